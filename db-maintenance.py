@@ -6,9 +6,11 @@
 #
 # A discord bot for performing various maintenance and
 # corrective actions on the LVE database
-# Usage: "python3 ./db-maintenance.py <flags>
+# Usage: "python3 ./db-maintenance.py [--migrate] [--check-indexes] [--rm-duplicates]"
 import sys
-import sqlite3
+import argparse
+import logging
+import stfc_db
 
 # MODIFIABLE PARAMTERS
 db_name = "LVE.db"
@@ -16,37 +18,45 @@ db_name = "LVE.db"
 # -----------------------------------------------------------------------------
 #                        DATABASE CONNECTION SCRIPT
 # -----------------------------------------------------------------------------
-def create_connection(db_file):
-    """ create a database connection to the SQLite database
-        specified by the db_file
-    :param db_file: database file
-    :return: Connection object or None
-    """
-    try:
-        conn = sqlite3.connect(db_file)
-        logging.info("connected to " + db_file);
-        return conn
-    except Error as e:
-        logging.error(e, exc_info=True)
- 
-    return None
-
-
-conn = create_connection(db_name)
+logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s: %(message)s')
+conn = stfc_db.create_connection(db_name)
 
+# rm_duplicates
+# aliases stored before names were lowercased can give one player two keys;
+# move the data of the mixed-case key onto the lowercase key and lowercase the
+# alias
 def rm_duplicates():
-	sql = '''SELECT (name, key) FROM alias WHERE name REGEXP "[A-Z]"'''
-    logging.debug("SQL: " + sql)
-    cur.execute(sql)
-    name_list = cur.fetchall()
-    for i in range(len(name_list)):
-    	sql = '''SELECT key FROM alias WHERE name="{}"'''.format(name_list[i][0])
-    	logging.debug("SQL: " + sql)
-    	cur.execute(sql)
-    	val_list = cur.fetchall()
-    	if val is not None:
-    		for k in range(len(val_list)):
-    			sql = '''UPDATE LVE SET PlayerKey="{}" WHERE name="{}" AND PlayerKey="{}"'''.format(val_list[k], name_list[i][0], name_list[i][1])
-    			logging.debug("SQL: " + sql)
-    			cur.execute(sql)
+    name_list = stfc_db.get_mixed_case_aliases(conn)
+    for name, old_key in name_list:
+        key = stfc_db.get_key(conn, name.lower())
+        if key is not None and key != old_key:
+            logging.info("merging key {} ({}) into key {}".format(old_key, name, key))
+            stfc_db.merge_keys(conn, key, old_key)
+        stfc_db.lowercase_alias(conn, name)
+    conn.commit()
+    logging.info("fixed {} mixed-case aliases".format(len(name_list)))
+
+# check_indexes
+# log the query plan of every query the bots run, and exit with an error if any
+# of them scans a table instead of using an index
+def check_indexes():
+    scans = stfc_db.check_query_plans(conn)
+    if len(scans) > 0:
+        sys.exit("{} queries scan a table instead of using an index".format(len(scans)))
 
+# ------------------------------------------------------------------------------
+#                                 MAIN SCRIPT
+# ------------------------------------------------------------------------------
+parser = argparse.ArgumentParser()
+parser.add_argument('--migrate', action='store_true', help='upgrade the database to the latest schema version')
+parser.add_argument('--check-indexes', action='store_true', help='check that every query uses an index')
+parser.add_argument('--rm-duplicates', action='store_true', help='merge player keys split by mixed-case aliases')
+args = parser.parse_args()
+if args.migrate:
+    logging.info("{} is at schema version {}".format(db_name, stfc_db.migrate(conn)))
+if args.check_indexes:
+    check_indexes()
+if args.rm_duplicates:
+    rm_duplicates()
+if not (args.migrate or args.check_indexes or args.rm_duplicates):
+    parser.print_help()
@@ -0,0 +1,953 @@
+#!/usr/bin/env python
+#
+# FILENAME: perf-test.py
+# CREATED:  October 18, 2026
+# AUTHOR:   buerge3
+#
+# A command-line script for measuring the performance of the screenshot and
+# database pipelines independent of discord.
+# Usage: "python ./perf-test.py --mask <image_file_path> [<image_file_path> ...]"
+#        "python ./perf-test.py --ocr <image_file_path> [...] --pool-size 4 --repeat 5"
+#        "python ./perf-test.py --load-test <image_file_path> [...] --uploads 20 --workers 2"
+#        "python ./perf-test.py --store --members 100 --repeat 5"
+#        "python ./perf-test.py --concurrency --members 500 --seconds 10"
+#        "python ./perf-test.py --ping-db --members 2000 --repeat 5"
+#        "python ./perf-test.py --roster --alliances 50 --members 100 --days 730 --repeat 20"
+#        "python ./perf-test.py --outbox --screenshots 10 --warnings 3 --rate-window 5"
+#        "python ./perf-test.py --names 5000 --lookups 100 [--misreads <file>]"
+#        "python ./perf-test.py --dictionary 5000"
+#        "python ./perf-test.py --guess --alliances 50 --members 100 --days 730 --repeat 20"
+#        "python ./perf-test.py --replay [<LVE.db>] --replay-days 30 --alliances 20 --members 100"
+
+from PIL import Image                            # PIL            - loads and preprocesses images
+import math                                      # math           - performs basic math operations such as min/max
+import os                                        # os             - builds file paths
+import sqlite3                                   # sqlite3        - opens the database the way the bots used to
+import multiprocessing                           # multiprocessing - runs the two bots' workloads side by side
+import tempfile                                  # tempfile       - holds the synthetic databases
+import random                                    # random         - generates synthetic roster data
+import datetime                                  # datetime       - dates of the synthetic roster entries
+import time                                      # time           - measures elapsed wall-clock time
+import argparse                                  # argparse       - process command line arguments
+import asyncio                                   # asyncio        - simulates the discord.py event loop
+from types import SimpleNamespace                # types          - stands in for a discord message and bot
+from concurrent.futures import ThreadPoolExecutor # concurrent     - simulates a burst of uploads
+import stfc_vision                               # stfc_vision    - shared screenshot masking and preprocessing
+import stfc_ocr                                  # stfc_ocr       - converts images to strings with Tesseract OCR
+import stfc_db                                   # stfc_db        - parameterized queries on the LVE database
+import stfc_discord                              # stfc_discord   - the bots' outbound message queue
+import stfc_names                                # stfc_names     - the OCR-aware player name index
+from aiohttp import web                          # aiohttp        - serves a fake discord API
+import aiohttp
+
+# MODIFIABLE PARAMTERS
+x_percent = 0.12
+mask_rgb = [200, 200, 200]
+
+# -----------------------------------------------------------------------------
+#                                    FUNCTIONS
+# -----------------------------------------------------------------------------
+# apply_img_mask_per_pixel
+# the original pixel-at-a-time implementation of apply_img_mask, kept only as a
+# baseline to benchmark against
+def apply_img_mask_per_pixel(im, rgb, x_percent):
+    pixdata = im.load()
+    width, height = im.size
+    x_cutoff = math.floor(width * x_percent)
+    for x in range(width):
+        for y in range(height):
+            r,g,b = im.getpixel((x,y))[:3]
+            if r < rgb[0] or g < rgb[1] or b < rgb[2] or x < x_cutoff:
+                pixdata[x,y] = (255, 255, 255);
+            else:
+                pixdata[x,y] = (0,0,0,0)
+
+# time_call
+# @param func, the function to time
+# @return the number of seconds it took to run func
+def time_call(func, *args):
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+# -----------------------------------------------------------------------------
+#                                BENCHMARKS
+# -----------------------------------------------------------------------------
+# bench_mask
+# time the per-pixel and vectorized masks on each screenshot, and confirm that
+# both produce the same image
+# @param ss, list of STFC screenshot paths
+def bench_mask(ss):
+    total_old = 0
+    total_new = 0
+    for img_path in ss:
+        im = Image.open(img_path).convert("RGB")
+        im_old = im.copy()
+        im_new = im.copy()
+        t_old = time_call(apply_img_mask_per_pixel, im_old, mask_rgb, x_percent)
+        t_new = time_call(stfc_vision.apply_img_mask, im_new, mask_rgb, x_percent)
+        same = im_old.tobytes() == im_new.tobytes()
+        total_old += t_old
+        total_new += t_new
+        print("{}: {}x{}, per-pixel {:.3f}s, vectorized {:.4f}s, identical={}".format(img_path, im.size[0], im.size[1], t_old, t_new, same))
+    if len(ss) > 0:
+        print("mean per screenshot: per-pixel {:.3f}s, vectorized {:.4f}s ({:.0f}x faster)".format(
+            total_old / len(ss), total_new / len(ss), total_old / max(total_new, 1e-9)))
+
+# read_screenshot
+# run every OCR call the bot makes for one screenshot
+# @param backend, the OCR backend to use
+# @param img_path, path to an STFC screenshot
+def read_screenshot(backend, img_path):
+    im = Image.open(img_path).convert("RGB")
+    rgb = stfc_vision.find_rgb_filter(im, backend.image_to_string)
+    if rgb is None:
+        rgb = mask_rgb
+    stfc_vision.apply_img_mask(im, rgb, x_percent)
+    stfc_vision.read_rows(stfc_vision.get_name_rows(im), lambda stitched: backend.image_to_data(stitched, psm=6))
+    width, height = im.size
+    backend.image_to_string(im.crop((math.floor(width/2), math.floor(height/10), width, height)))
+
+# bench_ocr
+# read a burst of screenshots, pool_size at a time, with the pytesseract backend
+# and with a pool of warm tesserocr engines
+# @param ss, list of STFC screenshot paths
+# @param pool_size, the number of engines / concurrent uploads
+# @param repeat, how many times each screenshot is uploaded in the burst
+def bench_ocr(ss, pool_size, repeat):
+    burst = ss * repeat
+    for use_pool in (False, True):
+        backend = stfc_ocr.create_backend(pool_size, use_pool)
+        if use_pool and backend.name != "tesserocr":
+            print("tesserocr is not installed; skipping the pool benchmark")
+            break
+        stfc_vision.device_filters.clear()
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=pool_size) as executor:
+            list(executor.map(lambda img_path: read_screenshot(backend, img_path), burst))
+        elapsed = time.perf_counter() - start
+        backend.close()
+        print("{}: {} screenshots in {:.2f}s ({:.3f}s per screenshot)".format(backend.name, len(burst), elapsed, elapsed / len(burst)))
+
+# percentile
+# @param values, a non-empty list of numbers
+# @param p, a percentile between 0 and 100
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+# measure_ping
+# simulate a user spamming !ping while uploads are processed: every interval,
+# record how late the event loop was to run the command
+# @param done, an asyncio.Event that is set when the uploads are finished
+# @return a list of latencies in seconds
+async def measure_ping(done, interval=0.02):
+    latencies = []
+    while not done.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        latencies.append(time.perf_counter() - start - interval)
+    return latencies
+
+# run_uploads
+# fire num_uploads simulated !alliance uploads at once, and measure !ping latency
+# @param read, a coroutine function that reads one screenshot
+async def run_uploads(read, ss, num_uploads):
+    done = asyncio.Event()
+    ping = asyncio.ensure_future(measure_ping(done))
+    start = time.perf_counter()
+    await asyncio.gather(*[read(ss[n % len(ss)]) for n in range(num_uploads)])
+    elapsed = time.perf_counter() - start
+    done.set()
+    return elapsed, await ping
+
+# load_test
+# compare reading screenshots on the event loop (as the bot used to) against
+# reading them in the ScreenshotWorkers process pool
+# @param ss, list of STFC screenshot paths
+# @param num_uploads, the number of simulated uploads
+# @param num_workers, the number of worker processes
+def load_test(ss, num_uploads, num_workers):
+    stfc_vision.init_worker(1)
+    ss = [open(img_path, "rb").read() for img_path in ss] # the bot reads downloads from memory
+    async def read_inline(img):
+        await asyncio.sleep(0)
+        return stfc_vision.read_screenshot(img, x_percent)
+    workers = stfc_vision.ScreenshotWorkers(num_workers, num_workers * 4)
+    workers.start()
+    for name, read in (("event loop", read_inline), ("{} workers".format(num_workers), lambda img: workers.read_screenshot(img, x_percent))):
+        elapsed, latencies = asyncio.run(run_uploads(read, ss, num_uploads))
+        print("{}: {} uploads in {:.2f}s; !ping latency p50 {:.1f}ms, p99 {:.1f}ms, max {:.1f}ms".format(name, num_uploads, elapsed,
+            percentile(latencies, 50) * 1000, percentile(latencies, 99) * 1000, max(latencies) * 1000))
+    workers.shutdown()
+
+# create_test_db
+# create an LVE database with num_members players, each with num_days of
+# history in one alliance
+# @param db_file, where to create the database; it must not exist yet
+# @return the connection and the names of the players
+def create_test_db(db_file, num_members, num_days, alliance="test"):
+    conn = stfc_db.create_connection(db_file)
+    stfc_db.migrate(conn)
+    today = datetime.date.today()
+    names = []
+    for key in range(num_members):
+        name = "player{}".format(key)
+        names.append(name)
+        conn.execute("INSERT INTO player (key) VALUES (?)", (key,))
+        conn.execute("INSERT INTO alias (key, name) VALUES (?, ?)", (key, name))
+        power = random.randint(100000, 5000000)
+        for day in range(num_days, 0, -1):
+            conn.execute("INSERT INTO LVE (PlayerKey, Date, Alliance, Lv, Power) VALUES (?, ?, ?, ?, ?)",
+                (key, str(today - datetime.timedelta(days=day)), alliance, 30, power))
+            power += random.randint(0, 20000)
+    conn.commit()
+    return conn, names
+
+# store_roster_formatted
+# the statements store_in_db used to run for every roster member, built with
+# str.format so that sqlite re-parses each one
+def store_roster_formatted(conn, names, date, alliance):
+    cur = conn.cursor()
+    for name in names:
+        cur.execute('''SELECT key FROM alias WHERE name="{}"'''.format(name))
+        key = cur.fetchone()[0]
+        cur.execute('''SELECT * FROM LVE WHERE PlayerKey={} AND Date="{}"'''.format(key, date))
+        cur.fetchone()
+        cur.execute('''SELECT Power FROM LVE WHERE PlayerKey="{}" ORDER BY Date DESC LIMIT 1;'''.format(key))
+        power = cur.fetchone()[0]
+        cur.execute('''INSERT INTO LVE (PlayerKey, Date, Alliance, Lv, Power) VALUES ("{}", "{}", "{}", "{}", "{}")'''.format(key, date, alliance, 30, power + 1000))
+    conn.commit()
+
+# store_roster_parameterized
+# the same statements through stfc_db
+def store_roster_parameterized(conn, names, date, alliance):
+    for name in names:
+        key = stfc_db.get_key(conn, name)
+        stfc_db.has_entry_on(conn, key, date)
+        power = stfc_db.get_latest_power(conn, key)
+        stfc_db.insert_lve(conn, key, date, alliance, 30, power + 1000)
+    conn.commit()
+
+# store_roster_batched
+# the queries of the batched store_in_db: one lookup each for the keys, the
+# players already entered today and their latest power, then one executemany
+def store_roster_batched(conn, names, date, alliance):
+    with stfc_db.transaction(conn):
+        keys = stfc_db.get_keys(conn, names)
+        entered = stfc_db.get_entered_on(conn, list(keys.values()), date)
+        powers = stfc_db.get_latest_powers(conn, list(keys.values()))
+        stfc_db.insert_lve_rows(conn, [(keys[name], date, alliance, 30, powers[keys[name]] + 1000) for name in names if keys[name] not in entered])
+        stfc_db.update_alliance_growth(conn, alliance, date)
+
+# bench_store
+# time the statements of one store_in_db call for a roster of num_members, with
+# string-formatted, parameterized and batched queries; every run is undone
+# @param num_members, the size of the roster
+# @param repeat, the number of runs to average over
+def bench_store(num_members, repeat):
+    tmp_dir = tempfile.TemporaryDirectory()
+    conn, names = create_test_db(os.path.join(tmp_dir.name, "LVE.db"), num_members, 60)
+    date = str(datetime.date.today())
+    for name, store in (("str.format", store_roster_formatted), ("parameterized", store_roster_parameterized), ("batched", store_roster_batched)):
+        total = 0
+        for n in range(repeat):
+            total += time_call(store, conn, names, date, "test")
+            conn.execute("DELETE FROM LVE WHERE Date=?", (date,))
+            conn.commit()
+        print("{}: {:.2f}ms per {}-member roster".format(name, total / repeat * 1000, num_members))
+    conn.close()
+    tmp_dir.cleanup()
+
+# LegacyConnection
+# one connection per process in rollback-journal mode, as the bots used to have
+class LegacyConnection:
+    def __init__(self, db_file):
+        self.conn = sqlite3.connect(db_file)
+
+    def query(self, func, *args):
+        return func(self.conn, *args)
+
+    def update(self, func, *args):
+        result = func(self.conn, *args)
+        self.conn.commit()
+        return result
+
+# store_roster
+# the reads and writes of one !alliance upload
+def store_roster(conn, names, date, alliance):
+    keys = stfc_db.get_keys(conn, names)
+    entered = stfc_db.get_entered_on(conn, list(keys.values()), date)
+    powers = stfc_db.get_latest_powers(conn, list(keys.values()))
+    stfc_db.insert_lve_rows(conn, [(keys[name], date, alliance, 30, powers[keys[name]] + 1000) for name in names if keys[name] not in entered])
+
+# vision_workload
+# upload a 100-member roster for one more day, over and over
+def vision_workload(db, names, deadline):
+    latencies = []
+    errors = 0
+    day = datetime.date.today()
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        try:
+            db.update(store_roster, names[:100], str(day), "test")
+        except sqlite3.OperationalError as err:
+            errors += 1
+        latencies.append(time.perf_counter() - start)
+        day += datetime.timedelta(days=1)
+    return latencies, errors
+
+# plotty_workload
+# run the queries of !roster and !missing, over and over
+def plotty_workload(db, names, deadline):
+    latencies = []
+    errors = 0
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        try:
+            db.query(stfc_db.get_roster, "test")
+            db.query(stfc_db.get_alliance_growth, "test")
+            db.query(stfc_db.get_missing_players, "test")
+        except sqlite3.OperationalError as err:
+            errors += 1
+        latencies.append(time.perf_counter() - start)
+    return latencies, errors
+
+# run_workload
+# run one workload in a child process and send its results back
+def run_workload(workload, legacy, db_file, names, deadline, results):
+    db = LegacyConnection(db_file) if legacy else stfc_db.Database(db_file, 2)
+    results.put((workload.__name__, workload(db, names, deadline)))
+
+# concurrency_test
+# run the vision-bot and plotty-bot workloads in two processes against one
+# database file, first with the old rollback-journal connections and then with
+# stfc_db.Database, and report the latency and the "database is locked" errors
+# of each side
+# @param num_members, the number of players in the synthetic alliance
+# @param seconds, how long to run each configuration
+def concurrency_test(num_members, seconds):
+    context = multiprocessing.get_context("fork")
+    for legacy in (True, False):
+        tmp_dir = tempfile.TemporaryDirectory()
+        db_file = os.path.join(tmp_dir.name, "LVE.db")
+        conn, names = create_test_db(db_file, num_members, 60)
+        if legacy:
+            conn.execute("PRAGMA journal_mode=DELETE")
+        conn.close()
+        results = context.Queue()
+        deadline = time.perf_counter() + seconds
+        procs = [context.Process(target=run_workload, args=(workload, legacy, db_file, names, deadline, results))
+            for workload in (vision_workload, plotty_workload)]
+        for proc in procs:
+            proc.start()
+        outcome = dict(results.get() for proc in procs)
+        for proc in procs:
+            proc.join()
+        print("rollback journal, one connection per bot:" if legacy else "WAL, read pool and single writer:")
+        for name, (latencies, errors) in sorted(outcome.items()):
+            print("    {}: {} runs, p50 {:.1f}ms, p99 {:.1f}ms, max {:.1f}ms, {} locked errors".format(name, len(latencies),
+                percentile(latencies, 50) * 1000, percentile(latencies, 99) * 1000, max(latencies) * 1000, errors))
+        tmp_dir.cleanup()
+
+# create_history_db
+# build a synthetic database of num_alliances alliances of num_members players
+# with one entry per player per day; the entries are inserted before the
+# migrations that add triggers on LVE, which then build their tables in bulk
+def create_history_db(db_file, num_alliances, num_members, num_days):
+    conn = stfc_db.create_connection(db_file)
+    stfc_db.migrate(conn, 3)
+    today = datetime.date.today()
+    dates = [str(today - datetime.timedelta(days=day)) for day in range(num_days, -1, -1)]
+    with stfc_db.transaction(conn):
+        for a in range(num_alliances):
+            alliance = "alliance{}".format(a)
+            for m in range(num_members):
+                key = a * num_members + m
+                conn.execute("INSERT INTO player (key) VALUES (?)", (key,))
+                conn.execute("INSERT INTO alias (key, name) VALUES (?, ?)", (key, "player{}".format(key)))
+                lv = random.randint(10, 50)
+                power = random.randint(100000, 5000000)
+                rows = []
+                for date in dates:
+                    rows.append((key, date, alliance, lv, power))
+                    power += random.choice((0, 0, random.randint(0, 50000)))
+                conn.executemany("INSERT INTO LVE (PlayerKey, Date, Alliance, Lv, Power) VALUES (?, ?, ?, ?, ?)", rows)
+    stfc_db.migrate(conn)
+    return conn
+
+# roster_per_player
+# the queries !roster used to run: the roster keys, then for every player the
+# last different power, their name and their last 8 days of history
+def roster_per_player(conn, alliance):
+    since = datetime.datetime.now() - datetime.timedelta(days=8)
+    for key in stfc_db.get_roster_keys(conn, alliance):
+        stfc_db.get_last_different_power(conn, key)
+        stfc_db.get_player_name(conn, key)
+        stfc_db.get_history_since(conn, key, since)
+
+# roster_windowed
+# the whole roster in one query, with the weekly growth worked out by window
+# functions over the last 8 days of LVE instead of read from the growth table
+def roster_windowed(conn, alliance):
+    sql = '''
+        SELECT IFNULL(
+                (SELECT name FROM display D WHERE D.key=L.PlayerKey ORDER BY D.ROWID DESC LIMIT 1),
+                (SELECT name FROM alias A WHERE A.key=L.PlayerKey ORDER BY A.ROWID DESC LIMIT 1)) AS Name,
+            W.Lv, W.Power, W.Entries, (W.Power - W.StartPower) * 7.0 / W.Entries, L.PrevDate
+        FROM [latest] L
+        INNER JOIN
+        (
+            SELECT PlayerKey, Lv, Power,
+                ROW_NUMBER() OVER (PARTITION BY PlayerKey ORDER BY Date DESC) AS Row,
+                COUNT(*) OVER (PARTITION BY PlayerKey) AS Entries,
+                FIRST_VALUE(Power) OVER (PARTITION BY PlayerKey ORDER BY Date ASC) AS StartPower
+            FROM [LVE]
+            WHERE Alliance = ?1 AND Date > date('now', '-8 days')
+        ) W ON W.PlayerKey = L.PlayerKey AND W.Row = 1
+        WHERE L.Alliance = ?1 AND L.Date > date('now', '-2 days')
+        ORDER BY L.Power DESC
+        '''
+    stfc_db.execute(conn, sql, (alliance,)).fetchall()
+
+# roster_set_based
+# the queries !roster runs now
+def roster_set_based(conn, alliance):
+    stfc_db.get_roster(conn, alliance)
+    stfc_db.get_alliance_growth(conn, alliance)
+
+# bench_roster
+# time !roster on a synthetic database with per-player queries, with window
+# functions over LVE and with the growth tables
+# @param num_alliances, the number of alliances in the database
+# @param num_members, the number of players in each alliance
+# @param num_days, the length of the history of every player
+# @param repeat, the number of rosters to average over
+def bench_roster(num_alliances, num_members, num_days, repeat):
+    tmp_dir = tempfile.TemporaryDirectory()
+    start = time.perf_counter()
+    conn = create_history_db(os.path.join(tmp_dir.name, "LVE.db"), num_alliances, num_members, num_days)
+    print("built {} alliances x {} players x {} days in {:.1f}s".format(num_alliances, num_members, num_days, time.perf_counter() - start))
+    alliances = ["alliance{}".format(random.randrange(num_alliances)) for n in range(repeat)]
+    for name, roster in (("per player", roster_per_player), ("window functions", roster_windowed), ("set-based", roster_set_based)):
+        stfc_db.query_log = []
+        total = sum(time_call(roster, conn, alliance) for alliance in alliances)
+        num_queries = len(stfc_db.query_log)
+        stfc_db.query_log = None
+        print("{}: {:.2f}ms and {} queries per {}-member roster".format(name, total / repeat * 1000, num_queries // repeat, num_members))
+    conn.close()
+    tmp_dir.cleanup()
+
+# guess_self_join
+# the query !guess used to run, parameterized but otherwise unchanged: the
+# backlog entry joined with every LVE entry of its alliance in the week before
+# it, with the latest entry of every player grouped out of the whole LVE table,
+# and with the whole alias and display tables, sorted by the distance in level
+# and power
+def guess_self_join(conn, name, limit):
+    sql = '''
+        SELECT Name, Lv, Power, Date FROM
+        (
+            SELECT IFNULL(E.Name, D.Name) AS Name, C.Date, C.Lv, C.Power, IFNULL (A.Power - B.Power, 0) AS Diff, IFNULL (A.Lv - B.Lv, 0) AS Lv_diff
+            FROM [backlog] A
+                INNER JOIN [LVE] C
+                    ON A.Alliance = C.Alliance
+                    AND julianday(C.Date) < julianday(A.Date)
+                    AND julianday(C.Date, '+7 days') > julianday(A.date)
+                INNER JOIN
+                (
+                    SELECT PlayerKey, MAX(Date) maxDate, Power, Lv
+                    FROM [LVE]
+                    GROUP BY PlayerKey
+                ) B ON C.PlayerKey = B.PlayerKey AND
+                    C.Date = B.maxDate
+            INNER JOIN
+            (
+                SELECT Name, key
+                FROM [alias]
+                GROUP BY key
+            ) D ON C.PlayerKey = D.Key
+            INNER JOIN
+            (
+                SELECT Name, key
+                FROM [display]
+                GROUP BY key
+            ) E ON C.PlayerKey = E.Key
+
+            WHERE A.Name = ?
+
+            ORDER BY ABS(Lv_diff), ABS(Diff) ASC
+        )
+        LIMIT ?
+        '''
+    return stfc_db.execute(conn, sql, (name.lower(), limit)).fetchall()
+
+# bench_guess
+# time !guess on a synthetic history with the self-join over LVE it used to run
+# and with the nearest-neighbour lookup, and check that both order the guesses
+# the same way
+# @param num_alliances, the number of alliances in the database
+# @param num_members, the number of players in each alliance
+# @param num_days, the length of the history of every player
+# @param repeat, the number of backlog entries to guess
+# @param limit, the number of guesses per entry
+def bench_guess(num_alliances, num_members, num_days, repeat, limit):
+    tmp_dir = tempfile.TemporaryDirectory()
+    start = time.perf_counter()
+    conn = create_history_db(os.path.join(tmp_dir.name, "LVE.db"), num_alliances, num_members, num_days)
+    print("built {} alliances x {} players x {} days in {:.1f}s".format(num_alliances, num_members, num_days, time.perf_counter() - start))
+    # the self-join only finds players with a display name
+    tomorrow = str(datetime.date.today() + datetime.timedelta(days=1))
+    entries = {}
+    with stfc_db.transaction(conn):
+        conn.execute("INSERT INTO display (key, name) SELECT key, name FROM alias")
+        for n, (key, alliance, lv, power) in enumerate(random.sample(conn.execute("SELECT PlayerKey, Alliance, Lv, Power FROM latest").fetchall(), repeat)):
+            entry = ("backlog{}".format(n), tomorrow, alliance, lv + random.randint(-1, 1), power + random.randint(-100000, 100000))
+            conn.execute("INSERT INTO backlog (Name, Date, Alliance, Lv, Power) VALUES (?, ?, ?, ?, ?)", entry)
+            entries[entry[0]] = entry
+    results = {}
+    for label, guess in (("self-join", guess_self_join), ("nearest-neighbour", stfc_db.guess_players)):
+        latencies = []
+        results[label] = []
+        for name in entries:
+            begin = time.perf_counter()
+            results[label].append(guess(conn, name, limit))
+            latencies.append(time.perf_counter() - begin)
+        print("{}: p50 {:.2f}ms, p99 {:.2f}ms per guess".format(label, percentile(latencies, 50) * 1000, percentile(latencies, 99) * 1000))
+    same = 0
+    for name, old, new in zip(entries, results["self-join"], results["nearest-neighbour"]):
+        lv, power = entries[name][3:]
+        same += [(abs(lv - row[1]), abs(power - row[2])) for row in old] == [(abs(lv - row[1]), abs(power - row[2])) for row in new]
+    print("same order for {}/{} backlog entries".format(same, len(entries)))
+    conn.close()
+    tmp_dir.cleanup()
+
+# run_heavy_queries
+# run the !missing query repeat times in a row while measuring !ping latency
+# @param query, a coroutine function that runs one data-access function
+async def run_heavy_queries(query, repeat):
+    done = asyncio.Event()
+    ping = asyncio.ensure_future(measure_ping(done))
+    start = time.perf_counter()
+    for n in range(repeat):
+        await query(stfc_db.get_missing_players, "test")
+    elapsed = time.perf_counter() - start
+    done.set()
+    return elapsed, await ping
+
+# ping_db_test
+# compare running a heavy query on the event loop (as the bots used to) against
+# awaiting it on the Database's reader threads
+# @param num_members, the number of players in the synthetic alliance
+# @param repeat, the number of heavy queries to run
+def ping_db_test(num_members, repeat):
+    tmp_dir = tempfile.TemporaryDirectory()
+    conn, names = create_test_db(os.path.join(tmp_dir.name, "LVE.db"), num_members, 60)
+    conn.close()
+    db = stfc_db.Database(os.path.join(tmp_dir.name, "LVE.db"), 2)
+    async def query_inline(func, *args):
+        await asyncio.sleep(0)
+        return db.query(func, *args)
+    for name, query in (("on the event loop", query_inline), ("run_query", db.run_query)):
+        elapsed, latencies = asyncio.run(run_heavy_queries(query, repeat))
+        print("{}: {} queries in {:.2f}s; !ping latency p50 {:.1f}ms, p99 {:.1f}ms, max {:.1f}ms".format(name, repeat, elapsed,
+            percentile(latencies, 50) * 1000, percentile(latencies, 99) * 1000, max(latencies) * 1000))
+    db.close()
+    tmp_dir.cleanup()
+
+# FakeDiscord
+# a local HTTP endpoint that accepts POST /channels/<id>/messages like discord,
+# answering 429 with a retry_after once a channel has had rate messages in the
+# last per seconds
+class FakeDiscord:
+    def __init__(self, rate, per):
+        self.rate = rate
+        self.per = per
+        self.sent = {}
+        self.requests = 0
+        self.rate_limited = 0
+        self.messages = []
+
+    async def post_message(self, request):
+        self.requests += 1
+        channel = request.match_info["channel"]
+        now = time.perf_counter()
+        sent = [t for t in self.sent.get(channel, []) if t > now - self.per]
+        if len(sent) >= self.rate:
+            self.rate_limited += 1
+            return web.json_response({"retry_after": sent[0] + self.per - now}, status=429)
+        sent.append(now)
+        self.sent[channel] = sent
+        self.messages.append(((await request.json())["content"], now))
+        return web.json_response({"id": len(self.messages)})
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post("/channels/{channel}/messages", self.post_message)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        return "http://127.0.0.1:{}".format(self.runner.addresses[0][1])
+
+# FakeContext
+# a stfc_discord.Context in a fake channel whose messages are sent by send, so
+# the outbox test goes through the same post/send path as a command
+class FakeContext(stfc_discord.Context):
+    def __init__(self, outbox, send):
+        super().__init__(message=SimpleNamespace(channel=SimpleNamespace(id=1), _state=None),
+            bot=SimpleNamespace(get_outbox=lambda channel: outbox), view=None)
+        self.send_message = send
+
+    async def send_now(self, *args, **kwargs):
+        self.api_calls += 1
+        return await self.send_message(*args, **kwargs)
+
+# simulate_upload
+# send what !alliance sends for an upload of num_screenshots screenshots: a
+# line and num_warnings warnings per screenshot, then the summary
+# @param send_line, a coroutine function that sends or queues a line
+# @param send_summary, a coroutine function that sends the summary
+# @return the number of seconds until the summary was sent
+async def simulate_upload(send_line, send_summary, num_screenshots, num_warnings):
+    start = time.perf_counter()
+    for i in range(num_screenshots):
+        await asyncio.sleep(0.02)
+        await send_line("Processing screenshot #{}:".format(i + 1))
+        for n in range(num_warnings):
+            await send_line("**[WARNING]** Unrecognized player name player{}".format(i * 7 + n))
+    await send_summary("Done.")
+    return time.perf_counter() - start
+
+# outbox_test
+# run a simulated upload against a fake discord endpoint, sending every line
+# as soon as it is produced (as the bots used to, retrying on 429) and through
+# stfc_discord.Outbox, and report the requests, 429s and how long it took;
+# then check the order in which the outbox sends a summary
+# @param num_screenshots, the number of screenshots in the upload
+# @param num_warnings, the number of warnings per screenshot
+# @param per, the length in seconds of the fake rate limit window of 5 messages
+def outbox_test(num_screenshots, num_warnings, per):
+    async def run(queued):
+        fake = FakeDiscord(5, per)
+        url = await fake.start() + "/channels/1/messages"
+        async with aiohttp.ClientSession() as session:
+            async def send(content):
+                while True:
+                    async with session.post(url, json={"content": content}) as resp:
+                        if resp.status != 429:
+                            return await resp.json()
+                        await asyncio.sleep((await resp.json())["retry_after"])
+            if queued:
+                outbox = stfc_discord.Outbox(5, per)
+                ctx = FakeContext(outbox, send)
+                async def send_line(line):
+                    ctx.post(line)
+                async def send_summary(content):
+                    await ctx.send(content, priority=True)
+            else:
+                send_line = send_summary = send
+            elapsed = await simulate_upload(send_line, send_summary, num_screenshots, num_warnings)
+            if queued:
+                await ctx.flush()
+        await fake.runner.cleanup()
+        return fake, elapsed
+    for name, queued in (("send every line", False), ("outbox", True)):
+        start = time.perf_counter()
+        fake, elapsed = asyncio.run(run(queued))
+        print("{}: {} messages, {} requests, {} rate limited; summary after {:.2f}s, everything sent after {:.2f}s".format(name,
+            len(fake.messages), fake.requests, fake.rate_limited, elapsed, time.perf_counter() - start))
+    check_summary_order(num_screenshots, num_warnings)
+
+# check_summary_order
+# run a simulated upload through an outbox while another command is queueing
+# lines in the same channel, and check that the upload's summary is sent after
+# the upload's own lines but ahead of the other command's
+# @param num_screenshots, the number of screenshots in the upload
+# @param num_warnings, the number of warnings per screenshot
+def check_summary_order(num_screenshots, num_warnings):
+    async def run():
+        contents = []
+        async def send(content):
+            await asyncio.sleep(0.001)
+            contents.append(content)
+        outbox = stfc_discord.Outbox(5, 0.05)
+        ctx = FakeContext(outbox, send)
+        other = FakeContext(outbox, send)
+        async def send_line(line):
+            ctx.post(line)
+            other.post("other command's line")
+        async def send_summary(content):
+            other.post("other command's line")
+            other.post("other command's line", code_block=True)
+            await ctx.send(content, priority=True)
+        await simulate_upload(send_line, send_summary, num_screenshots, num_warnings)
+        await other.flush()
+        return contents
+    contents = asyncio.run(run())
+    summary = contents.index("Done.")
+    assert "Processing screenshot #{}:".format(num_screenshots) in "\n".join(contents[:summary]), "the summary was sent before the upload's lines"
+    assert any("other command's line" in content for content in contents[summary + 1:]), "the summary waited for another command's lines"
+    print("outbox: the summary was sent after the upload's lines and ahead of another command's")
+
+# random_name
+# @return a synthetic gamer tag, e.g. "Kill3r_mira"
+def random_name():
+    syllables = ["ka", "mor", "lin", "ta", "rex", "vol", "mi", "on", "dar", "ill", "sto", "wen", "qua", "zor", "bel"]
+    name = "".join(random.choice(syllables) for n in range(random.randint(2, 4)))
+    if random.random() < 0.4:
+        name = name.capitalize() + "_" + random.choice(syllables)
+    if random.random() < 0.4:
+        name += str(random.randint(0, 999))
+    return name
+
+# misread
+# @return name with one or two of the mistakes Tesseract makes
+def misread(name):
+    swaps = [("l", "1"), ("i", "l"), ("I", "l"), ("o", "0"), ("O", "0"), ("m", "rn"), ("w", "vv"), ("s", "5")]
+    for n in range(random.randint(1, 2)):
+        found = [(a, b) for a, b in swaps if a in name]
+        if found and random.random() < 0.8:
+            a, b = random.choice(found)
+            k = random.choice([k for k in range(len(name)) if name.startswith(a, k)])
+            name = name[:k] + b + name[k + len(a):]
+        else:
+            k = random.randrange(len(name))
+            name = name[:k] + name[k + 1:]
+    return name
+
+# load_misreads
+# @param path, a file with one "<misread> <correct name>" pair per line
+# @return a list of (misread, correct name)
+def load_misreads(path):
+    pairs = []
+    with open(path, encoding="utf-8") as file:
+        for line in file:
+            words = line.split()
+            if len(words) == 2:
+                pairs.append((words[0], words[1]))
+    return pairs
+
+# bench_names
+# time correcting misread names with pyspellchecker and with stfc_names, and
+# with stfc_names looking in the misread player's alliance first
+# @param num_names, the number of known names
+# @param num_lookups, the number of misreads to correct
+# @param misreads_file, a file of recorded misreads, or None to make them up
+# @param alliance_size, the number of players per alliance
+def bench_names(num_names, num_lookups, misreads_file, alliance_size):
+    from spellchecker import SpellChecker
+    names = set()
+    while len(names) < num_names:
+        names.add(random_name())
+    names = list(names)
+    if misreads_file is not None:
+        pairs = load_misreads(misreads_file)
+        names += [correct for misread, correct in pairs]
+    else:
+        pairs = [(misread(name), name) for name in random.sample(names, num_lookups)]
+    spell = SpellChecker(language=None, case_sensitive=False)
+    index = stfc_names.NameIndex()
+    for label, checker, load in (("pyspellchecker", spell, spell.word_frequency.load_words), ("stfc_names", index, index.load_words)):
+        elapsed = time_call(load, names)
+        correct = 0
+        latencies = []
+        for word, name in pairs:
+            start = time.perf_counter()
+            cor = checker.correction(word)
+            latencies.append(time.perf_counter() - start)
+            correct += cor is not None and cor.lower() == name.lower()
+        print("{}: loaded {} names in {:.0f}ms; {}/{} corrected, p50 {:.0f}us, p99 {:.0f}us per name".format(label, len(names), elapsed * 1000,
+            correct, len(pairs), percentile(latencies, 50) * 1e6, percentile(latencies, 99) * 1e6))
+    if misreads_file is not None:
+        return
+    alliances = {}
+    for n, name in enumerate(names):
+        alliances.setdefault(n // alliance_size, stfc_names.NameIndex()).add(name)
+    alliance_of = {name: n // alliance_size for n, name in enumerate(names)}
+    correct = 0
+    latencies = []
+    tier_stats = {}
+    for word, name in pairs:
+        start = time.perf_counter()
+        cor, tier, corrected = stfc_names.resolve(word, [("alliance", alliances[alliance_of[name]]), ("global", index)])
+        latencies.append(time.perf_counter() - start)
+        correct += cor is not None and cor.lower() == name.lower()
+        tier_stats[tier] = tier_stats.get(tier, 0) + 1
+    print("stfc_names, alliance of {} first: {}/{} corrected, p50 {:.0f}us, p99 {:.0f}us per name; {}".format(alliance_size, correct, len(pairs),
+        percentile(latencies, 50) * 1e6, percentile(latencies, 99) * 1e6, ", ".join("{} {}".format(tier, count) for tier, count in sorted(tier_stats.items(), key=str))))
+
+# bench_dictionary
+# time building the name dictionary at startup: from a flat file with
+# pyspellchecker as vision-bot used to, and from the alias table with and
+# without a snapshot; then check that a name added with !add survives both
+# @param num_names, the number of names in the alias table
+def bench_dictionary(num_names):
+    from spellchecker import SpellChecker
+    tmp_dir = tempfile.TemporaryDirectory()
+    dict_file = os.path.join(tmp_dir.name, "STFC_dict.txt")
+    snapshot_file = os.path.join(tmp_dir.name, "names.snapshot")
+    conn = stfc_db.create_connection(os.path.join(tmp_dir.name, "LVE.db"))
+    stfc_db.migrate(conn)
+    names = set()
+    while len(names) < num_names:
+        names.add(random_name())
+    names = list(names)
+    with stfc_db.transaction(conn):
+        conn.executemany("INSERT INTO alias (key, name) VALUES (?, ?)", [(key, name.lower()) for key, name in enumerate(names)])
+        conn.execute("INSERT INTO display (key, name) SELECT key, name FROM alias")
+    with open(dict_file, "w", encoding="utf-8") as file:
+        file.write("\n".join(names) + "\n")
+    spell = SpellChecker(language=None, case_sensitive=False)
+    print("pyspellchecker from STFC_dict.txt: {:.0f}ms".format(time_call(spell.word_frequency.load_text_file, dict_file) * 1000))
+    print("alias table, no snapshot: {:.0f}ms".format(time_call(stfc_names.load_alias_index, conn, snapshot_file) * 1000))
+    print("alias table, snapshot: {:.0f}ms".format(time_call(stfc_names.load_alias_index, conn, snapshot_file) * 1000))
+    with stfc_db.transaction(conn):
+        conn.executemany("INSERT INTO alias (key, name) VALUES (?, ?)", [(num_names + n, random_name().lower()) for n in range(100)])
+        conn.execute("INSERT INTO display (key, name) SELECT key, name FROM alias WHERE key>=?", (num_names,))
+    print("alias table, snapshot and 100 new names: {:.0f}ms".format(time_call(stfc_names.load_alias_index, conn, snapshot_file) * 1000))
+    print("snapshot size: {}KB".format(os.path.getsize(snapshot_file) // 1024))
+    # a name added with !add has no LVE entry or display name yet, but must
+    # still be known when the index is loaded again or rebuilt
+    added = random_name().lower()
+    with stfc_db.transaction(conn):
+        stfc_db.add_known_name(conn, added)
+    assert added in stfc_names.load_alias_index(conn, snapshot_file).names, "an added name is missing from the snapshot"
+    os.remove(snapshot_file)
+    assert added in stfc_names.load_alias_index(conn, snapshot_file).names, "an added name is missing after a rebuild"
+    print("a name added by hand is still known after reloading and rebuilding the index")
+    conn.close()
+    tmp_dir.cleanup()
+
+# replay_uploads
+# replay every upload of the last num_days days of a database through the name
+# resolution of vision-bot: each roster is cut into screenshots of 7 rows in
+# power order and its names misread, then resolved with and without matching
+# the rows left over to the previous roster, counting the rows that would go to
+# the backlog
+# @param db_file, an LVE database, or None for a synthetic history
+# @param num_alliances, num_members, the size of the synthetic history
+# @param num_days, the number of days to replay
+# @param misread_rate, the fraction of names read with a few OCR mistakes
+# @param unreadable_rate, the fraction of names read beyond repair
+def replay_uploads(db_file, num_alliances, num_members, num_days, misread_rate, unreadable_rate):
+    tmp_dir = None
+    if db_file is None:
+        tmp_dir = tempfile.TemporaryDirectory()
+        conn = create_history_db(os.path.join(tmp_dir.name, "LVE.db"), num_alliances, num_members, num_days)
+        names = set()
+        while len(names) < num_alliances * num_members:
+            names.add(random_name().lower())
+        with stfc_db.transaction(conn):
+            conn.executemany("UPDATE alias SET name=? WHERE key=?", [(name, key) for key, name in enumerate(names)])
+    else:
+        conn = stfc_db.create_connection(db_file, read_only=True)
+    global_index = stfc_names.NameIndex()
+    global_index.load_words(row[0] for row in conn.execute("SELECT name FROM alias"))
+    first = str(datetime.date.today() - datetime.timedelta(days=num_days - 1))
+    uploads = conn.execute("SELECT DISTINCT Alliance, Date FROM LVE WHERE Date>=? ORDER BY Date, Alliance", (first,)).fetchall()
+    counts = {"rows": 0, "unrecognized": 0, "wrong": 0, "roster": 0, "roster wrong": 0}
+    latencies = []
+    for alliance, date in uploads:
+        since = str(datetime.date.fromisoformat(date) - datetime.timedelta(days=14))
+        alliance_index = stfc_names.NameIndex()
+        alliance_index.load_words(stfc_db.get_alliance_names(conn, alliance, since))
+        tiers = [("alliance", alliance_index), ("global", global_index)]
+        roster = stfc_names.load_previous_roster(conn, alliance, date)
+        used = set()
+        players = conn.execute("SELECT PlayerKey, Lv, Power FROM LVE WHERE Alliance=? AND Date=? ORDER BY Power DESC", (alliance, date)).fetchall()
+        names = dict(stfc_db.get_names_of_keys(conn, [row[0] for row in players]))
+        for start in range(0, len(players), 7):
+            screenshot = [(key, names[key].lower(), lv, power) for key, lv, power in players[start:start + 7] if key in names]
+            rows = []
+            for key, name, lv, power in screenshot:
+                roll = random.random()
+                if roll < unreadable_rate:
+                    name = "".join(random.choice("~#%&@$") for n in range(len(name)))
+                elif roll < unreadable_rate + misread_rate:
+                    name = misread(name)
+                rows.append((name, lv, power))
+            begin = time.perf_counter()
+            resolved = stfc_names.resolve_rows(rows, tiers, roster, used)
+            latencies.append(time.perf_counter() - begin)
+            for (key, name, lv, power), (cor, tier, corrected) in zip(screenshot, resolved):
+                counts["rows"] += 1
+                if cor is None:
+                    counts["unrecognized"] += 1
+                elif tier == "roster":
+                    counts["roster"] += 1
+                    counts["roster wrong"] += stfc_db.get_key(conn, cor) != key
+                else:
+                    counts["wrong"] += stfc_db.get_key(conn, cor) != key
+    conn.close()
+    if tmp_dir is not None:
+        tmp_dir.cleanup()
+    rows = max(counts["rows"], 1)
+    print("replayed {} uploads, {} rows; p50 {:.2f}ms, p99 {:.2f}ms per screenshot".format(len(uploads), counts["rows"],
+        percentile(latencies, 50) * 1000, percentile(latencies, 99) * 1000))
+    print("names only: {} to the backlog ({:.1%}), {} resolved to the wrong player".format(counts["unrecognized"] + counts["roster"],
+        (counts["unrecognized"] + counts["roster"]) / rows, counts["wrong"]))
+    print("names and roster position: {} to the backlog ({:.1%}), {} matched by position of which {} to the wrong player".format(
+        counts["unrecognized"], counts["unrecognized"] / rows, counts["roster"], counts["roster wrong"]))
+
+# ------------------------------------------------------------------------------
+#                                 MAIN SCRIPT
+# ------------------------------------------------------------------------------
+parser = argparse.ArgumentParser()
+parser.add_argument('--mask', nargs='+', help='time apply_img_mask on the given screenshots')
+parser.add_argument('--ocr', nargs='+', help='time the OCR backends on a burst of the given screenshots')
+parser.add_argument('--pool-size', type=int, default=2)
+parser.add_argument('--repeat', type=int, default=5)
+parser.add_argument('--load-test', nargs='+', help='fire simulated uploads of the given screenshots and measure !ping latency')
+parser.add_argument('--uploads', type=int, default=20)
+parser.add_argument('--workers', type=int, default=2)
+parser.add_argument('--store', action='store_true', help='time the queries of store_in_db on a synthetic roster')
+parser.add_argument('--members', type=int, default=100)
+parser.add_argument('--concurrency', action='store_true', help='run both bots\' database workloads against one file')
+parser.add_argument('--seconds', type=int, default=10)
+parser.add_argument('--ping-db', action='store_true', help='measure !ping latency while a heavy query runs')
+parser.add_argument('--roster', action='store_true', help='time the queries of !roster on a synthetic history')
+parser.add_argument('--alliances', type=int, default=50)
+parser.add_argument('--days', type=int, default=730)
+parser.add_argument('--guess', action='store_true', help='time the queries of !guess on a synthetic history')
+parser.add_argument('--limit', type=int, default=3)
+parser.add_argument('--outbox', action='store_true', help='send a simulated upload\'s messages to a fake discord endpoint')
+parser.add_argument('--screenshots', type=int, default=10)
+parser.add_argument('--warnings', type=int, default=3)
+parser.add_argument('--rate-window', type=float, default=5.0)
+parser.add_argument('--names', type=int, help='time correcting misread names against a dictionary of this many names')
+parser.add_argument('--lookups', type=int, default=100)
+parser.add_argument('--misreads', help='a file of "<misread> <correct name>" lines to use instead of made-up misreads')
+parser.add_argument('--alliance-size', type=int, default=100)
+parser.add_argument('--dictionary', type=int, help='time loading a dictionary of this many names at startup')
+parser.add_argument('--replay', nargs='?', const='', help='replay the uploads of a database, or of a synthetic history if no file is given, and count the names that go to the backlog')
+parser.add_argument('--replay-days', type=int, default=30)
+parser.add_argument('--misread-rate', type=float, default=0.2)
+parser.add_argument('--unreadable-rate', type=float, default=0.05)
+args = parser.parse_args()
+if args.mask is not None:
+    bench_mask(args.mask)
+elif args.ocr is not None:
+    bench_ocr(args.ocr, args.pool_size, args.repeat)
+elif args.load_test is not None:
+    load_test(args.load_test, args.uploads, args.workers)
+elif args.store:
+    bench_store(args.members, args.repeat)
+elif args.concurrency:
+    concurrency_test(args.members, args.seconds)
+elif args.ping_db:
+    ping_db_test(args.members, args.repeat)
+elif args.roster:
+    bench_roster(args.alliances, args.members, args.days, args.repeat)
+elif args.guess:
+    bench_guess(args.alliances, args.members, args.days, args.repeat, args.limit)
+elif args.outbox:
+    outbox_test(args.screenshots, args.warnings, args.rate_window)
+elif args.names is not None:
+    bench_names(args.names, args.lookups, args.misreads, args.alliance_size)
+elif args.dictionary is not None:
+    bench_dictionary(args.dictionary)
+elif args.replay is not None:
+    replay_uploads(args.replay or None, args.alliances, args.members, args.replay_days, args.misread_rate, args.unreadable_rate)
+else:
+    parser.print_help()
@@ -11,8 +11,8 @@ from discord.ext import commands
 from discord import Status
 #from discord.ext.commands import Bot
 
-import sqlite3
-from sqlite3 import Error
+import stfc_db
+import stfc_discord
 
 import logging
 
@@ -29,29 +29,14 @@ from matplotlib import style
 db_name = "LVE.db"
 token_file = "secret_plotty.txt"
 img_save_name = "latest-plotty.png"
+db_read_pool_size = 4
 BOT_PREFIX = ("!","?")
-bot = commands.Bot(command_prefix=BOT_PREFIX)
+bot = stfc_discord.Bot(command_prefix=BOT_PREFIX)
 
 # -----------------------------------------------------------------------------
 #                        DATABASE CONNECTION SCRIPT
 # -----------------------------------------------------------------------------
-def create_connection(db_file):
-    """ create a database connection to the SQLite database
-        specified by the db_file
-    :param db_file: database file
-    :return: Connection object or None
-    """
-    try:
-        conn = sqlite3.connect(db_file)
-        logging.info("connected to " + db_file);
-        return conn
-    except Error as e:
-        logging.error(e, exc_info=True)
- 
-    return None
-
-
-conn = create_connection(db_name)
+DB = stfc_db.Database(db_name, db_read_pool_size)
 
 
 # -----------------------------------------------------------------------------
@@ -81,56 +66,37 @@ def init_logger():
 # -----------------------------------------------------------------------------
 @bot.command(brief="Plot the growth of a player", description="Plot the growth of a single player. To compare the growth of different players, use the \"players\" command", aliases=["plot", "plot-one"])
 async def player(ctx, ppl : str):
-    cur = conn.cursor()
-
-    sql = '''SELECT key FROM alias WHERE name="{}"'''.format(ppl.lower())
-    logging.debug("SQL: " + sql)
-    cur.execute(sql)
-    res = cur.fetchone()
-    key = -1
-    if res is None or len(res) == 0:
+    key = await DB.run_query(stfc_db.get_key, ppl.lower())
+    if key is None:
         msg = "**[WARNING]** The player " + ppl + " does not exist. Please check your spelling and try again."
         logging.warning(msg)
         await ctx.send(msg)
         return
-    else:
-        key = res[0]
-    #cur.execute("SELECT * FROM test1 WHERE Name=?", str(ppl))
-    sql1 = '''SELECT Date, Lv, Power FROM LVE WHERE PlayerKey="{}" ORDER BY ROWID DESC LIMIT 1'''.format(str(key))
-    logging.debug("SQL: " + sql1)
-    cur.execute(sql1)
-
-    value_list = cur.fetchone()
+    value_list = await DB.run_query(stfc_db.get_last_entry, key)
     if value_list is None or len(value_list) == 0:
         msg = "**[WARNING]** The player " + ppl + " does not have any data."
         logging.warning(msg)
         await ctx.send(msg)
         return
 
-    sql2 = '''SELECT name FROM display WHERE key="{}" ORDER BY ROWID DESC LIMIT 1'''.format(str(key))
-    logging.debug("SQL: " + sql2)
-    cur.execute(sql2)
-    default_name = cur.fetchone()
+    default_name = await DB.run_query(stfc_db.get_display_name, key)
 
     title = ppl;
     alias_list = [];
     if default_name is not None:
-        if (default_name[0].lower() == ppl.lower()):
-            title = default_name[0];
+        if (default_name.lower() == ppl.lower()):
+            title = default_name;
         else:
-            alias_list.append(default_name[0].lower())
+            alias_list.append(default_name.lower())
 
-    sql3 = '''SELECT name FROM alias WHERE key="{}" ORDER BY ROWID DESC'''.format(str(key))
-    logging.debug("SQL: " + sql3)
-    cur.execute(sql3)
-    list_o_names = cur.fetchall()
+    list_o_names = await DB.run_query(stfc_db.get_alias_names, key)
     if list_o_names is not None:
-        if (list_o_names[0][0].lower() != title.lower() and list_o_names[0][0] not in alias_list):
-            alias_list.append(list_o_names[0][0])
-        if (list_o_names[-1][0].lower() != title.lower() and list_o_names[-1][0] not in alias_list):
-            alias_list.append(list_o_names[-1][0])
-        if (len(list_o_names) > 2 and list_o_names[-2][0].lower() != title.lower() and list_o_names[-2][0] not in alias_list):
-            alias_list.append(list_o_names[-2][0])
+        if (list_o_names[0].lower() != title.lower() and list_o_names[0] not in alias_list):
+            alias_list.append(list_o_names[0])
+        if (list_o_names[-1].lower() != title.lower() and list_o_names[-1] not in alias_list):
+            alias_list.append(list_o_names[-1])
+        if (len(list_o_names) > 2 and list_o_names[-2].lower() != title.lower() and list_o_names[-2] not in alias_list):
+            alias_list.append(list_o_names[-2])
     alias_string = ", ".join(alias_list)
     if (len(list_o_names) > 4):
         alias_string += "... (+%s more)" % (len(list_o_names) - len(alias_list) - 1)
@@ -144,44 +110,14 @@ async def player(ctx, ppl : str):
     msg = "**%s**\n  Last Updated: %s\n  Lv: %s\n  Power: %s" % (title, value_list[0], value_list[1], '{:,}'.format(value_list[2]))
 
     # get growth rates:
-    sql4 = '''SELECT Lv, Power, Date FROM LVE WHERE PlayerKey="{}" AND Date>"{}" ORDER BY DATE DESC'''.format(str(key), datetime.datetime.now() - datetime.timedelta(days=8))
-    logging.debug('SQL: ' + sql4)
-    cur.execute(sql4)
-    result = cur.fetchall()
-    if result is not None and len(result) > 3:
-        num_entries = len(result)
-        power_change = result[0][1] - result[-1][1]
-        growth_per_day = float(power_change) / num_entries
-        growth_per_week = growth_per_day * 7
-        percent_growth_per_week = growth_per_week / result[-1][1]
-        msg += "\n  Growth: %s (%s) per week" % (human_format(growth_per_week), '{:.2%}'.format(percent_growth_per_week))
+    growth = await DB.run_query(stfc_db.get_growth, key)
+    if growth is not None and growth[2] > 3 and parser.parse(growth[7]) > datetime.datetime.now() - timedelta(days=8):
+        msg += "\n  Growth: %s (%s) per week" % (human_format(growth[3]), '{:.2%}'.format(growth[4]))
 
     msg += alias_string;
 
     # get lve fam birthday
-    sql5 = '''
-        SELECT Date, Lv
-        FROM [LVE] A
-        INNER JOIN
-        (
-            SELECT Alliance, MIN(Date) AS minDate
-            FROM [LVE]
-            GROUP BY Alliance
-        ) B ON A.Alliance = B.Alliance
-        INNER JOIN
-        (
-            SELECT PlayerKey, MIN(Date) AS minDate
-            FROM [LVE]
-            GROUP BY PlayerKey
-        ) C ON
-            A.PlayerKey="{}" AND
-            A.PlayerKey = C.PlayerKey AND
-            julianday(B.minDate, '+2 days') < julianday(C.minDate) AND
-            A.Date = C.minDate
-    '''.format(str(key))
-    logging.debug("SQL: " + sql5)
-    cur.execute(sql5)
-    birthday = cur.fetchone()
+    birthday = await DB.run_query(stfc_db.get_birthday, key)
     if (birthday is not None):
         msg += "\n  LVE Birthday: joined on %s when lv %d" % (birthday[0], birthday[1])
 
@@ -193,11 +129,7 @@ async def player(ctx, ppl : str):
     dates = []
     values = []
 
-    sql = '''SELECT Date, Lv, Power FROM LVE WHERE PlayerKey="{}" AND julianday(Date, '+1 month') > julianday('now', 'localtime') '''.format(str(key))
-    logging.debug("SQL: " + sql)
-    cur.execute(sql)
-
-    value_list = cur.fetchall()
+    value_list = await DB.run_query(stfc_db.get_month_history, key)
 
     for row in value_list:
         dates.append(parser.parse(row[0]))
@@ -225,30 +157,19 @@ async def compare(ctx, *argv):
     for arg in argv:
         args.append(arg)
 
-    cur = conn.cursor()
-
     async with ctx.message.channel.typing():
         fig = plt.figure()
         plt.style.use('dark_background')
         ax = fig.add_subplot(111)
         for i in range(len(argv)):
             ppl = argv[i]
-            key = -1
-            sql = '''SELECT key FROM alias WHERE name="{}"'''.format(ppl.lower())
-            logging.debug("SQL: " + sql)
-            cur.execute(sql)
-            res = cur.fetchone()
-            if res is None:
+            key = await DB.run_query(stfc_db.get_key, ppl.lower())
+            if key is None:
                 msg = "**[WARNING]** The player " + ppl + " does not exist. Please check your spelling and try again."
                 logging.warning(msg)
                 await ctx.send(msg)
                 continue
-            else:
-                key = res[0]
-            sql = '''SELECT Date, Lv, Power FROM LVE WHERE PlayerKey="{}" AND julianday(Date, '+1 month') > julianday('now', 'localtime')'''.format(str(key))
-            logging.debug("SQL: " + sql)
-            cur.execute(sql)
-            value_list = cur.fetchall()
+            value_list = await DB.run_query(stfc_db.get_month_history, key)
             dates = []
             values = []
             for row in value_list:
@@ -342,12 +263,7 @@ async def alliances(*argv):
 @bot.command(brief="Plot the growth of all players in an alliance", description="Plot the growth of all players in an alliance within an optionally specified level range on a single graph", aliases=["plot-alliance", "plot-all"])
 async def alliance(ctx, team : str, min=1,  max=40):
 
-    cur = conn.cursor()
-
-    sql = '''SELECT PlayerKey FROM LVE WHERE Alliance="{}" AND Date>date("now","-2 days") AND Lv>="{}" AND Lv <="{}" GROUP BY PlayerKey ORDER BY Power DESC'''.format(team.lower(), str(min), str(max))
-    logging.debug('SQL: ' + sql)
-    cur.execute(sql)
-    query_res = cur.fetchall()
+    query_res = await DB.run_query(stfc_db.get_roster_keys, team.lower(), int(min), int(max))
 
     if query_res is None or len(query_res) == 0:
         msg = "**[WARNING]** No results found for team {}".format(team)
@@ -360,26 +276,14 @@ async def alliance(ctx, team : str, min=1,  max=40):
         plt.style.use('dark_background')
         ax = fig.add_subplot(111)
         for key in query_res:
-            sql3 = '''SELECT name FROM display WHERE key="{}" ORDER BY ROWID DESC LIMIT 1'''.format(key[0])
-            logging.debug('SQL: ' + sql3)
-            cur.execute(sql3)
-            get_name = cur.fetchone()
-
-            if not get_name:
-                sql3 = '''SELECT Name FROM alias WHERE key="{}" ORDER BY ROWID DESC LIMIT 1'''.format(key[0])
-                logging.debug('SQL: ' + sql3)
-                cur.execute(sql3)
-                get_name = cur.fetchone()
-            sql = '''SELECT Date, Lv, Power FROM LVE WHERE PlayerKey="{}" AND julianday(Date, '+1 month') > julianday('now', 'localtime')'''.format(str(key[0]))
-            logging.debug("SQL: " + sql)
-            cur.execute(sql)
-            value_list = cur.fetchall()
+            get_name = await DB.run_query(stfc_db.get_player_name, key)
+            value_list = await DB.run_query(stfc_db.get_month_history, key)
             dates = []
             values = []
             for row in value_list:
                 dates.append(parser.parse(row[0]))
                 values.append(row[2])
-            line, = ax.plot(dates, values, lw=2, label=get_name[0])
+            line, = ax.plot(dates, values, lw=2, label=get_name)
 
         fig.autofmt_xdate()
         ax.set_title("Power of " + str(len(query_res)) + " Players this Month")
@@ -403,27 +307,15 @@ def human_format(num):
 
 @bot.command(brief="Assign a display name", description="Designate the case-sensitive display name of a player", aliases=["make-default", "set-default", "make-name", "set-name", "make-display", "set-display"])
 async def name(ctx, name : str):
-    cur = conn.cursor()
-    sql = '''SELECT key FROM alias WHERE name="{}" ORDER BY ROWID DESC LIMIT 1'''.format(name.lower())
-    logging.debug('SQL: ' + sql)
-    cur.execute(sql)
-    key = cur.fetchone()
+    key = await DB.run_query(stfc_db.get_key, name.lower(), True)
 
-    if not key:
+    if key is None:
         msg = "**[ERROR]** The name {} does not exist. Try adding it first by doing !add".format(name)
         logging.error(msg)
         await ctx.send(msg)
         return
 
-    sql = '''DELETE FROM display WHERE key="{}"'''.format(key[0])
-    logging.debug('SQL: ' + sql)
-    cur.execute(sql)
-
-    sql = '''INSERT INTO display (key, name) VALUES ("{}", "{}")'''.format(key[0], name)
-    logging.debug('SQL: ' + sql)
-    cur.execute(sql)
-
-    conn.commit()
+    await DB.run_update(stfc_db.set_display_name, key, name)
 
     msg = 'Set \'' + name + '\' as the player display name'
     logging.info(msg)
@@ -438,105 +330,48 @@ async def roster(ctx, team : str, options='-g'):
         -p         = sort by power
         -g         = sort by growth
     '''
-    num_insufficient = 0;
-    num_active = 0;
-    num_inactive = 0;
-    total_growth = 0;
-    total_percent_growth = 0;
     roster_msg = "";
-    cur = conn.cursor()
 
-
-    sql = '''SELECT PlayerKey FROM LVE WHERE Alliance="{}" AND Date>date("now","-2 days") GROUP BY PlayerKey'''.format(team.lower())
     '''if options == "-n" or options == "-a":
         # DON'T KNOW HOW TO IMPLEMENT THIS YET
     elif (options == "-p"):
-        sql += " ORDER BY Power DESC"
+        # sorted by power
     elif (options == "-g"):
         # NOT SURE KNOW HOW TO IMPLEMENT THIS YET'''
-    sql += " ORDER BY Power DESC"
-    logging.debug('SQL: ' + sql)
-    cur.execute(sql)
-    query_res = cur.fetchall()
+    summary = await DB.run_query(stfc_db.get_alliance_growth, team.lower())
+    if summary is None or summary[1] == 0:
+        msg = "No data has been uploaded for team {} today".format(team)
+        logging.info(msg)
+        await ctx.send(msg)
+        return
+    date, num_players, num_active, num_inactive, num_insufficient, total_growth, total_percent_growth = summary
+    query_res = await DB.run_query(stfc_db.get_roster, team.lower())
 
+    roster_lines = []
     async with ctx.message.channel.typing():
 
-        for key in query_res:
-            sql2 = '''
-                SELECT Power, Date
-                FROM [LVE] A
-                WHERE PlayerKey="{}"
-                AND Power NOT IN (
-                    SELECT Power
-                    FROM (
-                        SELECT MAX(Date) AS max, Power
-                        FROM [LVE] B
-                        WHERE B.PlayerKey = A.PlayerKey
-                        )
-                    )
-                ORDER BY Date DESC
-                LIMIT 1
-            '''.format(key[0])
-            logging.debug('SQL: ' + sql2)
-            cur.execute(sql2)
-            recent = cur.fetchone()
-
-            sql3 = '''SELECT name FROM display WHERE key="{}" ORDER BY ROWID DESC LIMIT 1'''.format(key[0])
-            logging.debug('SQL: ' + sql3)
-            cur.execute(sql3)
-            get_name = cur.fetchone()
-
-            if not get_name:
-                sql3 = '''SELECT Name FROM alias WHERE key="{}" ORDER BY ROWID DESC LIMIT 1'''.format(key[0])
-                logging.debug('SQL: ' + sql3)
-                cur.execute(sql3)
-                get_name = cur.fetchone()
-
-            sql4 = '''SELECT Lv, Power, Date FROM LVE WHERE PlayerKey="{}" AND Date>"{}" ORDER BY DATE DESC'''.format(key[0], datetime.datetime.now() - datetime.timedelta(days=8))
-            logging.debug('SQL: ' + sql4)
-            cur.execute(sql4)
-            result = cur.fetchall()
-
-            num_entries = len(result)
-
-            if num_entries < 3:
+        for get_name, lv, power, num_entries, growth_per_week, percent_growth_per_week, status, last_seen in query_res:
+
+            if status == "new":
                 # Case insufficent data
-                msg = "```🆕 Name: {:25}| Level: {:<3}| Power: {:<8}| Insufficient data, only {} entries this week ```".format( get_name[0] , result[0][0], human_format(result[0][1]), num_entries)
-                num_insufficient += 1
+                msg = "🆕 Name: {:25}| Level: {:<3}| Power: {:<8}| Insufficient data, only {} entries this week".format( get_name , lv, human_format(power), num_entries)
 
-            elif recent and ( datetime.datetime.strptime(recent[1], "%Y-%m-%d") + datetime.timedelta(days=14) ) >=  datetime.datetime.now() :
+            elif status == "active":
                 # Case active
-                power_change = result[0][1] - result[-1][1]
-                growth_per_day = float(power_change) / num_entries
-                growth_per_week = growth_per_day * 7
-                #percent_growth_per_day = growth_per_day /  recent[0];
-                percent_growth_per_week = growth_per_week / result[-1][1]
-
-                msg = "```🌿 Name: {0:<25}| Level: {1:<3}| Power: {2:<8}| Active, growing {3} ({4:.2%}) per week ```".format( get_name[0] , result[0][0], human_format(result[0][1]), human_format(growth_per_week), percent_growth_per_week)
-                num_active += 1
-                total_growth += growth_per_week
-                total_percent_growth += percent_growth_per_week
+                msg = "🌿 Name: {0:<25}| Level: {1:<3}| Power: {2:<8}| Active, growing {3} ({4:.2%}) per week".format( get_name , lv, human_format(power), human_format(growth_per_week), percent_growth_per_week)
 
             else :
                 # Case inactive
-                last_seen = ""
-                if (recent):
-                    last_seen = recent[1]
-                else:
+                if (last_seen is None):
                     last_seen = "never"
-                msg = "```🕒 Name: {:<25}| Level: {:<3}| Power: {:<8}| Inactive, last seen {} ```".format( get_name[0], result[0][0], human_format(result[0][1]), last_seen)
-                num_inactive += 1
+                msg = "🕒 Name: {:<25}| Level: {:<3}| Power: {:<8}| Inactive, last seen {}".format( get_name, lv, human_format(power), last_seen)
 
             #roster_msg += msg + "\n"
             logging.info(msg)
-            await ctx.send(msg)
+            roster_lines.append(msg)
+
+        await ctx.send_lines(roster_lines, code_block=True)
 
-    num_players = num_active + num_inactive + num_insufficient
-    if num_players == 0:
-        msg = "No data has been uploaded for team {} today".format(team)
-        logging.info(msg)
-        await ctx.send(msg)
-        return
     #overview_msg = "active players {} out of {}\n".format(num_active + num_insufficient, num_players)
     #overview_msg += "the average member grows {0} ({1:.2f}%) per week\n".format(human_format(total_growth/num_players), total_percent_growth/num_players)
     #overview_msg += "the average active member grows {} ({}%} per week".format(total_growth/num_players, total_percent_growth/num_players)
@@ -564,6 +399,7 @@ async def on_command_error(ctx, error):
 #                                 MAIN SCRIPT
 # ------------------------------------------------------------------------------
 init_logger()
+stfc_db.migrate(DB.writer)
 style.use ('fivethirtyeight')
 f = open(token_file, "r")
 TOKEN = f.read()
@@ -0,0 +1,988 @@
+#!/usr/bin/env python3
+#
+# FILENAME: stfc_db.py
+# CREATED:  October 18, 2026
+# AUTHOR:   buerge3
+#
+# Data-access functions for the LVE database shared by vision-bot.py,
+# plotty-bot.py and db-maintenance.py. Every query is a constant string with
+# bound parameters, so sqlite3's statement cache can reuse the prepared
+# statement instead of re-parsing it on every call, and names containing
+# quotes are stored as-is. migrate() creates the tables and the indexes the
+# queries rely on, and check_query_plans() confirms that they are used.
+# Usage: "import stfc_db"
+import sqlite3
+from sqlite3 import Error
+from contextlib import contextmanager
+
+import json
+import queue
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# MODIFIABLE PARAMETERS
+cached_statements = 256
+busy_timeout_ms = 5000
+synchronous = "NORMAL"
+read_pool_size = 4
+
+# when a list, execute appends the (sql, params) of every query to it; used by
+# check_query_plans
+query_log = None
+
+# -----------------------------------------------------------------------------
+#                        DATABASE CONNECTION SCRIPT
+# -----------------------------------------------------------------------------
+def create_connection(db_file, read_only=False):
+    """ create a database connection to the SQLite database
+        specified by the db_file, in WAL mode so that readers and
+        the writer do not block each other
+    :param db_file: database file
+    :param read_only: True to refuse writes on this connection
+    :return: Connection object or None
+    """
+    try:
+        conn = sqlite3.connect(db_file, cached_statements=cached_statements,
+            timeout=busy_timeout_ms / 1000, check_same_thread=False)
+        conn.execute('''PRAGMA journal_mode=WAL''')
+        conn.execute('''PRAGMA busy_timeout={}'''.format(busy_timeout_ms))
+        conn.execute('''PRAGMA synchronous={}'''.format(synchronous))
+        if read_only:
+            conn.execute('''PRAGMA query_only=ON''')
+        logging.info("connected to " + db_file);
+        return conn
+    except Error as e:
+        logging.error(e, exc_info=True)
+
+    return None
+
+# Database
+# the connections of one process to the LVE database: a small pool of read-only
+# connections, and a single writer that is used by one thread at a time. Each
+# bot is a separate process with its own Database; WAL mode lets their readers
+# run while the other bot is writing, and busy_timeout makes a second writer
+# wait for the first instead of failing with "database is locked".
+# Coroutines use run_query and run_update, which run on dedicated threads (one
+# per read connection, and one for the writer) so that the event loop never
+# waits on SQLite.
+class Database:
+    def __init__(self, db_file, pool_size=read_pool_size):
+        self.db_file = db_file
+        self.writer = create_connection(db_file)
+        self.write_lock = threading.RLock()
+        self.write_depth = 0
+        self.readers = queue.Queue()
+        for i in range(pool_size):
+            self.readers.put(create_connection(db_file, read_only=True))
+        self.read_executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="db-read")
+        self.write_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-write")
+
+    # read
+    # borrow a read connection for the duration of a with-block; it sees every
+    # write committed before the block started
+    @contextmanager
+    def read(self):
+        conn = self.readers.get()
+        try:
+            yield conn
+        finally:
+            conn.rollback()
+            self.readers.put(conn)
+
+    # write
+    # hold the writer for the duration of a with-block, whose statements are
+    # committed as one transaction; nested write blocks join the outer one
+    @contextmanager
+    def write(self):
+        with self.write_lock:
+            if self.write_depth > 0:
+                yield self.writer
+                return
+            self.write_depth += 1
+            try:
+                with transaction(self.writer):
+                    yield self.writer
+            finally:
+                self.write_depth -= 1
+
+    # query
+    # @param func, a data-access function taking a connection as its first argument
+    # @return func(conn, *args) run on a read connection
+    def query(self, func, *args):
+        with self.read() as conn:
+            return func(conn, *args)
+
+    # update
+    # @param func, a data-access function taking a connection as its first argument
+    # @return func(conn, *args) run and committed on the writer
+    def update(self, func, *args):
+        with self.write() as conn:
+            return func(conn, *args)
+
+    # run_query
+    # the awaitable form of query, for use in coroutines
+    async def run_query(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.read_executor, self.query, func, *args)
+
+    # run_update
+    # the awaitable form of update, for use in coroutines; updates run one at a
+    # time in the order they were awaited
+    async def run_update(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.write_executor, self.update, func, *args)
+
+    def close(self):
+        self.read_executor.shutdown()
+        self.write_executor.shutdown()
+        with self.write_lock:
+            self.writer.close()
+        while not self.readers.empty():
+            self.readers.get().close()
+
+# execute
+# @param conn, a database connection
+# @param sql, a query with ? placeholders
+# @param params, the values to bind to the placeholders
+# @return the cursor the query was executed on
+def execute(conn, sql, params=()):
+    logging.debug("SQL: " + sql + " " + str(params))
+    if query_log is not None:
+        query_log.append((sql, params))
+    return conn.execute(sql, params)
+
+# transaction
+# run the statements of a with-block in one transaction, which is committed at
+# the end of the block or rolled back if the block raises
+@contextmanager
+def transaction(conn):
+    conn.commit()
+    conn.execute('''BEGIN''')
+    try:
+        yield conn
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+
+# -----------------------------------------------------------------------------
+#                              SCHEMA MIGRATIONS
+# -----------------------------------------------------------------------------
+# MIGRATIONS[n] upgrades a database from schema version n to n + 1; the version
+# is stored in PRAGMA user_version. Never edit a migration that has shipped,
+# append a new one instead.
+MIGRATIONS = [
+    # 1: the tables the bots have always used
+    [
+        '''CREATE TABLE IF NOT EXISTS LVE (PlayerKey INTEGER, Date TEXT, Alliance TEXT, Lv INTEGER, Power INTEGER)''',
+        '''CREATE TABLE IF NOT EXISTS alias (key INTEGER, name TEXT)''',
+        '''CREATE TABLE IF NOT EXISTS display (key INTEGER, name TEXT)''',
+        '''CREATE TABLE IF NOT EXISTS backlog (Name TEXT, Date TEXT, Alliance TEXT, Lv INTEGER, Power INTEGER)''',
+        '''CREATE TABLE IF NOT EXISTS __state (name TEXT, value INTEGER)''',
+        '''INSERT INTO __state (name, value) SELECT 'key', 0 WHERE NOT EXISTS (SELECT 1 FROM __state WHERE name='key')''',
+    ],
+    # 2: covering indexes for the per-player, per-alliance, alias, display and
+    # backlog lookups
+    [
+        '''CREATE INDEX IF NOT EXISTS LVE_player_date ON LVE (PlayerKey, Date, Power, Lv, Alliance)''',
+        '''CREATE INDEX IF NOT EXISTS LVE_alliance_date ON LVE (Alliance, Date, PlayerKey, Lv, Power)''',
+        '''CREATE INDEX IF NOT EXISTS alias_name ON alias (name, key)''',
+        '''CREATE INDEX IF NOT EXISTS alias_key ON alias (key, name)''',
+        '''CREATE INDEX IF NOT EXISTS display_key ON display (key, name)''',
+        '''CREATE INDEX IF NOT EXISTS backlog_name ON backlog (Name)''',
+        '''CREATE INDEX IF NOT EXISTS backlog_alliance_date ON backlog (Alliance, Date)''',
+        '''CREATE INDEX IF NOT EXISTS __state_name ON __state (name)''',
+    ],
+    # 3: allocate player keys from an AUTOINCREMENT table instead of the
+    # __state counter; every key in use or handed out before is kept
+    [
+        '''CREATE TABLE IF NOT EXISTS player (key INTEGER PRIMARY KEY AUTOINCREMENT)''',
+        '''INSERT OR IGNORE INTO player (key) SELECT CAST(key AS INTEGER) FROM alias UNION SELECT CAST(PlayerKey AS INTEGER) FROM LVE''',
+        '''INSERT INTO sqlite_sequence (name, seq) SELECT 'player', -1 WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name='player')''',
+        '''UPDATE sqlite_sequence SET seq=MAX(seq, IFNULL((SELECT CAST(value AS INTEGER) - 1 FROM __state WHERE name='key'), -1)) WHERE name='player' ''',
+        '''DELETE FROM __state WHERE name='key' ''',
+    ],
+    # 4: the latest entry of every player, and the most recent entry before it
+    # with a different power, kept current by triggers on LVE. Entries in date
+    # order update the row directly; anything else recomputes it from LVE.
+    [
+        '''CREATE TABLE IF NOT EXISTS latest (PlayerKey INTEGER PRIMARY KEY, Date TEXT, Alliance TEXT, Lv INTEGER, Power INTEGER, PrevPower INTEGER, PrevDate TEXT)''',
+        '''CREATE INDEX IF NOT EXISTS latest_alliance_date ON latest (Alliance, Date, Power, Lv)''',
+        '''INSERT OR REPLACE INTO latest (PlayerKey, Date, Alliance, Lv, Power)
+            SELECT PlayerKey, MAX(Date), Alliance, Lv, Power FROM LVE GROUP BY PlayerKey''',
+        '''UPDATE latest SET (PrevPower, PrevDate) = (
+            SELECT Power, Date FROM LVE WHERE LVE.PlayerKey=latest.PlayerKey AND LVE.Power!=latest.Power ORDER BY Date DESC, ROWID DESC LIMIT 1)''',
+        '''CREATE TRIGGER IF NOT EXISTS latest_insert AFTER INSERT ON LVE
+            WHEN NOT EXISTS (SELECT 1 FROM latest WHERE PlayerKey=NEW.PlayerKey AND Date>NEW.Date)
+            BEGIN
+                INSERT OR REPLACE INTO latest (PlayerKey, Date, Alliance, Lv, Power, PrevPower, PrevDate)
+                SELECT NEW.PlayerKey, NEW.Date, NEW.Alliance, NEW.Lv, NEW.Power,
+                    CASE WHEN L.Power IS NOT NULL AND L.Power!=NEW.Power THEN L.Power ELSE L.PrevPower END,
+                    CASE WHEN L.Power IS NOT NULL AND L.Power!=NEW.Power THEN L.Date ELSE L.PrevDate END
+                FROM (SELECT 1) LEFT JOIN latest L ON L.PlayerKey=NEW.PlayerKey;
+            END''',
+        '''CREATE TRIGGER IF NOT EXISTS latest_insert_older AFTER INSERT ON LVE
+            WHEN EXISTS (SELECT 1 FROM latest WHERE PlayerKey=NEW.PlayerKey AND Date>NEW.Date)
+            BEGIN
+                UPDATE latest SET (PrevPower, PrevDate) = (
+                    SELECT Power, Date FROM LVE WHERE LVE.PlayerKey=latest.PlayerKey AND LVE.Power!=latest.Power ORDER BY Date DESC, ROWID DESC LIMIT 1)
+                WHERE PlayerKey=NEW.PlayerKey;
+            END''',
+        '''CREATE TRIGGER IF NOT EXISTS latest_delete AFTER DELETE ON LVE
+            BEGIN
+                DELETE FROM latest WHERE PlayerKey=OLD.PlayerKey;
+                INSERT INTO latest (PlayerKey, Date, Alliance, Lv, Power, PrevPower, PrevDate)
+                SELECT PlayerKey, Date, Alliance, Lv, Power,
+                    (SELECT Power FROM LVE B WHERE B.PlayerKey=A.PlayerKey AND B.Power!=A.Power ORDER BY B.Date DESC, B.ROWID DESC LIMIT 1),
+                    (SELECT Date FROM LVE B WHERE B.PlayerKey=A.PlayerKey AND B.Power!=A.Power ORDER BY B.Date DESC, B.ROWID DESC LIMIT 1)
+                FROM LVE A WHERE PlayerKey=OLD.PlayerKey ORDER BY Date DESC, ROWID DESC LIMIT 1;
+            END''',
+        '''CREATE TRIGGER IF NOT EXISTS latest_update AFTER UPDATE ON LVE
+            BEGIN
+                DELETE FROM latest WHERE PlayerKey IN (OLD.PlayerKey, NEW.PlayerKey);
+                INSERT INTO latest (PlayerKey, Date, Alliance, Lv, Power, PrevPower, PrevDate)
+                SELECT PlayerKey, Date, Alliance, Lv, Power,
+                    (SELECT Power FROM LVE B WHERE B.PlayerKey=A.PlayerKey AND B.Power!=A.Power ORDER BY B.Date DESC, B.ROWID DESC LIMIT 1),
+                    (SELECT Date FROM LVE B WHERE B.PlayerKey=A.PlayerKey AND B.Power!=A.Power ORDER BY B.Date DESC, B.ROWID DESC LIMIT 1)
+                FROM LVE A WHERE PlayerKey=OLD.PlayerKey ORDER BY Date DESC, ROWID DESC LIMIT 1;
+                INSERT OR REPLACE INTO latest (PlayerKey, Date, Alliance, Lv, Power, PrevPower, PrevDate)
+                SELECT PlayerKey, Date, Alliance, Lv, Power,
+                    (SELECT Power FROM LVE B WHERE B.PlayerKey=A.PlayerKey AND B.Power!=A.Power ORDER BY B.Date DESC, B.ROWID DESC LIMIT 1),
+                    (SELECT Date FROM LVE B WHERE B.PlayerKey=A.PlayerKey AND B.Power!=A.Power ORDER BY B.Date DESC, B.ROWID DESC LIMIT 1)
+                FROM LVE A WHERE PlayerKey=NEW.PlayerKey ORDER BY Date DESC, ROWID DESC LIMIT 1;
+            END''',
+    ],
+    # 5: weekly growth rollups. growth holds the growth of every player over the
+    # week ending on their latest entry, recomputed from that week of LVE
+    # whenever their latest row changes; alliance_growth holds the totals of the
+    # players of an alliance on each day, refreshed by update_alliance_growth
+    # once a roster has been stored.
+    # A player is 'new' with fewer than 3 entries that week, 'active' if their
+    # power changed in the two weeks before their latest entry, else 'inactive'.
+    [
+        '''CREATE TABLE IF NOT EXISTS growth (PlayerKey INTEGER PRIMARY KEY, Date TEXT, Alliance TEXT, Lv INTEGER, Power INTEGER,
+            Entries INTEGER, StartPower INTEGER, WeeklyGrowth REAL, WeeklyPercent REAL, Status TEXT, PrevDate TEXT)''',
+        '''CREATE INDEX IF NOT EXISTS growth_alliance_date ON growth (Alliance, Date)''',
+        '''CREATE TABLE IF NOT EXISTS alliance_growth (Alliance TEXT, Date TEXT, Players INTEGER, Active INTEGER, Inactive INTEGER, New INTEGER,
+            TotalGrowth REAL, TotalPercent REAL, PRIMARY KEY (Alliance, Date))''',
+        '''INSERT OR REPLACE INTO growth (PlayerKey, Date, Alliance, Lv, Power, Entries, StartPower, WeeklyGrowth, WeeklyPercent, Status, PrevDate)
+            SELECT PlayerKey, Date, Alliance, Lv, Power, Entries, StartPower,
+                (Power - StartPower) * 7.0 / Entries,
+                (Power - StartPower) * 7.0 / Entries / StartPower,
+                CASE WHEN Entries < 3 THEN 'new'
+                    WHEN PrevDate IS NOT NULL AND julianday(PrevDate, '+14 days') >= julianday(Date) THEN 'active'
+                    ELSE 'inactive' END,
+                PrevDate
+            FROM (
+                SELECT L.PlayerKey, L.Date, L.Alliance, L.Lv, L.Power, L.PrevDate,
+                    (SELECT COUNT(*) FROM LVE W WHERE W.PlayerKey=L.PlayerKey AND W.Date>date(L.Date, '-8 days') AND W.Date<=L.Date) AS Entries,
+                    (SELECT Power FROM LVE W WHERE W.PlayerKey=L.PlayerKey AND W.Date>date(L.Date, '-8 days') ORDER BY W.Date ASC, W.ROWID ASC LIMIT 1) AS StartPower
+                FROM latest L
+            )''',
+        '''INSERT OR REPLACE INTO alliance_growth (Alliance, Date, Players, Active, Inactive, New, TotalGrowth, TotalPercent)
+            SELECT A.Alliance, A.Date, COUNT(*), SUM(G.Status='active'), SUM(G.Status='inactive'), SUM(G.Status='new'),
+                TOTAL(CASE WHEN G.Status='active' THEN G.WeeklyGrowth END), TOTAL(CASE WHEN G.Status='active' THEN G.WeeklyPercent END)
+            FROM (SELECT DISTINCT Alliance, Date FROM growth) A
+            INNER JOIN growth G ON G.Alliance=A.Alliance AND G.Date>date(A.Date, '-2 days') AND G.Date<=A.Date
+            GROUP BY A.Alliance, A.Date''',
+        '''CREATE TRIGGER IF NOT EXISTS growth_insert AFTER INSERT ON latest
+            BEGIN
+                INSERT OR REPLACE INTO growth (PlayerKey, Date, Alliance, Lv, Power, Entries, StartPower, WeeklyGrowth, WeeklyPercent, Status, PrevDate)
+                SELECT NEW.PlayerKey, NEW.Date, NEW.Alliance, NEW.Lv, NEW.Power, W.Entries, W.StartPower,
+                    (NEW.Power - W.StartPower) * 7.0 / W.Entries,
+                    (NEW.Power - W.StartPower) * 7.0 / W.Entries / W.StartPower,
+                    CASE WHEN W.Entries < 3 THEN 'new'
+                        WHEN NEW.PrevDate IS NOT NULL AND julianday(NEW.PrevDate, '+14 days') >= julianday(NEW.Date) THEN 'active'
+                        ELSE 'inactive' END,
+                    NEW.PrevDate
+                FROM (
+                    SELECT COUNT(*) AS Entries,
+                        (SELECT Power FROM LVE WHERE PlayerKey=NEW.PlayerKey AND Date>date(NEW.Date, '-8 days') ORDER BY Date ASC, ROWID ASC LIMIT 1) AS StartPower
+                    FROM LVE WHERE PlayerKey=NEW.PlayerKey AND Date>date(NEW.Date, '-8 days') AND Date<=NEW.Date
+                ) W;
+            END''',
+        '''CREATE TRIGGER IF NOT EXISTS growth_update AFTER UPDATE ON latest
+            BEGIN
+                INSERT OR REPLACE INTO growth (PlayerKey, Date, Alliance, Lv, Power, Entries, StartPower, WeeklyGrowth, WeeklyPercent, Status, PrevDate)
+                SELECT NEW.PlayerKey, NEW.Date, NEW.Alliance, NEW.Lv, NEW.Power, W.Entries, W.StartPower,
+                    (NEW.Power - W.StartPower) * 7.0 / W.Entries,
+                    (NEW.Power - W.StartPower) * 7.0 / W.Entries / W.StartPower,
+                    CASE WHEN W.Entries < 3 THEN 'new'
+                        WHEN NEW.PrevDate IS NOT NULL AND julianday(NEW.PrevDate, '+14 days') >= julianday(NEW.Date) THEN 'active'
+                        ELSE 'inactive' END,
+                    NEW.PrevDate
+                FROM (
+                    SELECT COUNT(*) AS Entries,
+                        (SELECT Power FROM LVE WHERE PlayerKey=NEW.PlayerKey AND Date>date(NEW.Date, '-8 days') ORDER BY Date ASC, ROWID ASC LIMIT 1) AS StartPower
+                    FROM LVE WHERE PlayerKey=NEW.PlayerKey AND Date>date(NEW.Date, '-8 days') AND Date<=NEW.Date
+                ) W;
+            END''',
+        '''CREATE TRIGGER IF NOT EXISTS growth_delete AFTER DELETE ON latest
+            BEGIN
+                DELETE FROM growth WHERE PlayerKey=OLD.PlayerKey;
+            END''',
+    ],
+    # 6: the latest entry of every player by alliance, level and power, for
+    # the nearest-neighbour lookups of guess_players
+    [
+        '''CREATE INDEX IF NOT EXISTS latest_alliance_lv ON latest (Alliance, Lv, Power, Date)''',
+    ],
+    # 7: the names added by hand with !add, !alias or !correct, which are known
+    # names before the player has an LVE entry
+    [
+        '''ALTER TABLE alias ADD COLUMN added INTEGER DEFAULT 0''',
+    ],
+]
+
+# get_schema_version
+# @return the number of migrations that have been applied to the database
+def get_schema_version(conn):
+    return conn.execute('''PRAGMA user_version''').fetchone()[0]
+
+# migrate
+# apply every pending migration, each in its own transaction
+# @param target, the schema version to stop at; the latest one by default
+# @return the schema version of the database
+def migrate(conn, target=None):
+    if target is None:
+        target = len(MIGRATIONS)
+    conn.commit()
+    version = get_schema_version(conn)
+    while version < target:
+        logging.info("migrating the database from schema version {} to {}".format(version, version + 1))
+        try:
+            conn.execute('''BEGIN''')
+            for sql in MIGRATIONS[version]:
+                execute(conn, sql)
+            conn.execute('''PRAGMA user_version = {}'''.format(version + 1))
+            conn.commit()
+        except Error as e:
+            conn.rollback()
+            logging.error("migration to schema version {} failed: {}".format(version + 1, e), exc_info=True)
+            raise
+        version += 1
+    return version
+
+# QUERY_PLAN_SAMPLES
+# one call of every data-access function that reads the LVE, alias, display or
+# backlog tables, with placeholder arguments
+QUERY_PLAN_SAMPLES = [
+    ("get_key", ("name",)),
+    ("get_key", ("name", True)),
+    ("get_keys", (["name", "other"],)),
+    ("add_name_to_alias", ("name",)),
+    ("add_known_name", ("name",)),
+    ("merge_keys", (1, 2)),
+    ("get_player_name", (1,)),
+    ("get_alias_names", (1,)),
+    ("get_player_alias_rows", (0,)),
+    ("get_names_of_keys", ([1, 2],)),
+    ("sum_player_alias_rows", (1,)),
+    ("get_alliance_names", ("alliance", "2019-01-01")),
+    ("set_display_name", (1, "Name")),
+    ("has_entry_on", (1, "2019-01-01")),
+    ("get_latest_power", (1,)),
+    ("get_entered_on", ([1, 2], "2019-01-01")),
+    ("get_latest_powers", ([1, 2],)),
+    ("count_uploaded", ("alliance", "2019-01-01")),
+    ("get_last_entry", (1,)),
+    ("get_history_since", (1, "2019-01-01")),
+    ("get_month_history", (1,)),
+    ("get_last_different_power", (1,)),
+    ("get_birthday", (1,)),
+    ("get_roster_keys", ("alliance",)),
+    ("get_roster_keys", ("alliance", 1, 40)),
+    ("get_previous_roster", ("alliance", "2019-01-01")),
+    ("get_missing_players", ("alliance",)),
+    ("get_roster", ("alliance",)),
+    ("get_growth", (1,)),
+    ("update_alliance_growth", ("alliance", "2019-01-01")),
+    ("get_alliance_growth", ("alliance",)),
+    ("refresh_alliance_growth", ("alliance",)),
+    ("get_latest_alliances", ([1, 2],)),
+    ("pop_backlog", ("name",)),
+    ("clear_backlog", ("alliance",)),
+    ("get_backlog", ("alliance", "2019-01-01")),
+    ("count_backlog", ("name",)),
+    ("guess_players", ("name", 5)),
+    ("nearest_players", ("alliance", "2019-01-01", 30, 1000000, 5)),
+    ("nearest_players", ("alliance", "2019-01-01", None, 1000000, 5)),
+]
+
+# check_query_plans
+# run every sample query in a transaction that is rolled back, and check with
+# EXPLAIN QUERY PLAN that each one finds its rows through an index
+# @return a list of (sql, plan detail) for every scan found
+def check_query_plans(conn):
+    global query_log
+    conn.commit()
+    queries = []
+    try:
+        for name, args in QUERY_PLAN_SAMPLES:
+            query_log = []
+            globals()[name](conn, *args)
+            queries += query_log
+    finally:
+        query_log = None
+        conn.rollback()
+
+    scans = []
+    checked = set()
+    for sql, params in queries:
+        if sql in checked:
+            continue
+        checked.add(sql)
+        one_line = " ".join(sql.split())
+        plan = conn.execute('''EXPLAIN QUERY PLAN ''' + sql, params).fetchall()
+        subqueries = set()
+        for row in plan:
+            words = row[-1].split()
+            if words[0] in ("MATERIALIZE", "CO-ROUTINE"):
+                subqueries.add(words[1])
+            # "SCAN <name>" reads every row of a table or index; scans of
+            # materialized subqueries and of json_each parameter lists are fine
+            elif words[0] == "SCAN" and words[1] not in subqueries and not words[1].startswith("(") and words[1] != "CONSTANT" \
+                    and "VIRTUAL" not in words:
+                scans.append((one_line, row[-1]))
+                logging.warning("full scan: {} in {}".format(row[-1], one_line))
+    logging.info("checked the query plans of {} queries, {} full scans".format(len(checked), len(scans)))
+    return scans
+
+# -----------------------------------------------------------------------------
+#                                PLAYER NAMES
+# -----------------------------------------------------------------------------
+# get_key
+# @param name, a lowercase player name
+# @param newest, True to prefer the most recently added alias if the name is ambiguous
+# @return the player key for the name, or None if the name is not in the alias table
+def get_key(conn, name, newest=False):
+    if newest:
+        sql = '''SELECT key FROM alias WHERE name=? ORDER BY ROWID DESC LIMIT 1'''
+    else:
+        sql = '''SELECT key FROM alias WHERE name=?'''
+    row = execute(conn, sql, (name,)).fetchone()
+    return None if row is None else row[0]
+
+# get_keys
+# look up the keys of many names in one query
+# @param names, a list of lowercase player names
+# @return a dict from each name in the alias table to its player key
+def get_keys(conn, names):
+    sql = '''SELECT name, key FROM alias WHERE name IN (SELECT value FROM json_each(?)) ORDER BY ROWID'''
+    keys = {}
+    for name, key in execute(conn, sql, (json.dumps(names),)).fetchall():
+        keys.setdefault(name, key)
+    return keys
+
+# add_player
+# @return a new player key; keys are never reused, even after merge_keys
+def add_player(conn):
+    sql = '''INSERT INTO player DEFAULT VALUES'''
+    return execute(conn, sql).lastrowid
+
+# add_name_to_alias
+# @param name, the name to add to the alias table under a new player key
+# @return the new player key
+def add_name_to_alias(conn, name):
+    key = add_player(conn)
+    add_alias(conn, key, name)
+    return key
+
+# add_known_name
+# add a name by hand: give it a new player key if it is not in the alias table,
+# and mark it as added so that it is a known name before the player has an LVE
+# entry
+# @return the player key of the name
+def add_known_name(conn, name):
+    key = get_key(conn, name.lower())
+    if key is None:
+        key = add_name_to_alias(conn, name)
+    set_alias_added(conn, name)
+    return key
+
+# set_alias_added
+# mark every alias row of a name as added by hand
+def set_alias_added(conn, name):
+    sql = '''UPDATE alias SET added=1 WHERE name=?'''
+    execute(conn, sql, (name.lower(),))
+
+# add_alias
+# @param key, an existing player key
+# @param name, a new name for that player
+def add_alias(conn, key, name):
+    sql = '''INSERT INTO alias (key, name) VALUES (?, ?)'''
+    execute(conn, sql, (key, name.lower()))
+
+# merge_keys
+# move every alias and every LVE row of one player key to another
+# @param key, the key to keep
+# @param old_key, the key to replace
+def merge_keys(conn, key, old_key):
+    sql = '''UPDATE alias SET key=? WHERE key=?'''
+    execute(conn, sql, (key, old_key))
+    sql = '''UPDATE LVE SET PlayerKey=? WHERE PlayerKey=?'''
+    execute(conn, sql, (key, old_key))
+
+# get_mixed_case_aliases
+# @return (name, key) of every alias that was stored before names were lowercased
+def get_mixed_case_aliases(conn):
+    sql = '''SELECT name, key FROM alias WHERE name!=lower(name)'''
+    return execute(conn, sql).fetchall()
+
+# lowercase_alias
+# @param name, a mixed-case alias to replace with its lowercase form
+def lowercase_alias(conn, name):
+    sql = '''UPDATE alias SET name=lower(name) WHERE name=?'''
+    execute(conn, sql, (name,))
+
+# get_display_name
+# @return the case-sensitive display name of a player, or None
+def get_display_name(conn, key):
+    sql = '''SELECT name FROM display WHERE key=? ORDER BY ROWID DESC LIMIT 1'''
+    row = execute(conn, sql, (key,)).fetchone()
+    return None if row is None else row[0]
+
+# set_display_name
+# @param key, a player key
+# @param name, the case-sensitive display name for that player
+def set_display_name(conn, key, name):
+    sql = '''DELETE FROM display WHERE key=?'''
+    execute(conn, sql, (key,))
+    sql = '''INSERT INTO display (key, name) VALUES (?, ?)'''
+    execute(conn, sql, (key, name))
+
+# get_alias_names
+# @return every name of a player, newest first
+def get_alias_names(conn, key):
+    sql = '''SELECT name FROM alias WHERE key=? ORDER BY ROWID DESC'''
+    return [row[0] for row in execute(conn, sql, (key,)).fetchall()]
+
+# get_player_alias_rows
+# the alias rows of real players, whose key has an LVE entry or a display name,
+# and the names added by hand; the names only ever seen in the backlog are left
+# out
+# @param rowid, the ROWID of the last alias row already seen
+# @return a list of (ROWID, name) of the alias rows of real players after it,
+#         oldest first
+def get_player_alias_rows(conn, rowid):
+    sql = '''
+        SELECT A.ROWID, A.name
+        FROM alias A
+        WHERE A.ROWID>? AND
+            (A.added=1 OR
+             EXISTS (SELECT 1 FROM LVE L WHERE L.PlayerKey=A.key) OR
+             EXISTS (SELECT 1 FROM display D WHERE D.key=A.key))
+        ORDER BY A.ROWID
+        '''
+    return execute(conn, sql, (rowid,)).fetchall()
+
+# get_alliance_names
+# @param since, a date string; entries after it count
+# @return every name of the players with an entry in an alliance since a date
+def get_alliance_names(conn, alliance, since):
+    sql = '''SELECT name FROM alias WHERE key IN (SELECT PlayerKey FROM LVE WHERE Alliance=? AND Date>?)'''
+    return [row[0] for row in execute(conn, sql, (alliance, since)).fetchall()]
+
+# get_names_of_keys
+# @param keys, a list of player keys
+# @return (key, name) of every alias of those players, newest first
+def get_names_of_keys(conn, keys):
+    sql = '''SELECT key, name FROM alias WHERE key IN (SELECT value FROM json_each(?)) ORDER BY ROWID DESC'''
+    return execute(conn, sql, (json.dumps(keys),)).fetchall()
+
+# sum_player_alias_rows
+# @return (count, sum of ROWIDs) of the alias rows of real players, as in
+#         get_player_alias_rows, up to and including a ROWID
+def sum_player_alias_rows(conn, rowid):
+    sql = '''
+        SELECT COUNT(*), IFNULL(SUM(A.ROWID), 0)
+        FROM alias A
+        WHERE A.ROWID<=? AND
+            (A.added=1 OR
+             EXISTS (SELECT 1 FROM LVE L WHERE L.PlayerKey=A.key) OR
+             EXISTS (SELECT 1 FROM display D WHERE D.key=A.key))
+        '''
+    return tuple(execute(conn, sql, (rowid,)).fetchone())
+
+# get_player_name
+# @return the display name of a player, falling back to their newest alias
+def get_player_name(conn, key):
+    name = get_display_name(conn, key)
+    if name is None:
+        sql = '''SELECT Name FROM alias WHERE key=? ORDER BY ROWID DESC LIMIT 1'''
+        row = execute(conn, sql, (key,)).fetchone()
+        name = None if row is None else row[0]
+    return name
+
+# -----------------------------------------------------------------------------
+#                                 LVE TABLE
+# -----------------------------------------------------------------------------
+# has_entry_on
+# @return True if the player already has data for the given date
+def has_entry_on(conn, key, date):
+    sql = '''SELECT 1 FROM LVE WHERE PlayerKey=? AND Date=? LIMIT 1'''
+    return execute(conn, sql, (key, date)).fetchone() is not None
+
+# get_latest_power
+# @return the power of the most recent entry of a player, or None if there is none
+def get_latest_power(conn, key):
+    sql = '''SELECT Power FROM latest WHERE PlayerKey=?'''
+    row = execute(conn, sql, (key,)).fetchone()
+    return None if row is None else row[0]
+
+# insert_lve
+def insert_lve(conn, key, date, alliance, lv, power):
+    sql = '''INSERT INTO LVE (PlayerKey, Date, Alliance, Lv, Power) VALUES (?, ?, ?, ?, ?)'''
+    execute(conn, sql, (key, date, alliance, lv, power))
+
+# get_entered_on
+# @param keys, a list of player keys
+# @return the set of those keys that already have data for the given date
+def get_entered_on(conn, keys, date):
+    sql = '''SELECT PlayerKey FROM LVE WHERE Date=? AND PlayerKey IN (SELECT value FROM json_each(?))'''
+    return set(row[0] for row in execute(conn, sql, (date, json.dumps(keys))).fetchall())
+
+# get_latest_powers
+# @param keys, a list of player keys
+# @return a dict from each key with data to the power of its latest entry
+def get_latest_powers(conn, keys):
+    sql = '''SELECT PlayerKey, Power FROM latest WHERE PlayerKey IN (SELECT value FROM json_each(?))'''
+    return dict(execute(conn, sql, (json.dumps(keys),)).fetchall())
+
+# insert_lve_rows
+# @param rows, a list of (PlayerKey, Date, Alliance, Lv, Power) tuples
+def insert_lve_rows(conn, rows):
+    sql = '''INSERT INTO LVE (PlayerKey, Date, Alliance, Lv, Power) VALUES (?, ?, ?, ?, ?)'''
+    logging.debug("SQL: " + sql + " x" + str(len(rows)))
+    conn.executemany(sql, rows)
+
+# count_uploaded
+# @return the number of players uploaded for an alliance on a date
+def count_uploaded(conn, alliance, date):
+    sql = '''SELECT COUNT(*) FROM LVE WHERE Alliance=? AND Date=?'''
+    return execute(conn, sql, (alliance, date)).fetchone()[0]
+
+# get_last_entry
+# @return (Date, Lv, Power) of the most recently inserted entry of a player, or None
+def get_last_entry(conn, key):
+    sql = '''SELECT Date, Lv, Power FROM LVE WHERE PlayerKey=? ORDER BY ROWID DESC LIMIT 1'''
+    return execute(conn, sql, (key,)).fetchone()
+
+# get_history_since
+# @param since, entries after this date (a datetime or a date string) are returned
+# @return a list of (Lv, Power, Date), newest first
+def get_history_since(conn, key, since):
+    sql = '''SELECT Lv, Power, Date FROM LVE WHERE PlayerKey=? AND Date>? ORDER BY Date DESC'''
+    return execute(conn, sql, (key, str(since))).fetchall()
+
+# get_month_history
+# @return a list of (Date, Lv, Power) for the last month
+def get_month_history(conn, key):
+    sql = '''SELECT Date, Lv, Power FROM LVE WHERE PlayerKey=? AND julianday(Date, '+1 month') > julianday('now', 'localtime')'''
+    return execute(conn, sql, (key,)).fetchall()
+
+# get_last_different_power
+# @return (Power, Date) of the most recent entry whose power differs from the
+#         player's latest power, or None
+def get_last_different_power(conn, key):
+    sql = '''SELECT PrevPower, PrevDate FROM latest WHERE PlayerKey=? AND PrevDate IS NOT NULL'''
+    return execute(conn, sql, (key,)).fetchone()
+
+# get_birthday
+# @return (Date, Lv) of the first entry of a player who joined at least two days
+#         after their alliance was first uploaded, or None
+def get_birthday(conn, key):
+    sql = '''
+        SELECT A.Date, A.Lv
+        FROM [LVE] A
+        WHERE A.PlayerKey = ?1 AND
+            A.Date = (SELECT MIN(Date) FROM [LVE] WHERE PlayerKey = ?1) AND
+            julianday((SELECT MIN(Date) FROM [LVE] B WHERE B.Alliance = A.Alliance), '+2 days') < julianday(A.Date)
+    '''
+    return execute(conn, sql, (key,)).fetchone()
+
+# get_roster_keys
+# @return the keys of the players whose latest entry is in an alliance and in
+#         the last two days, optionally within a level range, ordered by power
+def get_roster_keys(conn, alliance, min_lv=None, max_lv=None):
+    if min_lv is None:
+        sql = '''SELECT PlayerKey FROM latest WHERE Alliance=? AND Date>date('now','-2 days') ORDER BY Power DESC'''
+        rows = execute(conn, sql, (alliance,)).fetchall()
+    else:
+        sql = '''SELECT PlayerKey FROM latest WHERE Alliance=? AND Date>date('now','-2 days') AND Lv>=? AND Lv<=? ORDER BY Power DESC'''
+        rows = execute(conn, sql, (alliance, min_lv, max_lv)).fetchall()
+    return [row[0] for row in rows]
+
+# get_previous_roster
+# @return (PlayerKey, Lv, Power) of the entries of an alliance on the last day
+#         before a date that it was uploaded, ordered by power
+def get_previous_roster(conn, alliance, date):
+    sql = '''
+        SELECT PlayerKey, Lv, Power FROM LVE
+        WHERE Alliance=?1 AND Date=(SELECT MAX(Date) FROM LVE WHERE Alliance=?1 AND Date<?2)
+        ORDER BY Power DESC
+        '''
+    return execute(conn, sql, (alliance, date)).fetchall()
+
+# get_missing_players
+# @return (Name, Lv, Power, Date) of the players of an alliance that have data
+#         in the last week but not today, ordered by power
+def get_missing_players(conn, alliance):
+    sql = '''
+        SELECT IFNULL(
+                (SELECT name FROM display D WHERE D.key=A.PlayerKey ORDER BY D.ROWID DESC LIMIT 1),
+                (SELECT name FROM alias C WHERE C.key=A.PlayerKey ORDER BY C.ROWID DESC LIMIT 1)) AS Name,
+            A.Lv, A.Power, A.Date
+        FROM [latest] A
+        WHERE A.Alliance = ? AND
+            A.Date > date('now', 'localtime', '-7 days') AND
+            A.Date != date('now', 'localtime')
+        ORDER BY A.Power DESC
+        '''
+    return execute(conn, sql, (alliance,)).fetchall()
+
+# get_growth
+# @return (Lv, Power, Entries, WeeklyGrowth, WeeklyPercent, Status, PrevDate,
+#         Date) of a player over the week ending on their latest entry, or None
+def get_growth(conn, key):
+    sql = '''SELECT Lv, Power, Entries, WeeklyGrowth, WeeklyPercent, Status, PrevDate, Date FROM growth WHERE PlayerKey=?'''
+    return execute(conn, sql, (key,)).fetchone()
+
+# get_roster
+# the players of an alliance are those counted by get_alliance_growth: the
+# players whose latest entry is in the alliance and in the two days up to its
+# most recent upload, if that upload was in the last two days
+# @return (Name, Lv, Power, Entries, WeeklyGrowth, WeeklyPercent, Status,
+#         PrevDate) of every player on the roster, ordered by power
+def get_roster(conn, alliance):
+    sql = '''
+        SELECT IFNULL(
+                (SELECT name FROM display D WHERE D.key=G.PlayerKey ORDER BY D.ROWID DESC LIMIT 1),
+                (SELECT name FROM alias A WHERE A.key=G.PlayerKey ORDER BY A.ROWID DESC LIMIT 1)) AS Name,
+            G.Lv, G.Power, G.Entries, G.WeeklyGrowth, G.WeeklyPercent, G.Status, G.PrevDate
+        FROM [alliance_growth] S
+        INNER JOIN [growth] G ON G.Alliance = S.Alliance AND G.Date > date(S.Date, '-2 days') AND G.Date <= S.Date
+        WHERE S.Alliance = ?1 AND
+            S.Date = (SELECT MAX(Date) FROM alliance_growth WHERE Alliance = ?1) AND
+            S.Date > date('now', 'localtime', '-2 days')
+        ORDER BY G.Power DESC
+        '''
+    return execute(conn, sql, (alliance,)).fetchall()
+
+# update_alliance_growth
+# recompute the totals of the players of an alliance whose latest entry is in
+# the two days up to a date
+def update_alliance_growth(conn, alliance, date):
+    sql = '''
+        INSERT OR REPLACE INTO alliance_growth (Alliance, Date, Players, Active, Inactive, New, TotalGrowth, TotalPercent)
+        SELECT ?1, ?2, COUNT(*), SUM(Status='active'), SUM(Status='inactive'), SUM(Status='new'),
+            TOTAL(CASE WHEN Status='active' THEN WeeklyGrowth END), TOTAL(CASE WHEN Status='active' THEN WeeklyPercent END)
+        FROM growth WHERE Alliance=?1 AND Date>date(?2, '-2 days') AND Date<=?2
+        '''
+    execute(conn, sql, (alliance, date))
+
+# refresh_alliance_growth
+# recompute the totals of the most recent upload of an alliance, after players
+# counted in them have since been uploaded in another alliance
+def refresh_alliance_growth(conn, alliance):
+    sql = '''SELECT MAX(Date) FROM alliance_growth WHERE Alliance=?'''
+    date = execute(conn, sql, (alliance,)).fetchone()[0]
+    if date is not None:
+        update_alliance_growth(conn, alliance, date)
+
+# get_alliance_growth
+# @return (Date, Players, Active, Inactive, New, TotalGrowth, TotalPercent) of
+#         the most recent upload of an alliance, or None if it was not uploaded
+#         in the last two days
+def get_alliance_growth(conn, alliance):
+    sql = '''
+        SELECT Date, Players, Active, Inactive, New, TotalGrowth, TotalPercent
+        FROM alliance_growth
+        WHERE Alliance=? AND Date > date('now', 'localtime', '-2 days')
+        ORDER BY Date DESC LIMIT 1
+        '''
+    return execute(conn, sql, (alliance,)).fetchone()
+
+# get_latest_alliances
+# @param keys, a list of player keys
+# @return the alliances of the latest entries of those players
+def get_latest_alliances(conn, keys):
+    sql = '''SELECT DISTINCT Alliance FROM latest WHERE PlayerKey IN (SELECT value FROM json_each(?))'''
+    return [row[0] for row in execute(conn, sql, (json.dumps(keys),)).fetchall()]
+
+# -----------------------------------------------------------------------------
+#                                   BACKLOG
+# -----------------------------------------------------------------------------
+# insert_backlog
+def insert_backlog(conn, name, date, alliance, lv, power):
+    sql = '''INSERT INTO backlog (Name, Date, Alliance, Lv, Power) VALUES (?, ?, ?, ?, ?)'''
+    execute(conn, sql, (name.lower(), date, alliance, lv, power))
+
+# insert_backlog_rows
+# @param rows, a list of (Name, Date, Alliance, Lv, Power) tuples
+def insert_backlog_rows(conn, rows):
+    sql = '''INSERT INTO backlog (Name, Date, Alliance, Lv, Power) VALUES (?, ?, ?, ?, ?)'''
+    rows = [(row[0].lower(),) + tuple(row[1:]) for row in rows]
+    logging.debug("SQL: " + sql + " x" + str(len(rows)))
+    conn.executemany(sql, rows)
+
+# pop_backlog
+# remove every backlog entry for a name
+# @return the first (Name, Date, Alliance, Lv, Power) entry that was removed, or None
+def pop_backlog(conn, name):
+    sql = '''SELECT Name, Date, Alliance, Lv, Power FROM backlog WHERE Name=?'''
+    row = execute(conn, sql, (name.lower(),)).fetchone()
+    sql = '''DELETE FROM backlog WHERE Name=?'''
+    execute(conn, sql, (name.lower(),))
+    return row
+
+# clear_backlog
+# delete every backlog entry of an alliance
+def clear_backlog(conn, alliance):
+    sql = '''DELETE FROM backlog WHERE Alliance=?'''
+    execute(conn, sql, (alliance,))
+
+# get_backlog
+# @return (Name, Lv, Power) of the backlog entries of an alliance on a date
+def get_backlog(conn, alliance, date):
+    sql = '''SELECT Name, Lv, Power FROM backlog WHERE Alliance=? AND Date=?'''
+    return execute(conn, sql, (alliance, date)).fetchall()
+
+# count_backlog
+# @return the number of backlog entries for a name
+def count_backlog(conn, name):
+    sql = '''SELECT Count(*) FROM backlog WHERE Name=?'''
+    return execute(conn, sql, (name.lower(),)).fetchone()[0]
+
+# guess_players
+# @param name, a name in the backlog
+# @param limit, maximum number of guesses
+# @return (Name, Lv, Power, Date) of the players of the same alliance seen in the
+#         week before the backlog entry, closest in level and then in power first
+def guess_players(conn, name, limit):
+    sql = '''SELECT Date, Alliance, Lv, Power FROM backlog WHERE Name=? ORDER BY ROWID LIMIT 1'''
+    row = execute(conn, sql, (name.lower(),)).fetchone()
+    if row is None:
+        return []
+    date, alliance, lv, power = row
+    try:
+        lv = int(str(lv).replace(',', ''))
+    except ValueError:
+        lv = None
+    try:
+        power = int(str(power).replace(',', ''))
+    except ValueError:
+        power = None
+    rows = nearest_players(conn, alliance, date, lv, power, limit)
+    sql = '''
+        SELECT IFNULL(
+            (SELECT name FROM display WHERE key=K.value ORDER BY ROWID DESC LIMIT 1),
+            (SELECT name FROM alias WHERE key=K.value ORDER BY ROWID DESC LIMIT 1))
+        FROM json_each(?) K
+        '''
+    names = execute(conn, sql, (json.dumps([row[0] for row in rows]),)).fetchall()
+    return [(names[i][0],) + tuple(rows[i][1:]) for i in range(len(rows))]
+
+# nearest_players
+# find the players of an alliance closest to a level and power by walking
+# outwards from the level through latest_alliance_lv: each level holds its
+# players in power order, so the closest in power are the first above and
+# below the power, and the next level either way is one index seek away
+# @param date, the players whose latest entry is in the week before date count
+# @param lv, power, the level and power to be close to; None matches any
+# @param limit, maximum number of players
+# @return (PlayerKey, Lv, Power, Date) of the closest players, closest in level
+#         and then in power first
+def nearest_players(conn, alliance, date, lv, power, limit):
+    if lv is None:
+        sql = '''SELECT PlayerKey, Lv, Power, Date FROM latest WHERE Alliance=?1 AND Date>date(?2, '-7 days') AND Date<?2'''
+        rows = execute(conn, sql, (alliance, date)).fetchall()
+        if power is not None:
+            rows.sort(key=lambda row: abs(row[2] - power))
+        return rows[:limit]
+    target = 0 if power is None else power
+
+    # level_rows
+    # @return the players of one level closest in power
+    def level_rows(level, count):
+        sql = '''
+            SELECT PlayerKey, Lv, Power, Date FROM latest
+            WHERE Alliance=?1 AND Lv=?2 AND Power>=?3 AND Date>date(?4, '-7 days') AND Date<?4
+            ORDER BY Power ASC LIMIT ?5
+            '''
+        rows = execute(conn, sql, (alliance, level, target, date, count)).fetchall()
+        sql = '''
+            SELECT PlayerKey, Lv, Power, Date FROM latest
+            WHERE Alliance=?1 AND Lv=?2 AND Power<?3 AND Date>date(?4, '-7 days') AND Date<?4
+            ORDER BY Power DESC LIMIT ?5
+            '''
+        rows += execute(conn, sql, (alliance, level, target, date, count)).fetchall()
+        return rows
+
+    # next_level
+    # @return the closest level above (step 1) or below (step -1) level that
+    #         has a player of the alliance, or None
+    def next_level(level, step):
+        if step > 0:
+            sql = '''SELECT MIN(Lv) FROM latest WHERE Alliance=? AND Lv>?'''
+        else:
+            sql = '''SELECT MAX(Lv) FROM latest WHERE Alliance=? AND Lv<?'''
+        return execute(conn, sql, (alliance, level)).fetchone()[0]
+
+    found = []
+    group = level_rows(lv, limit)
+    up = next_level(lv, 1)
+    down = next_level(lv, -1)
+    while True:
+        group.sort(key=lambda row: abs(row[2] - target))
+        found += group[:limit - len(found)]
+        if len(found) >= limit or (up is None and down is None):
+            return found
+        distance = min(abs(level - lv) for level in (up, down) if level is not None)
+        group = []
+        if up is not None and up - lv == distance:
+            group += level_rows(up, limit - len(found))
+            up = next_level(up, 1)
+        if down is not None and lv - down == distance:
+            group += level_rows(down, limit - len(found))
+            down = next_level(down, -1)
+
+# -----------------------------------------------------------------------------
+#                               SCREENSHOT CACHE
+# -----------------------------------------------------------------------------
+# init_screenshot_cache
+# create the table that maps the hash of a screenshot to what was read from it
+def init_screenshot_cache(conn):
+    sql = '''CREATE TABLE IF NOT EXISTS screenshot_cache (hash TEXT PRIMARY KEY, result TEXT, created TEXT, last_used TEXT)'''
+    execute(conn, sql)
+    sql = '''CREATE INDEX IF NOT EXISTS screenshot_cache_last_used ON screenshot_cache (last_used)'''
+    execute(conn, sql)
+
+# get_cached_screenshot
+# @param digest, the hash of the screenshot bytes
+# @param now, the current time as an ISO string
+# @return the cached result text, or None on a miss
+def get_cached_screenshot(conn, digest, now):
+    sql = '''SELECT result FROM screenshot_cache WHERE hash=?'''
+    row = execute(conn, sql, (digest,)).fetchone()
+    if row is None:
+        return None
+    sql = '''UPDATE screenshot_cache SET last_used=? WHERE hash=?'''
+    execute(conn, sql, (now, digest))
+    return row[0]
+
+# cache_screenshot
+# store a result, then evict entries last used before oldest, and the least
+# recently used entries beyond max_entries
+# @param digest, the hash of the screenshot bytes
+# @param result, the result text
+# @param now, the current time as an ISO string
+# @param oldest, entries last used before this ISO time are evicted
+# @param max_entries, the maximum number of entries to keep
+def cache_screenshot(conn, digest, result, now, oldest, max_entries):
+    sql = '''INSERT OR REPLACE INTO screenshot_cache (hash, result, created, last_used) VALUES (?, ?, ?, ?)'''
+    execute(conn, sql, (digest, result, now, now))
+    sql = '''DELETE FROM screenshot_cache WHERE last_used < ?'''
+    execute(conn, sql, (oldest,))
+    sql = '''DELETE FROM screenshot_cache WHERE hash NOT IN (SELECT hash FROM screenshot_cache ORDER BY last_used DESC LIMIT ?)'''
+    execute(conn, sql, (max_entries,))
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+#
+# FILENAME: stfc_discord.py
+# CREATED:  October 18, 2026
+# AUTHOR:   buerge3
+#
+# Discord helpers shared by vision-bot.py and plotty-bot.py: a command context
+# that packs lines of output into as few messages as discord allows, counts the
+# messages every command sends, and sends them through a per-channel queue
+# paced to discord's rate limits
+# Usage: "import stfc_discord"
+import time
+import asyncio
+import logging
+from collections import deque
+
+from discord.ext import commands
+
+# MODIFIABLE PARAMETERS
+max_message_length = 2000
+channel_rate = 5        # messages per channel_per seconds, discord's per-channel limit
+channel_per = 5.0
+
+# -----------------------------------------------------------------------------
+#                                    FUNCTIONS
+# -----------------------------------------------------------------------------
+# pack_lines
+# join lines into as few messages as possible without splitting a line, unless
+# the line is too long for a message on its own
+# @param lines, a list of strings
+# @param code_block, True to wrap every message in a ``` code block
+# @param limit, the maximum length of a message
+# @return a list of message strings
+def pack_lines(lines, code_block=False, limit=max_message_length):
+    if code_block:
+        limit -= len("```\n\n```")
+    chunks = []
+    for line in lines:
+        while len(line) > limit:
+            chunks.append(line[:limit])
+            line = line[limit:]
+        chunks.append(line)
+    msgs = []
+    msg = None
+    for chunk in chunks:
+        if msg is not None and len(msg) + 1 + len(chunk) <= limit:
+            msg += "\n" + chunk
+        else:
+            if msg is not None:
+                msgs.append(msg)
+            msg = chunk
+    if msg is not None:
+        msgs.append(msg)
+    if code_block:
+        msgs = ["```\n" + msg + "\n```" for msg in msgs]
+    return msgs
+
+# TokenBucket
+# paces a stream of sends to rate per per seconds: the bucket holds rate
+# tokens, every send takes one, and each token returns per seconds after it was
+# taken, so no window of per seconds ever sees more than rate sends
+class TokenBucket:
+    def __init__(self, rate, per):
+        self.per = per
+        self.taken = deque(maxlen=rate)
+
+    # acquire
+    # wait until a token is available, and take it
+    async def acquire(self):
+        if len(self.taken) == self.taken.maxlen:
+            wait = self.taken[0] + self.per - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+        self.taken.append(time.monotonic())
+
+# Lines
+# lines posted to an Outbox, sent with the same send function
+class Lines:
+    def __init__(self, send, code_block):
+        self.send = send
+        self.code_block = code_block
+        self.lines = []
+        self.futures = []
+
+# Message
+# one message sent to an Outbox
+class Message:
+    def __init__(self, send, args, kwargs, future):
+        self.send = send
+        self.args = args
+        self.kwargs = kwargs
+        self.future = future
+
+# Outbox
+# the messages waiting to be sent to one channel. They are sent one at a time,
+# paced by a token bucket, with priority messages (summaries) ahead of the
+# rest; lines posted one after another while the channel is busy are packed
+# into as few messages as possible.
+class Outbox:
+    def __init__(self, rate=channel_rate, per=channel_per):
+        self.bucket = TokenBucket(rate, per)
+        self.priority = deque()
+        self.queue = deque()
+        self.task = None
+
+    # post
+    # queue a line of output without waiting for it to be sent
+    # @param send, a coroutine function that sends one message string
+    # @param line, the line to send
+    # @param code_block, True to send the line inside a ``` code block
+    # @return a future that is done once the line has been sent
+    def post(self, send, line, code_block=False):
+        future = asyncio.get_event_loop().create_future()
+        last = self.queue[-1] if self.queue else None
+        if not isinstance(last, Lines) or last.send != send or last.code_block != code_block:
+            last = Lines(send, code_block)
+            self.queue.append(last)
+        last.lines.append(line)
+        last.futures.append(future)
+        self.start()
+        return future
+
+    # send
+    # queue a message and wait for it to be sent
+    # @param send, a coroutine function that sends one message
+    # @param priority, True to send the message before anything that is not
+    # @return the result of send(*args, **kwargs)
+    async def send(self, send, args, kwargs, priority=False):
+        future = asyncio.get_event_loop().create_future()
+        (self.priority if priority else self.queue).append(Message(send, args, kwargs, future))
+        self.start()
+        return await future
+
+    def start(self):
+        if self.task is None or self.task.done():
+            self.task = asyncio.ensure_future(self.run())
+
+    async def run(self):
+        while self.priority or self.queue:
+            item = self.priority.popleft() if self.priority else self.queue.popleft()
+            if isinstance(item, Lines):
+                error = None
+                for msg in pack_lines(item.lines, item.code_block):
+                    await self.bucket.acquire()
+                    try:
+                        await item.send(msg)
+                    except Exception as e:
+                        logging.error("failed to send a message: {}".format(e))
+                        error = e
+                for future in item.futures:
+                    if not future.done():
+                        future.set_result(error)
+            else:
+                await self.bucket.acquire()
+                try:
+                    result = await item.send(*item.args, **item.kwargs)
+                except Exception as e:
+                    if not item.future.done():
+                        item.future.set_exception(e)
+                else:
+                    if not item.future.done():
+                        item.future.set_result(result)
+
+# Context
+# the context of a command, which sends its messages through the Outbox of its
+# channel and counts them
+class Context(commands.Context):
+    def __init__(self, **attrs):
+        super().__init__(**attrs)
+        self.api_calls = 0
+        self.pending = []
+
+    async def send_now(self, *args, **kwargs):
+        self.api_calls += 1
+        return await super().send(*args, **kwargs)
+
+    # send
+    # queue a message and wait for it to be sent; messages with an embed are
+    # sent ahead of other commands' queued lines unless priority is given, but
+    # only once the lines this command posted have been sent
+    async def send(self, *args, priority=None, **kwargs):
+        if priority is None:
+            priority = kwargs.get("embed") is not None
+        if priority:
+            await self.flush()
+        return await self.bot.get_outbox(self.channel).send(self.send_now, args, kwargs, priority)
+
+    # post
+    # queue a line of output, e.g. a warning, without waiting for it to be sent
+    # @param line, a string
+    # @param code_block, True to send the line inside a ``` code block
+    def post(self, line, code_block=False):
+        self.pending.append(self.bot.get_outbox(self.channel).post(self.send_now, line, code_block))
+
+    # send_lines
+    # send lines of output in as few messages as possible
+    # @param lines, a list of strings
+    # @param code_block, True to wrap every message in a ``` code block
+    async def send_lines(self, lines, code_block=False):
+        for line in lines:
+            self.post(line, code_block)
+        await self.flush()
+
+    # flush
+    # wait until every line posted by this command has been sent
+    async def flush(self):
+        pending, self.pending = self.pending, []
+        await asyncio.gather(*pending)
+
+# Bot
+# a commands.Bot whose commands get a Context, with an Outbox per channel, and
+# which logs the number of messages each command sent
+class Bot(commands.Bot):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.outboxes = {}
+
+    # get_outbox
+    # @return the Outbox of a channel
+    def get_outbox(self, channel):
+        if channel.id not in self.outboxes:
+            self.outboxes[channel.id] = Outbox()
+        return self.outboxes[channel.id]
+
+    async def get_context(self, message, *, cls=Context):
+        return await super().get_context(message, cls=cls)
+
+    async def invoke(self, ctx):
+        await super().invoke(ctx)
+        await ctx.flush()
+        if ctx.command is not None:
+            logging.info("!{} sent {} messages".format(ctx.command.qualified_name, ctx.api_calls))
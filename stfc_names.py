@@ -0,0 +1,407 @@
+#!/usr/bin/env python3
+#
+# FILENAME: stfc_names.py
+# CREATED:  October 18, 2026
+# AUTHOR:   buerge3
+#
+# Resolves OCR'd player names against the known names. NameIndex is a
+# SymSpell-style deletion index: every known name is stored under each string
+# that can be made from its first prefix_length characters by deleting up to
+# max_distance of them, so the names within reach of a misread are found with a
+# few dictionary lookups instead of by generating every possible edit. The
+# candidates are then ranked by an edit distance in which the substitutions
+# Tesseract is prone to (l/1/I, O/0, rn/m, ...) are cheap.
+# load_alias_index builds the index of the names of every real player in the
+# alias table, starting from a snapshot of the index saved by the previous run.
+# reconcile matches the rows of a screenshot whose names could not be resolved
+# to the players of the alliance's previous roster by their position, level and
+# power, since a roster is ordered by power and changes little from day to day.
+# Usage: "import stfc_names; NAMES = stfc_names.load_alias_index(conn, snapshot_file)"
+import time
+import pickle
+import logging
+
+import stfc_db
+
+# MODIFIABLE PARAMETERS
+max_distance = 2
+prefix_length = 7
+snapshot_version = 2
+roster_level_gain = 1       # levels a player may gain between two uploads
+roster_power_loss = 0.05    # the fraction of their power a player may lose between two uploads
+roster_power_gain = 0.25    # the fraction of their power a player may gain between two uploads
+roster_margin = 0.5         # how much better than any other player a match must fit
+
+# the cost of replacing one string with another, for the misreads OCR makes;
+# every other substitution costs 1. Names are compared in lowercase.
+ocr_confusions = {
+    ("l", "1"): 0.25,
+    ("l", "i"): 0.25,
+    ("1", "i"): 0.25,
+    ("l", "|"): 0.25,
+    ("o", "0"): 0.25,
+    ("s", "5"): 0.5,
+    ("b", "8"): 0.5,
+    ("z", "2"): 0.5,
+    ("g", "9"): 0.5,
+    ("rn", "m"): 0.25,
+    ("vv", "w"): 0.25,
+    ("cl", "d"): 0.5,
+}
+
+# -----------------------------------------------------------------------------
+#                                    FUNCTIONS
+# -----------------------------------------------------------------------------
+# both directions of every confusion: SUBSTITUTIONS[x][y] is the cost of
+# reading character y as x, DIGRAPHS[xy][z] the cost of reading z as xy
+SUBSTITUTIONS = {}
+DIGRAPHS = {}
+for (a, b), cost in ocr_confusions.items():
+    for x, y in ((a, b), (b, a)):
+        if len(x) == 1 and len(y) == 1:
+            SUBSTITUTIONS.setdefault(x, {})[y] = cost
+        elif len(x) == 2 and len(y) == 1:
+            DIGRAPHS.setdefault(x, {})[y] = cost
+
+# ocr_distance
+# the cost of turning one lowercase string into another with insertions,
+# deletions, transpositions and substitutions, where the substitutions in
+# ocr_confusions are cheaper than 1. The common prefix and suffix are skipped,
+# so comparing a misread with its name only looks at the misread characters.
+# @param a, the misread string
+# @param b, a known name
+# @param limit, give up as soon as the cost must exceed this
+# @return the cost, or None if it exceeds limit
+def ocr_distance(a, b, limit=max_distance):
+    if abs(len(a) - len(b)) > limit:
+        return None
+    n = len(a)
+    m = len(b)
+    while n and m and a[n - 1] == b[m - 1]:
+        n -= 1
+        m -= 1
+    start = 0
+    while start < n and start < m and a[start] == b[start]:
+        start += 1
+    a = a[start:n]
+    b = b[start:m]
+    n -= start
+    m -= start
+    if n == 0 or m == 0:
+        return max(n, m) if max(n, m) <= limit else None
+    b_pairs = [None, None] + [DIGRAPHS.get(b[j - 2:j]) for j in range(2, m + 1)]
+    prev2 = None
+    prev = list(range(m + 1))
+    for i in range(1, n + 1):
+        ca = a[i - 1]
+        subs = SUBSTITUTIONS.get(ca)
+        a_pair = DIGRAPHS.get(a[i - 2:i]) if i > 1 else None
+        row = [i]
+        left = i
+        for j in range(1, m + 1):
+            cb = b[j - 1]
+            if ca == cb:
+                cost = prev[j - 1]
+            else:
+                cost = prev[j - 1] + (subs.get(cb, 1) if subs else 1)
+                if prev[j] + 1 < cost:
+                    cost = prev[j] + 1
+                if left + 1 < cost:
+                    cost = left + 1
+                if i > 1 and j > 1 and ca == b[j - 2] and a[i - 2] == cb and prev2[j - 2] + 1 < cost:
+                    cost = prev2[j - 2] + 1
+                if a_pair is not None and cb in a_pair and prev2[j - 1] + a_pair[cb] < cost:
+                    cost = prev2[j - 1] + a_pair[cb]
+                b_pair = b_pairs[j]
+                if b_pair is not None and ca in b_pair and prev[j - 2] + b_pair[ca] < cost:
+                    cost = prev[j - 2] + b_pair[ca]
+            row.append(cost)
+            left = cost
+        if min(row) > limit and min(prev) > limit:
+            return None
+        prev2 = prev
+        prev = row
+    return prev[m] if prev[m] <= limit else None
+
+# deletes
+# @param word, a string
+# @param distance, the maximum number of characters to delete
+# @return every string made by deleting up to distance characters from word,
+#         including word itself
+def deletes(word, distance):
+    result = {word}
+    frontier = {word}
+    for n in range(distance):
+        frontier = {w[:i] + w[i + 1:] for w in frontier for i in range(len(w))}
+        result |= frontier
+    return result
+
+# NameIndex
+# the known player names, with the number of times each was added
+class NameIndex:
+    def __init__(self, distance=max_distance, prefix=prefix_length):
+        self.distance = distance
+        self.prefix = prefix
+        self.names = {}
+        self.index = {}
+
+    def __contains__(self, name):
+        return name.lower() in self.names
+
+    def __len__(self):
+        return len(self.names)
+
+    # add
+    # @param name, a player name; names are case-insensitive
+    # @param count, how many more times the name has been seen
+    def add(self, name, count=1):
+        name = name.lower()
+        if name in self.names:
+            self.names[name] += count
+            return
+        self.names[name] = count
+        for key in deletes(name[:self.prefix], self.distance):
+            self.index.setdefault(key, []).append(name)
+
+    # load_words
+    # @param names, an iterable of player names
+    def load_words(self, names):
+        for name in names:
+            self.add(name)
+
+    # candidates
+    # @param word, a possibly misread name
+    # @param limit, the maximum number of candidates to return
+    # @return a list of (name, cost) of the known names within the edit distance
+    #         of word, cheapest first and then most often seen
+    def candidates(self, word, limit=None):
+        word = word.lower()
+        found = set()
+        for key in deletes(word[:self.prefix], self.distance):
+            found.update(self.index.get(key, ()))
+        ranked = []
+        for name in found:
+            cost = ocr_distance(word, name, self.distance)
+            if cost is not None:
+                ranked.append((cost, -self.names[name], name))
+        ranked.sort()
+        return [(name, cost) for cost, count, name in ranked[:limit]]
+
+    # correction
+    # @param word, a possibly misread name
+    # @return the best candidate for word, or word itself if there is none
+    def correction(self, word):
+        if word in self:
+            return word.lower()
+        ranked = self.candidates(word, 1)
+        return ranked[0][0] if ranked else word
+
+# resolve
+# look a name up in a list of indexes, e.g. the players of one alliance and then
+# every known player: first for an exact match in any of them, then for the
+# best correction in the first one that has a candidate
+# @param word, a possibly misread name
+# @param tiers, a list of (tier name, NameIndex), narrowest first
+# @return (name, tier name, corrected), or (None, None, False) if nothing matched
+def resolve(word, tiers):
+    for tier, index in tiers:
+        if word in index:
+            return word, tier, False
+    for tier, index in tiers:
+        ranked = index.candidates(word, 1)
+        if ranked:
+            return ranked[0][0], tier, True
+    return None, None, False
+
+# -----------------------------------------------------------------------------
+#                                  SNAPSHOTS
+# -----------------------------------------------------------------------------
+# save_snapshot
+# @param index, a NameIndex
+# @param path, the file to write
+# @param rowid, the ROWID of the last alias row in the index
+# @param checksum, the (count, sum of ROWIDs) of the alias rows in the index
+def save_snapshot(index, path, rowid, checksum):
+    state = (snapshot_version, index.distance, index.prefix, rowid, checksum, index.names, index.index)
+    with open(path, "wb") as file:
+        pickle.dump(state, file, protocol=pickle.HIGHEST_PROTOCOL)
+
+# load_snapshot
+# @param path, a file written by save_snapshot
+# @return (index, rowid, checksum), or (None, 0, (0, 0)) if there is no usable
+#         snapshot
+def load_snapshot(path):
+    try:
+        with open(path, "rb") as file:
+            version, distance, prefix, rowid, checksum, names, index = pickle.load(file)
+    except (OSError, EOFError, ValueError, pickle.UnpicklingError) as e:
+        logging.info("not using the name snapshot {}: {}".format(path, e))
+        return None, 0, (0, 0)
+    if version != snapshot_version or distance != max_distance or prefix != prefix_length:
+        logging.info("not using the name snapshot {}: it was built with other settings".format(path))
+        return None, 0, (0, 0)
+    name_index = NameIndex(distance, prefix)
+    name_index.names = names
+    name_index.index = index
+    return name_index, rowid, checksum
+
+# load_alias_index
+# load the snapshot and add the alias rows of real players added since it was
+# saved. Only the alias rows of players with an LVE entry or a display name and
+# the names added by hand are indexed, so the names of the backlog do not
+# become known names. The index is rebuilt from the whole alias table if the
+# real players' rows up to the snapshot have changed since, because rows were
+# removed or a name that was only in the backlog has since been confirmed,
+# added or merged into a player. The snapshot is rewritten whenever it was out
+# of date.
+# @param conn, a connection to the LVE database
+# @param path, the snapshot file
+# @return a NameIndex of every name of a real player in the alias table
+def load_alias_index(conn, path):
+    start = time.perf_counter()
+    index, rowid, checksum = load_snapshot(path)
+    if index is not None and stfc_db.sum_player_alias_rows(conn, rowid) != checksum:
+        logging.info("alias rows changed since the name snapshot was saved; rebuilding it")
+        index, rowid, checksum = None, 0, (0, 0)
+    source = "snapshot"
+    if index is None:
+        index = NameIndex()
+        source = "alias table"
+    rows = stfc_db.get_player_alias_rows(conn, rowid)
+    for rowid, name in rows:
+        index.add(name)
+    checksum = (checksum[0] + len(rows), checksum[1] + sum(row[0] for row in rows))
+    if rows or source != "snapshot":
+        save_snapshot(index, path, rowid, checksum)
+    logging.info("loaded {} names from the {} (+{} new alias rows) in {:.0f}ms".format(len(index), source,
+        len(rows) if source == "snapshot" else 0, (time.perf_counter() - start) * 1000))
+    return index
+
+# -----------------------------------------------------------------------------
+#                             ROSTER RECONCILIATION
+# -----------------------------------------------------------------------------
+# load_previous_roster
+# @param conn, a connection to the LVE database
+# @param alliance, a lowercase alliance name
+# @param date, a date string
+# @return the roster of an alliance on the last day before date it was uploaded,
+#         as a list of (key, names, Lv, Power) ordered by power, where names is
+#         a list of the player's lowercase names, newest first
+def load_previous_roster(conn, alliance, date):
+    rows = stfc_db.get_previous_roster(conn, alliance, date)
+    names = {}
+    for key, name in stfc_db.get_names_of_keys(conn, [row[0] for row in rows]):
+        if name.lower() not in names.setdefault(key, []):
+            names[key].append(name.lower())
+    return [(key, names[key], lv, power) for key, lv, power in rows if key in names]
+
+# roster_score
+# @param lv, power, the level and power read from a screenshot row
+# @param roster_lv, roster_power, the level and power of a player on the
+#        previous roster
+# @return how well the row fits the player, at most 1, or None if the row
+#         cannot be them
+def roster_score(lv, power, roster_lv, roster_power):
+    if lv < roster_lv or lv > roster_lv + roster_level_gain or roster_power <= 0:
+        return None
+    change = (power - roster_power) / roster_power
+    if change < -roster_power_loss or change > roster_power_gain:
+        return None
+    return 1 - abs(change) / roster_power_gain - (lv - roster_lv) * 0.25
+
+# reconcile
+# align the rows of a screenshot with the previous roster of the alliance: both
+# are ordered by power, so the rows are matched to the roster in order, a row
+# with a known name to that player and an unrecognized row to the player whose
+# level and power fit it best. An unrecognized row is only resolved if no other
+# player between its neighbours' matches fits it nearly as well, and no player
+# elsewhere on the roster, who would have changed places since, fits it better.
+# @param rows, a list of (name, lv, power) in screenshot order, where name is a
+#        resolved lowercase name or None if the name was not recognized, and lv
+#        and power are None if they could not be read
+# @param roster, a roster as returned by load_previous_roster
+# @param used, the indexes into roster of the players already matched to other
+#        rows of the same upload
+# @return a list with, for every unrecognized row, the index into roster of the
+#         player it was resolved to, and None for every other row
+def reconcile(rows, roster, used=()):
+    n = len(rows)
+    m = len(roster)
+    scores = []
+    for name, lv, power in rows:
+        row_scores = []
+        for j, (key, names, roster_lv, roster_power) in enumerate(roster):
+            if name is not None:
+                row_scores.append(2 if name in names else None)
+            elif lv is None or power is None or j in used:
+                row_scores.append(None)
+            else:
+                row_scores.append(roster_score(lv, power, roster_lv, roster_power))
+        scores.append(row_scores)
+
+    # best[i][j] is the best total score of matching the first i rows with the
+    # first j players in order
+    best = [[0.0] * (m + 1) for i in range(n + 1)]
+    for i in range(1, n + 1):
+        row_scores = scores[i - 1]
+        for j in range(1, m + 1):
+            total = max(best[i][j - 1], best[i - 1][j])
+            score = row_scores[j - 1]
+            if score is not None and best[i - 1][j - 1] + score > total:
+                total = best[i - 1][j - 1] + score
+            best[i][j] = total
+    match = [None] * n
+    i = n
+    j = m
+    while i and j:
+        score = scores[i - 1][j - 1]
+        if score is not None and best[i][j] == best[i - 1][j - 1] + score:
+            match[i - 1] = j - 1
+            i -= 1
+            j -= 1
+        elif best[i][j] == best[i - 1][j]:
+            i -= 1
+        else:
+            j -= 1
+
+    result = [None] * n
+    taken = set(j for i, j in enumerate(match) if j is not None and rows[i][0] is not None)
+    for i, (name, lv, power) in enumerate(rows):
+        j = match[i]
+        if name is not None or j is None:
+            continue
+        lower = max([match[k] for k in range(i) if rows[k][0] is not None and match[k] is not None], default=-1)
+        upper = min([match[k] for k in range(i + 1, n) if rows[k][0] is not None and match[k] is not None], default=m)
+        if all(k == j or k in taken or scores[i][k] is None or
+                scores[i][k] < scores[i][j] - (roster_margin if lower < k < upper else 0) for k in range(m)):
+            result[i] = j
+    return result
+
+# resolve_rows
+# resolve the names of the rows of a screenshot with resolve, then match the
+# rows it cannot resolve to the previous roster with reconcile
+# @param rows, a list of (word, lv, power) as read from a screenshot, where word
+#        is None if the row could not be read
+# @param tiers, see resolve
+# @param roster, used, see reconcile; used gets the players matched to the rows
+# @return a list of (name, tier name, corrected) for every row, see resolve;
+#         the tier name is "roster" for rows matched by reconcile
+def resolve_rows(rows, tiers, roster, used):
+    resolved = []
+    aligned = []
+    for word, lv, power in rows:
+        if word is None:
+            resolved.append((None, None, False))
+            aligned.append(("", None, None))
+            continue
+        name, tier, corrected = resolve(word, tiers)
+        resolved.append((name, tier, corrected))
+        aligned.append((name.lower(), None, None) if name is not None else (None, lv, power))
+    matches = reconcile(aligned, roster, used)
+    for i, (name, lv, power) in enumerate(aligned):
+        if name:
+            used.update(j for j, player in enumerate(roster) if name in player[1])
+        elif name is None and matches[i] is not None:
+            used.add(matches[i])
+            resolved[i] = (roster[matches[i]][1][0], "roster", True)
+    return resolved
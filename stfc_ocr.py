@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+#
+# FILENAME: stfc_ocr.py
+# CREATED:  October 18, 2026
+# AUTHOR:   buerge3
+#
+# OCR backends shared by vision-bot.py and vision-test.py. The tesserocr backend
+# keeps a pool of warm Tesseract engines so that reading an image does not fork
+# the tesseract binary and round-trip through temp files every time; the
+# pytesseract backend is used when tesserocr is not installed.
+# Usage: "import stfc_ocr; OCR = stfc_ocr.create_backend(pool_size)"
+import logging
+import queue
+from contextlib import contextmanager
+
+import pytesseract
+
+try:
+    import tesserocr
+except ImportError:
+    tesserocr = None
+
+# MODIFIABLE PARAMETERS
+ocr_lang = "eng"
+
+# -----------------------------------------------------------------------------
+#                                   BACKENDS
+# -----------------------------------------------------------------------------
+# PytesseractBackend
+# runs the tesseract binary once per call
+class PytesseractBackend:
+    name = "pytesseract"
+
+    # image_to_string
+    # @param im, the image to read
+    # @param psm, the Tesseract page segmentation mode
+    # @return the text in the image
+    def image_to_string(self, im, psm=3):
+        return pytesseract.image_to_string(im, lang=ocr_lang, config='--psm {}'.format(psm))
+
+    # image_to_data
+    # @param im, the image to read
+    # @param psm, the Tesseract page segmentation mode
+    # @return the words in the image, in the form of pytesseract.Output.DICT
+    def image_to_data(self, im, psm=3):
+        return pytesseract.image_to_data(im, lang=ocr_lang, config='--psm {}'.format(psm), output_type=pytesseract.Output.DICT)
+
+    def close(self):
+        pass
+
+# TesserocrPool
+# a fixed number of Tesseract engines that stay loaded for the lifetime of the
+# process; a call blocks until an engine is free
+class TesserocrPool:
+    name = "tesserocr"
+
+    def __init__(self, size):
+        self.size = size
+        self.engines = queue.Queue()
+        for i in range(size):
+            self.engines.put(tesserocr.PyTessBaseAPI(lang=ocr_lang))
+
+    # engine
+    # borrow an engine from the pool for the duration of a with-block
+    @contextmanager
+    def engine(self, im, psm):
+        api = self.engines.get()
+        try:
+            api.SetPageSegMode(psm)
+            api.SetImage(im)
+            yield api
+        finally:
+            api.Clear()
+            self.engines.put(api)
+
+    def image_to_string(self, im, psm=3):
+        with self.engine(im, psm) as api:
+            return api.GetUTF8Text()
+
+    def image_to_data(self, im, psm=3):
+        data = {"text": [], "conf": [], "left": [], "top": [], "width": [], "height": []}
+        with self.engine(im, psm) as api:
+            api.Recognize()
+            level = tesserocr.RIL.WORD
+            for word in tesserocr.iterate_level(api.GetIterator(), level):
+                box = word.BoundingBox(level)
+                if box is None:
+                    continue
+                x1, y1, x2, y2 = box
+                data["text"].append(word.GetUTF8Text(level))
+                data["conf"].append(word.Confidence(level))
+                data["left"].append(x1)
+                data["top"].append(y1)
+                data["width"].append(x2 - x1)
+                data["height"].append(y2 - y1)
+        return data
+
+    def close(self):
+        while not self.engines.empty():
+            self.engines.get().End()
+
+# create_backend
+# @param pool_size, the number of warm Tesseract engines to keep
+# @param use_pool, False to always use the pytesseract backend
+# @return a pool of warm engines if tesserocr is available, otherwise the pytesseract backend
+def create_backend(pool_size, use_pool=True):
+    if use_pool and tesserocr is not None and pool_size > 0:
+        try:
+            backend = TesserocrPool(pool_size)
+            logging.info("using a pool of {} tesserocr engines for OCR".format(pool_size))
+            return backend
+        except RuntimeError as err:
+            logging.error("failed to start tesserocr engines: {}".format(err))
+    logging.info("using pytesseract for OCR")
+    return PytesseractBackend()
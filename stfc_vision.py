@@ -0,0 +1,445 @@
+#!/usr/bin/env python3
+#
+# FILENAME: stfc_vision.py
+# CREATED:  October 18, 2026
+# AUTHOR:   buerge3
+#
+# Image-processing helpers shared by vision-bot.py and vision-test.py
+# Usage: "import stfc_vision"
+import math
+import re
+import io
+import time
+import logging
+import asyncio
+import hashlib
+import sqlite3
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image
+from PIL import ImageChops
+
+import stfc_ocr
+
+# MODIFIABLE PARAMETERS
+fallback_thresholds = [220, 200, 180, 160]
+num_rows = 7
+row_padding = 20
+
+# how often each strategy of find_rgb_filter produced the filter that was used
+# in this process; worker processes return the strategy of every screenshot in
+# its result instead, for the bot to add up
+FILTER_STATS = {"cached": 0, "histogram": 0, "fallback": 0, "failed": 0}
+
+# the last filter that worked for each screenshot resolution (i.e. each device)
+device_filters = {}
+
+# the OCR backend and row cache of a ScreenshotWorkers worker process
+worker_ocr = None
+worker_row_cache = None
+
+# -----------------------------------------------------------------------------
+#                                    FUNCTIONS
+# -----------------------------------------------------------------------------
+# threshold_band
+# @param band, a single-channel ("L") image
+# @param threshold, the minimum channel value that counts as text
+# @return a bilevel ("1") image that is set wherever band >= threshold
+def threshold_band(band, threshold):
+    lut = [255 if v >= threshold else 0 for v in range(256)]
+    return band.point(lut, mode="1")
+
+# get_text_mask
+# compare every channel against its threshold in one pass per channel
+# @param im, the image to build a mask for
+# @param rgb, a three-element list consisting of the rgb values for the mask threshold
+# @param x_percent, what percentage of the width to ignore on the left
+# @return a bilevel ("1") image that is set for pixels which belong to text
+def get_text_mask(im, rgb, x_percent):
+    width, height = im.size
+    x_cutoff = math.floor(width * x_percent)
+    bands = im.convert("RGB").split()
+    mask = threshold_band(bands[0], rgb[0])
+    for band, threshold in zip(bands[1:], rgb[1:]):
+        mask = ImageChops.logical_and(mask, threshold_band(band, threshold))
+    if x_cutoff > 0:
+        mask.paste(0, (0, 0, min(x_cutoff, width), height))
+    return mask
+
+# apply_img_mask
+# modify the supplied image s.t. all pixel values below the threshold become white, and all
+# pixels above the threshold become black. Drop-in replacement for the old per-pixel loop.
+# @param im, the image to apply a mask to
+# @param rgb, a three-element list consisting of the rgb values for the mask threshold
+# @param x_percent, what percentage of the width to crop off from the left. Used to
+#        remove STFC rank symbols for premier, commodore, etc
+# @return im, for convenience; the image is modified in place
+def apply_img_mask(im, rgb, x_percent):
+    mask = get_text_mask(im, rgb, x_percent)
+    num_bands = len(im.getbands())
+    white = (255, 255, 255, 255)[:num_bands]
+    black = (0, 0, 0, 0)[:num_bands]
+    if num_bands == 1:
+        white, black = white[0], black[0]
+    im.paste(white, (0, 0) + im.size)
+    im.paste(black, (0, 0) + im.size, mask)
+    return im
+
+# get_header
+# @param im, an STFC roster screenshot
+# @return the strip at the top of the screenshot which contains the word "MEMBERS"
+def get_header(im):
+    width, height = im.size
+    return im.crop((0, 0, width, math.floor(height/10)))
+
+# otsu_threshold
+# find the threshold that best separates the bright header text from the
+# background, using the darkest channel of each pixel since the mask requires
+# every channel to be above the threshold
+# @param im, the header strip of an STFC roster screenshot
+# @return an integer threshold between 0 and 255
+def otsu_threshold(im):
+    r, g, b = im.convert("RGB").split()
+    hist = ImageChops.darker(ImageChops.darker(r, g), b).histogram()
+    total = sum(hist)
+    sum_all = sum(v * hist[v] for v in range(256))
+    sum_bg = 0
+    weight_bg = 0
+    best_var = -1
+    best_t = fallback_thresholds[0]
+    for t in range(256):
+        weight_bg += hist[t]
+        if weight_bg == 0:
+            continue
+        weight_fg = total - weight_bg
+        if weight_fg == 0:
+            break
+        sum_bg += t * hist[t]
+        mean_bg = sum_bg / weight_bg
+        mean_fg = (sum_all - sum_bg) / weight_fg
+        var = weight_bg * weight_fg * (mean_bg - mean_fg) ** 2
+        if var > best_var:
+            best_var = var
+            best_t = t + 1 # pixels >= best_t are foreground
+    return best_t
+
+# header_matches
+# @param im, an STFC roster screenshot
+# @param rgb, the filter to try
+# @param read_text, a function that converts an image to a string
+# @return True if the word "MEMBERS" can be read in the header using this filter
+def header_matches(im, rgb, read_text):
+    im_rgb = apply_img_mask(get_header(im), rgb, 0)
+    word = read_text(im_rgb)
+    logging.debug("I read: " + word)
+    return bool(re.search(r"MEMBERS", word))
+
+# find_rgb_filter
+# pick a filter from the last one that worked on this device, or from the header
+# histogram, and confirm it with a single OCR call. If that fails, fall back to
+# guessing filters until the word "MEMBERS" can be read
+# @param im, the STFC roster screenshot to find appropriate filter values for
+# @param read_text, a function that converts an image to a string; any exception
+#        it raises is passed on to the caller
+# @return rgb, a three-element list consisting of the rgb values for the filter, or None
+def find_rgb_filter(im, read_text):
+    return pick_rgb_filter(im, read_text)[0]
+
+# pick_rgb_filter
+# find_rgb_filter, also saying which strategy produced the filter
+# @return (rgb, source), where rgb is None and source is "failed" if no filter
+#         worked; source is one of the keys of FILTER_STATS
+def pick_rgb_filter(im, read_text):
+    if im.size in device_filters:
+        source = "cached"
+        rgb = list(device_filters[im.size])
+    else:
+        source = "histogram"
+        threshold = otsu_threshold(get_header(im))
+        threshold = min(max(threshold, min(fallback_thresholds)), max(fallback_thresholds))
+        rgb = [threshold] * 3
+
+    candidates = [(source, rgb)]
+    for threshold in fallback_thresholds:
+        if threshold != rgb[0]:
+            candidates.append(("fallback", [threshold] * 3))
+
+    for source, rgb in candidates:
+        if header_matches(im, rgb, read_text):
+            logging.debug("found a working filter {} from the {} strategy".format(rgb, source))
+            FILTER_STATS[source] += 1
+            device_filters[im.size] = rgb
+            return rgb, source
+    FILTER_STATS["failed"] += 1
+    device_filters.pop(im.size, None)
+    return None, "failed"
+
+# get_name_rows
+# @param im, a masked STFC roster screenshot
+# @return a list of the name/level strips, one per roster row
+def get_name_rows(im):
+    width, height = im.size
+    rows = []
+    for k in range(num_rows):
+        a = 2 * height / 10
+        b = (( height - a) / num_rows ) * k
+        c = (( height - a) / num_rows ) * (k + 1)
+        rows.append(im.crop((  0, math.floor( a + b ) , math.floor(width/2), math.floor( a + c ) )))
+    return rows
+
+# stitch_rows
+# stack the row strips on top of each other, separated by white padding, so that
+# they can be read with a single OCR call
+# @param rows, a list of images of the same width
+# @return the stitched image, and a list of the (top, bottom) pixel band of each row
+def stitch_rows(rows):
+    width = max(row.size[0] for row in rows)
+    height = sum(row.size[1] for row in rows) + row_padding * (len(rows) + 1)
+    stitched = Image.new(rows[0].mode, (width, height), (255,) * len(rows[0].getbands()))
+    bands = []
+    top = row_padding
+    for row in rows:
+        stitched.paste(row, (0, top))
+        bands.append((top, top + row.size[1]))
+        top += row.size[1] + row_padding
+    return stitched, bands
+
+# find_band
+# @param bands, a list of (top, bottom) pixel bands
+# @param y, a vertical pixel position
+# @return the index of the band that contains y, or the closest band if none does
+def find_band(bands, y):
+    distances = []
+    for top, bottom in bands:
+        if top <= y < bottom:
+            distances.append(0)
+        else:
+            distances.append(min(abs(y - top), abs(y - bottom)))
+    return distances.index(min(distances))
+
+# read_rows
+# read every row strip with one OCR call and split the words back into rows by
+# their vertical position. Rows found in the cache are not read again, and if
+# every row is cached no OCR call is made at all
+# @param rows, a list of row strips
+# @param read_data, a function that returns the words of an image in the form of
+#        pytesseract.image_to_data(..., output_type=Output.DICT)
+# @param cache, an optional RowCache
+# @return a list with the text of each row; rows with no words are ""
+def read_rows(rows, read_data, cache=None):
+    texts = [None] * len(rows)
+    keys = [None] * len(rows)
+    if cache is not None:
+        for k in range(len(rows)):
+            keys[k] = RowCache.key(rows[k])
+            texts[k] = cache.get(keys[k])
+    missed = [k for k in range(len(rows)) if texts[k] is None]
+    if len(missed) == 0:
+        return texts
+
+    stitched, bands = stitch_rows([rows[k] for k in missed])
+    data = read_data(stitched)
+    words = [[] for k in missed]
+    for i in range(len(data["text"])):
+        text = data["text"][i].strip()
+        if text == "":
+            continue
+        center = data["top"][i] + data["height"][i] / 2
+        words[find_band(bands, center)].append((data["left"][i], text))
+    for k, row_words in zip(missed, words):
+        texts[k] = " ".join(text for left, text in sorted(row_words))
+        if cache is not None and parse_name_line(texts[k]) is not None:
+            cache.put(keys[k], texts[k])
+    return texts
+
+# RowCache
+# a bounded LRU of the OCR text of masked name strips, keyed on a hash of the
+# strip's pixels, with an optional on-disk tier that survives restarts and is
+# shared by every worker process. The disk tier is an LRU too: every hit
+# refreshes the row's last_used time, and the rows used least recently are
+# evicted first.
+class RowCache:
+
+    # @param size, the maximum number of rows to keep in memory (and on disk)
+    # @param path, an sqlite file for the on-disk tier, or None to keep rows in memory only
+    def __init__(self, size, path=None):
+        self.size = size
+        self.rows = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.touched = {}
+        self.conn = None
+        if path is not None:
+            self.conn = sqlite3.connect(path, timeout=10)
+            self.conn.execute('''CREATE TABLE IF NOT EXISTS row_cache (hash TEXT PRIMARY KEY, text TEXT, last_used REAL DEFAULT 0)''')
+            columns = [row[1] for row in self.conn.execute('''PRAGMA table_info(row_cache)''')]
+            if "last_used" not in columns:
+                self.conn.execute('''ALTER TABLE row_cache ADD COLUMN last_used REAL DEFAULT 0''')
+            self.conn.execute('''CREATE INDEX IF NOT EXISTS row_cache_last_used ON row_cache (last_used)''')
+            self.conn.commit()
+
+    # key
+    # @param row, a masked name strip
+    # @return a hash of the strip's pixels
+    @staticmethod
+    def key(row):
+        digest = hashlib.sha1(row.tobytes())
+        digest.update("{}{}".format(row.mode, row.size).encode())
+        return digest.hexdigest()
+
+    # get
+    # @return the cached text, or None on a miss
+    def get(self, key):
+        text = self.rows.get(key)
+        if text is None and self.conn is not None:
+            row = self.conn.execute('''SELECT text FROM row_cache WHERE hash=?''', (key,)).fetchone()
+            if row is not None:
+                text = row[0]
+                self.remember(key, text)
+                self.conn.execute('''UPDATE row_cache SET last_used=? WHERE hash=?''', (time.time(), key))
+                self.conn.commit()
+        elif text is not None and self.conn is not None:
+            # hits in memory refresh the disk tier with the next write
+            self.touched[key] = time.time()
+        if text is None:
+            self.misses += 1
+            return None
+        self.rows.move_to_end(key)
+        self.hits += 1
+        return text
+
+    def put(self, key, text):
+        self.remember(key, text)
+        if self.conn is not None:
+            self.touched.pop(key, None)
+            self.conn.executemany('''UPDATE row_cache SET last_used=? WHERE hash=?''', [(used, hash) for hash, used in self.touched.items()])
+            self.touched = {}
+            self.conn.execute('''INSERT OR REPLACE INTO row_cache (hash, text, last_used) VALUES (?, ?, ?)''', (key, text, time.time()))
+            excess = self.conn.execute('''SELECT COUNT(*) FROM row_cache''').fetchone()[0] - self.size
+            if excess > 0:
+                self.conn.execute('''DELETE FROM row_cache WHERE hash IN (SELECT hash FROM row_cache ORDER BY last_used, rowid LIMIT ?)''', (excess,))
+            self.conn.commit()
+
+    # remember
+    # add a row to the in-memory tier, evicting the least recently used row if it is full
+    def remember(self, key, text):
+        self.rows[key] = text
+        self.rows.move_to_end(key)
+        while len(self.rows) > self.size:
+            self.rows.popitem(last=False)
+
+# parse_name_line
+# extract a player level and name from one line of the roster
+# @param text, the OCR output for one row strip
+# @return (level, name), or None if the line is not in the expected format
+def parse_name_line(text):
+    booboo = re.search(r"[1-5][\]\)l] ", text)
+    if (bool(booboo)):
+        text = text[booboo.start()] + "1 " + text[booboo.end():]
+    match = re.search(r"[0-9]+ {1,3}\S", text)
+    if not bool(match):
+        return None
+    text = text[match.start():]
+    lv, name = re.split(' {1,3}', text, 1)
+    name = name.replace(" ", "_")
+    name = re.sub(r'^[0-9]+_', '', name)
+    heart_match = re.search(r"[a-zA-Z0-9]", name); # check for extra whitespace created by hearts
+    if (bool(heart_match)):
+        name = name[heart_match.start():] # handle extra whitespace created by hearts
+    return lv, name
+
+# -----------------------------------------------------------------------------
+#                                WORKER PROCESSES
+# -----------------------------------------------------------------------------
+# init_worker
+# start the OCR engines and row cache of a worker process
+# @param ocr_pool_size, the number of warm Tesseract engines per worker
+# @param row_cache_size, the maximum number of name strips to cache
+# @param row_cache_path, an sqlite file for the on-disk tier of the row cache, or None
+def init_worker(ocr_pool_size, row_cache_size=0, row_cache_path=None):
+    global worker_ocr, worker_row_cache
+    worker_ocr = stfc_ocr.create_backend(ocr_pool_size)
+    if row_cache_size > 0:
+        worker_row_cache = RowCache(row_cache_size, row_cache_path)
+
+def worker_ready():
+    return worker_ocr is not None
+
+# read_screenshot
+# run all of the CPU-bound stages for one screenshot: find the rgb filter, mask
+# the image, and read the name rows and the power column. Errors are returned
+# rather than raised so that the caller can report them in order.
+# @param img, the bytes of an STFC roster screenshot, or a path to one
+# @param x_percent, what percentage of the width to ignore on the left
+# @return a dict with the filter, row text and power text, and any errors
+def read_screenshot(img, x_percent):
+    result = {"rgb": None, "error": None, "rows": None, "rows_error": None,
+        "power": None, "power_error": None, "filter_source": None, "row_cache": None}
+    if isinstance(img, bytes):
+        img = io.BytesIO(img)
+    im = Image.open(img)
+    try:
+        rgb, result["filter_source"] = pick_rgb_filter(im, worker_ocr.image_to_string)
+    except Exception as err:
+        result["error"] = str(err)
+        return result
+    if rgb is None:
+        return result
+    result["rgb"] = rgb
+
+    apply_img_mask(im, rgb, x_percent)
+    cache = worker_row_cache
+    hits, misses = (cache.hits, cache.misses) if cache is not None else (0, 0)
+    try:
+        result["rows"] = read_rows(get_name_rows(im), lambda stitched: worker_ocr.image_to_data(stitched, psm=6), cache)
+    except Exception as err:
+        result["rows_error"] = str(err)
+        result["rows"] = [""] * num_rows
+    if cache is not None:
+        result["row_cache"] = {"hits": cache.hits - hits, "misses": cache.misses - misses}
+
+    width, height = im.size
+    try:
+        result["power"] = worker_ocr.image_to_string(im.crop((math.floor(width/2), math.floor(height/10), width, height)))
+    except Exception as err:
+        result["power_error"] = str(err)
+    return result
+
+# ScreenshotWorkers
+# a pool of worker processes that read screenshots off the asyncio event loop.
+# At most queue_size screenshots are submitted at once; further uploads wait
+# for a free slot.
+class ScreenshotWorkers:
+
+    # @param num_workers, the number of worker processes
+    # @param queue_size, the maximum number of screenshots queued or in progress
+    # @param ocr_pool_size, the number of warm Tesseract engines per worker
+    # @param row_cache_size, the maximum number of name strips each worker caches
+    # @param row_cache_path, an sqlite file for the on-disk tier of the row cache, or None
+    def __init__(self, num_workers, queue_size, ocr_pool_size=1, row_cache_size=0, row_cache_path=None):
+        # the bot scripts start the bot at import, so the workers must be forked
+        # rather than spawned (which would re-run the script)
+        self.executor = ProcessPoolExecutor(max_workers=num_workers,
+            mp_context=multiprocessing.get_context("fork"),
+            initializer=init_worker, initargs=(ocr_pool_size, row_cache_size, row_cache_path))
+        self.queue_size = queue_size
+        self.slots = None
+
+    # start
+    # fork the worker processes now, before the discord client starts any threads
+    def start(self):
+        self.executor.submit(worker_ready).result()
+
+    # read_screenshot
+    # @return the result of read_screenshot(img, x_percent), computed in a worker
+    async def read_screenshot(self, img, x_percent):
+        if self.slots is None:
+            self.slots = asyncio.Semaphore(self.queue_size)
+        async with self.slots:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, read_screenshot, img, x_percent)
+
+    def shutdown(self):
+        self.executor.shutdown()
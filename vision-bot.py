@@ -10,20 +10,20 @@ import discord
 from discord.ext import commands
 from discord import Status
 
-import sqlite3
-from sqlite3 import Error
+import stfc_db
+import stfc_discord
 
-from PIL import Image
-import pytesseract
 import math
-from spellchecker import SpellChecker
+import stfc_vision
+import stfc_names
 
 import asyncio
 import aiohttp
-import aiofiles
 
 import datetime
 import re
+import json
+import hashlib
 
 import logging
 
@@ -31,57 +31,68 @@ import logging
 db_name = "LVE.db"
 token_file = "secret_vision.txt"
 x_percent = 0.12
-bot = commands.Bot(command_prefix='!')
-SPELL = SpellChecker(language=None, case_sensitive=False)
-SPELL.word_frequency.load_text_file("STFC_dict.txt")
+ocr_workers = 2
+ocr_queue_size = 8
+ocr_pool_size = 1
+attachment_fanout = 4
+http_pool_size = 8
+screenshot_cache_size = 500
+screenshot_cache_days = 7
+row_cache_size = 2000
+row_cache_file = "row_cache.db"
+name_snapshot_file = "names.snapshot"
+alliance_tier_days = 14
+db_read_pool_size = 4
+bot = stfc_discord.Bot(command_prefix='!')
+SPELL = None
+WORKERS = stfc_vision.ScreenshotWorkers(ocr_workers, ocr_queue_size, ocr_pool_size, row_cache_size, row_cache_file)
+HTTP_SESSION = None
+FILTER_STATS = {}   # how often each strategy of stfc_vision.find_rgb_filter supplied the filter, over every worker
 
 # -----------------------------------------------------------------------------
 #                        DATABASE CONNECTION SCRIPT
 # -----------------------------------------------------------------------------
-def create_connection(db_file):
-    """ create a database connection to the SQLite database
-        specified by the db_file
-    :param db_file: database file
-    :return: Connection object or None
-    """
-    try:
-        conn = sqlite3.connect(db_file)
-        logging.info("connected to " + db_file);
-        return conn
-    except Error as e:
-        logging.error(e, exc_info=True)
- 
-    return None
-
-conn = create_connection(db_name)
+DB = stfc_db.Database(db_name, db_read_pool_size)
 
 
 # -----------------------------------------------------------------------------
 #                                    FUNCTIONS
 # -----------------------------------------------------------------------------
-# add_name_to_alias
-# @param name, the name to add to the alias table
-def add_name_to_alias(name):
-    cur = conn.cursor()
-    sql = '''SELECT value FROM __state WHERE name="key"'''
-    logging.debug("SQL: " + sql)
-    cur.execute(sql)
-    key = cur.fetchone()[0]
-    sql = '''INSERT INTO alias (key, name) VALUES ("{}", "{}")'''.format(key, name.lower())
-    logging.debug("SQL: " + sql)
-    cur.execute(sql)
-    new_key = int(key) + 1
-    sql = '''UPDATE __state SET value={} WHERE name="key"'''.format(new_key)
-    logging.debug("SQL: " + sql)
-    cur.execute(sql)
-    return key
-
+# the fields of a stfc_vision.read_screenshot result that describe the OCR run
+# rather than the screenshot, and are left out of the cache
+uncached_fields = ("filter_source", "filter_stats", "row_cache")
+
+# get_cached_screenshot
+# @param digest, the sha256 hex digest of the screenshot bytes
+# @return the cached result of stfc_vision.read_screenshot, or None on a miss
+async def get_cached_screenshot(digest):
+    result = await DB.run_update(stfc_db.get_cached_screenshot, digest, datetime.datetime.now().isoformat())
+    if result is None:
+        return None
+    result = json.loads(result)
+    for field in uncached_fields:
+        result[field] = None # no OCR ran, so there is nothing to report
+    return result
+
+# cache_screenshot
+# remember what was read from a screenshot, then evict entries that have not been
+# used for screenshot_cache_days, and the least recently used entries beyond
+# screenshot_cache_size
+# @param digest, the sha256 hex digest of the screenshot bytes
+# @param result, the result of stfc_vision.read_screenshot
+async def cache_screenshot(digest, result):
+    if result["rgb"] is None or result["error"] or result["rows_error"] or result["power_error"]:
+        return # don't cache failures, they may be transient
+    now = datetime.datetime.now()
+    result = {field: value for field, value in result.items() if field not in uncached_fields}
+    await DB.run_update(stfc_db.cache_screenshot, digest, json.dumps(result), now.isoformat(),
+        (now - datetime.timedelta(days=screenshot_cache_days)).isoformat(), screenshot_cache_size)
+
+# add_name_to_dict
+# add a name to the in-memory dictionary; call it once the name is in the alias
+# table, which the dictionary is rebuilt from at startup
 async def add_name_to_dict(ctx, new_name):
-    # add incorrect name to dictionary
-    file = open("STFC_dict.txt", "ab")
-    name_utf8 = new_name.encode('UTF-8')
-    file.write(name_utf8 + "\n".encode('UTF-8'))
-    SPELL.word_frequency.load_words([new_name.lower()])
+    SPELL.add(new_name)
     #add_name_to_alias(old_name)
     msg = 'Added \'' + new_name + '\' to the dictionary'
     logging.info(msg)
@@ -96,94 +107,31 @@ def isImage(context, num):
             return True
     return False
 
+# get_http_session
+# @return the HTTP session shared by every download for the lifetime of the bot
+def get_http_session():
+    global HTTP_SESSION
+    if HTTP_SESSION is None or HTTP_SESSION.closed:
+        HTTP_SESSION = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=http_pool_size))
+    return HTTP_SESSION
+
 # getImage
 # @param url, a url to an image
-# fetch the image at the specified url and save it as 'latest.jpg'
+# @return the bytes of the image at the specified url
 async def getImage(url):
-    async with aiohttp.ClientSession() as session:
-        async with session.get(url) as resp:
-            f = await aiofiles.open('latest.jpg', mode='wb')
-            await f.write(await resp.read())
-            await f.close()
-
-# get_rgb_filter
-# @param im, the STFC roster screenshot to find appropriate filter values for
-# @returns rgb, a three-element list consisting of the rgb values for the filter
-async def get_rgb_filter(ctx, im):
-    width, height = im.size
-    rgb = [220, 220, 220]
-    for i in range(4):
-        im_rgb = im.crop((0, 0, width, math.floor(height/10)))
-        #logging.debug("trying r=" + str(rgb[0]), ", g=" + str(rgb[1]) + ", b=" + str(rgb[2]))
-        apply_img_mask(im_rgb, rgb, 0)
-        try:
-            word = pytesseract.image_to_string(im_rgb)
-        except Exception as err:
-            msg = "**[ERROR]** {0}".format(err)
-            logging.error(msg)
-            await ctx.send(msg)
-            return None
-
-        logging.debug("I read: " + word)
-        if (bool(re.search(r"MEMBERS", word))):
-            logging.debug("found a working filter! I see: " + word)
-            return rgb;
-        else:
-            rgb[0] -= 20
-            rgb[1] -= 20
-            rgb[2] -= 20
-    msg = "**[ERROR]** Unable to find a suitable rgb filter";
-    logging.error(msg)
-    await ctx.send(msg)
-    return None
-
-# apply_img_mask
-# @param im, the image to apply a mask to
-# @param rgb, a three-element list consisting of the rgb values for the mask threshold
-# @param x_percent, what percentage of the width to crop off from the right. Used to
-#        remove STFC rank symbols for premier, commodore, etc
-def apply_img_mask(im, rgb, x_percent):
-    pixdata = im.load()
-    width, height = im.size
-    x_cutoff = math.floor(width * x_percent)
-    for x in range(width):
-        for y in range(height):
-            pixel = im.getpixel((x,y))
-            r,g,b = pixel[0], pixel[1], pixel[2]
-            if r < rgb[0] or g < rgb[1] or b < rgb[2] or x < x_cutoff:
-                #out.putpixel((x,y), 0)
-                pixdata[x,y] = (255, 255, 255);
-            else:
-                pixdata[x,y] = (0,0,0,0)
+    async with get_http_session().get(url) as resp:
+        resp.raise_for_status()
+        return await resp.read()
 
 # process_name
-# @param im, an STFC roster screenshot
-# @param names_list, an empty list to populate with player names
-# @param level_list, an empty list to populate with player levels
+# @param text, the OCR text of one roster row
+# @param names_list, a list to append the player name to
+# @param level_list, a list to append the player level to
 # @return True if success, False if an error occurred
-async def process_name(ctx, im, names_list, level_list):
-    #width, height = im.size
-    #im_names = im.crop((0, math.floor(height/10), math.floor(width/2), height))
-    try:
-        text = pytesseract.image_to_string(im, config='--psm 7')
-    except Error as err:
-        msg = "**[ERROR]** {0}".format(err)
-        logging.error(msg)
-        await ctx.send(msg)
-        return False
-    booboo = re.search(r"[1-5][\]\)l] ", text)
-    if (bool(booboo)):
-        text = text[booboo.start()] + "1 " + text[booboo.end():]
-    match = re.search(r"[0-9]+ {1,3}\S", text)
-    if (bool(match)):
-        #text = re.sub(r'^\W+', '', text)
-        text = text[match.start():]
-        lv, name = re.split(' {1,3}', text, 1)
-        name = name.replace(" ", "_")
-        name = re.sub(r'^[0-9]+_', '', name)
-        heart_match = re.search(r"[a-zA-Z0-9]", name); # check for extra whitespace created by hearts
-        if (bool(heart_match)):
-            name = name[heart_match.start():] # handle extra whitespace created by hearts
+async def process_name(ctx, text, names_list, level_list):
+    parsed = stfc_vision.parse_name_line(text)
+    if parsed is not None:
+        lv, name = parsed
         level_list.append(lv)
         names_list.append(name)
         return True
@@ -191,293 +139,365 @@ async def process_name(ctx, im, names_list, level_list):
         #msg = "**[ERROR]** Unable to process image; cause: did not discover any data in the expected format"
         msg = "**[ERROR]** Unable to process line {}; cause: did not discover data in the expected format".format(text)
         logging.error(msg)
-        await ctx.send(msg)
+        ctx.post(msg)
         return False
 
+# get_alliance_index
+# @return a NameIndex of every name of the players seen in an alliance in the
+#         last alliance_tier_days days
+def get_alliance_index(conn, alliance):
+    since = (datetime.date.today() - datetime.timedelta(days=alliance_tier_days)).isoformat()
+    index = stfc_names.NameIndex()
+    index.load_words(stfc_db.get_alliance_names(conn, alliance, since))
+    return index
+
+# parse_number
+# @param value, a level or power as read from a screenshot, e.g. "1,234,567"
+# @return the value as an int, or None if it is not a number
+def parse_number(value):
+    try:
+        return int(str(value).replace(',', ''))
+    except ValueError:
+        return None
+
 # check_spelling
 # @param names_list, a list of player names to check the spelling of
-#         using the dictionary file 'STFC_dict.txt'
-async def check_spelling(ctx, names_list, mispelled):
-    
+#         against the names in the alias table
+# @param level_list, power_list, the level and power read for each name
+# @param tiers, a list of (tier name, NameIndex) to resolve names in, narrowest
+#         first; see stfc_names.resolve
+# @param tier_stats, a dict counting how the names were resolved
+# @param roster, roster_used, the previous roster of the alliance to match the
+#         names that cannot be resolved to by position, and the indexes into it
+#         matched so far this upload; see stfc_names.resolve_rows
+async def check_spelling(ctx, names_list, level_list, power_list, mispelled, tiers, tier_stats, roster, roster_used):
+
+    rows = []
+    for i in range(len(names_list)):
+        if (names_list[i] == "DELETE_ME"):
+            rows.append((None, None, None))
+            continue
+        lv = parse_number(level_list[i]) if i < len(level_list) else None
+        power = parse_number(power_list[i]) if i < len(power_list) else None
+        rows.append((names_list[i], lv, power))
+
+    resolved = stfc_names.resolve_rows(rows, tiers, roster, roster_used)
     for i in range(len(names_list)):
         if (names_list[i] == "DELETE_ME"):
             continue
         word = names_list[i]
 
-        if word in SPELL:
-            names_list[i] = word
-            logging.debug(word + " is spelled correctly!")
-        else:
-            cor = SPELL.correction(word)
-            if (cor != word):
-                logging.debug("Corrected '{}' to '{}'".format(word, cor))
-                names_list[i] = cor;
+        cor, tier, corrected = resolved[i]
+        if tier == "roster":
+            names_list[i] = cor
+            tier_stats[tier] = tier_stats.get(tier, 0) + 1
+            msg = "**[WARNING]** Unrecognized player name {} matched to {} by their place in the last roster uploaded".format(word, cor)
+            logging.warning(msg)
+            ctx.post(msg)
+        elif cor is not None:
+            names_list[i] = cor
+            stat = tier + " corrected" if corrected else tier
+            tier_stats[stat] = tier_stats.get(stat, 0) + 1
+            if corrected:
+                logging.debug("Corrected '{}' to '{}' ({})".format(word, cor, tier))
             else:
-                mispelled.append(word)
-                msg = "**[WARNING]** Unrecognized player name {}".format(word)
-                logging.warning(msg)
-                await ctx.send(msg)
-                names_list[i] = "DELETE_ME" + names_list[i]
-                continue
-
-def get_key (name):
-    cur = conn.cursor()
-    sql = '''SELECT key FROM alias WHERE name="{}"'''.format(name)
-    logging.debug('SQL: ' + sql)
-    cur.execute(sql)
-    value_list = cur.fetchone()
-    key = -1
-    if value_list is None:
-        key = add_name_to_alias(name)
-    else:
-        key = value_list[0]
-    return key
+                logging.debug(word + " is spelled correctly!")
+        else:
+            tier_stats["unrecognized"] = tier_stats.get("unrecognized", 0) + 1
+            mispelled.append(word)
+            msg = "**[WARNING]** Unrecognized player name {}".format(word)
+            logging.warning(msg)
+            ctx.post(msg)
+            names_list[i] = "DELETE_ME" + names_list[i]
+            continue
 
-# store_in_db
+# get_keys
+# @param names, a list of lowercase player names
+# @return a dict from each name to its player key, adding new names to the alias table
+def get_keys (conn, names):
+    keys = stfc_db.get_keys(conn, names)
+    for name in names:
+        if name not in keys:
+            keys[name] = stfc_db.add_name_to_alias(conn, name)
+    return keys
+
+# store_roster
+# check a roster against the database and write the accepted rows; all of the
+# reads and writes happen in the caller's transaction with a constant number of
+# queries
 # @param names_list, a list of player names
 # @param lv_list, a list of player levels
 # @param power_list, a list of player power
 # @param which alliance the roster screenshot belongs to
-async def store_in_db(ctx, names_list, lv_list, power_list, team, check_power):
-
-    cur = conn.cursor()
+# @return success_count, warn_count, power_err_count, and the messages to send
+def store_roster(conn, names_list, lv_list, power_list, team, check_power):
 
     success_count = 0;
     warn_count = 0;
     power_err_count = 0;
+    msgs = []
+    lve_rows = []
+    backlog_rows = []
+    today = datetime.datetime.now().strftime("%Y-%m-%d")
 
+    ## should name go into the LVE database or the backlog?
+    targets = []
     for i in range(0, len(names_list)):
-
-        ## should name go into the LVE database or the backlog?
-        target = ""
         if "DELETE_ME" in names_list[i]:
-            target="backlog"
+            targets.append("backlog")
             names_list[i] = names_list[i][9:] # remove "DELETE_ME" from the name string
         else:
-            target="LVE"
+            targets.append("LVE")
+    rows = [i for i in range(0, len(names_list)) if names_list[i] != "" and i < len(lv_list) and i < len(power_list)]
+
+    ## only names bound for the LVE table get a new key; an unrecognized name
+    ## keeps its key, if it has one, but does not get an alias of its own
+    keys = stfc_db.get_keys(conn, [names_list[i].lower() for i in rows if targets[i] == "backlog"])
+    keys.update(get_keys(conn, [names_list[i].lower() for i in rows if targets[i] == "LVE"]))
+    entered = stfc_db.get_entered_on(conn, list(keys.values()), today)
+    latest_power = stfc_db.get_latest_powers(conn, list(keys.values())) if check_power else {}
+
+    for i in rows:
+        target = targets[i]
+        key = keys.get(names_list[i].lower())
+
+        ## if data for this player has already been entered today, skip this player
+        if key in entered:
+            warn_count += 1
+            err_msg = "**[WARNING]** Data for player {} has already been entered today. Skipping this player...".format(names_list[i])
+            logging.warning(err_msg)
+            msgs.append(err_msg)
+            continue
 
-        if (names_list[i] == ""):
+        ## verify that both level and power are valid integers
+        try:
+            int(lv_list[i])
+        except ValueError as Err:
+            err_msg = "**[ERROR]** The level of player {} is \"{}\", which is not a number.".format(names_list[i], lv_list[i]);
+            logging.warning(err_msg, exc_info=True)
+            msgs.append(err_msg)
+            continue
+        try:
+            int(str(power_list[i]).replace(',', ''))
+        except ValueError as Err:
+            err_msg = "**[ERROR]** The power of player {} is \"{}\", which is not a number.".format(names_list[i], power_list[i]);
+            logging.warning(err_msg, exc_info=True)
+            msgs.append(err_msg)
             continue
 
-        if i < len(lv_list) and i < len(power_list):
-            key = get_key(names_list[i].lower())
-
-            ## if data for this player has already been entered today, skip this player
-            sql = '''SELECT * FROM LVE WHERE PlayerKey={} AND Date="{}"'''.format(key, datetime.datetime.now().strftime("%Y-%m-%d"))
-            logging.debug("SQL: " + sql)
-            cur.execute(sql)
-            value_list = cur.fetchone()
-            if value_list is not None:
-                warn_count += 1
-                err_msg = "**[WARNING]** Data for player {} has already been entered today. Skipping this player...".format(names_list[i])
+        ## confirm the power value is within the valid range!
+        if check_power and target=="LVE":
+            recent = latest_power.get(key)
+            if recent is None:
+                target = "backlog"
+                err_msg = "**[WARNING]** The player {} is new, please confirm that their power is {} by typing !confirm {}".format(names_list[i], power_list[i], names_list[i])
                 logging.warning(err_msg)
-                await ctx.send(err_msg)
-                continue
-
-            ## verify that both level and power are valid integers
-            try:
-                int(lv_list[i])
-            except ValueError as Err:
-                err_msg = "**[ERROR]** The level of player {} is \"{}\", which is not a number.".format(names_list[i], lv_list[i]);
-                logging.warning(err_msg, exc_info=True)
-                await ctx.send(err_msg)
-                continue
-            try:
-                int(str(power_list[i]).replace(',', ''))
-            except ValueError as Err:
-                err_msg = "**[ERROR]** The power of player {} is \"{}\", which is not a number.".format(names_list[i], power_list[i]);
-                logging.warning(err_msg, exc_info=True)
-                await ctx.send(err_msg)
-                continue
-
-            ## confirm the power value is within the valid range!
-            if check_power and target=="LVE":
-                sql = '''SELECT Power FROM LVE WHERE PlayerKey="{}" ORDER BY Date DESC LIMIT 1;'''.format(key, key, datetime.datetime.now().strftime("%Y-%m-%d"))
-                logging.debug("SQL: " + sql)
-                cur.execute(sql)
-                recent = cur.fetchone()
-                if recent is None or len(recent) == 0:
-                    target = "backlog"
-                    err_msg = "**[WARNING]** The player {} is new, please confirm that their power is {} by typing !confirm {}".format(names_list[i], power_list[i], names_list[i])
-                    logging.warning(err_msg)
-                    await ctx.send(err_msg)
-                    power_err_count += 1
-                else:
-                    try:
-                        power = int(str(power_list[i]).replace(',', ''))
-                        delta_power = (power - recent[0]) / power
-                        if (abs(delta_power) > 0.1):
-                            # second chance: try removing just the first digit
-                            tmp_power = str(power_list[i]).replace(',', '')
-                            power_list[i] = tmp_power[1:]
-                            power = int(tmp_power[1:])
-                            delta_power = (power - recent[0]) / power
-                        if (abs(delta_power) > 0.1):
-                            target = "backlog"
-                            err_msg = "**[WARNING]** The player {} has power {}, which seems wrong. If it is correct, please type !confirm {}".format(names_list[i], power_list[i], names_list[i])
-                            logging.warning(err_msg)
-                            await ctx.send(err_msg)
-                            power_err_count += 1
-
-                    except ValueError as err:
-                        #err_msg = "**[ERROR]** Cannot interpret the power of player {} as an integer; Power: {}".format(names_list[i], str(power_list[i]).replace(',', ''))
-                        err_msg = "**[ERROR]** {}".format(err)
-                        logging.warning(err_msg, exc_info=True)
-                        await ctx.send(err_msg)
-                        continue
-
-            ## store in the database
-            if (target == "LVE"):
-                sql = '''INSERT INTO LVE (PlayerKey, Date, Alliance, Lv, Power) VALUES ("{}", "{}", "{}", "{}", "{}")'''.format(key,
-                    datetime.datetime.now().strftime("%Y-%m-%d"),
-                    team,
-                    int(lv_list[i]),
-                    int(str(power_list[i]).replace(',', '')))
-                logging.debug("SQL: " + str(sql))
-                cur.execute(sql)
+                msgs.append(err_msg)
+                power_err_count += 1
             else:
-                #sql = '''INSERT INTO {} (Name, Date, Alliance, Lv, Power) VALUES ("{}", "{}", "{}", "{}", "{}")'''.format(target, names_list[i],
-                #    datetime.datetime.now().strftime("%Y-%m-%d"),
-                #    team,
-                #    int(lv_list[i]),
-                #    int(power_list[i].replace(',', '')))
-                await store_in_backlog((names_list[i], datetime.datetime.now().strftime("%Y-%m-%d"), team, lv_list[i], power_list[i]))
-
-            if target == "LVE":
-                success_count += 1
-                msg = "Name: " + names_list[i] + ", Lv: " + str(lv_list[i]) + ", Power: " + str(power_list[i])
-                logging.info(msg)
-                await ctx.send(msg)
-    conn.commit()
+                try:
+                    power = int(str(power_list[i]).replace(',', ''))
+                    delta_power = (power - recent) / power
+                    if (abs(delta_power) > 0.1):
+                        # second chance: try removing just the first digit
+                        tmp_power = str(power_list[i]).replace(',', '')
+                        power_list[i] = tmp_power[1:]
+                        power = int(tmp_power[1:])
+                        delta_power = (power - recent) / power
+                    if (abs(delta_power) > 0.1):
+                        target = "backlog"
+                        err_msg = "**[WARNING]** The player {} has power {}, which seems wrong. If it is correct, please type !confirm {}".format(names_list[i], power_list[i], names_list[i])
+                        logging.warning(err_msg)
+                        msgs.append(err_msg)
+                        power_err_count += 1
+
+                except ValueError as err:
+                    #err_msg = "**[ERROR]** Cannot interpret the power of player {} as an integer; Power: {}".format(names_list[i], str(power_list[i]).replace(',', ''))
+                    err_msg = "**[ERROR]** {}".format(err)
+                    logging.warning(err_msg, exc_info=True)
+                    msgs.append(err_msg)
+                    continue
+
+        ## store in the database
+        if (target == "LVE"):
+            lve_rows.append((key, today, team, int(lv_list[i]), int(str(power_list[i]).replace(',', ''))))
+            entered.add(key)
+            success_count += 1
+            msg = "Name: " + names_list[i] + ", Lv: " + str(lv_list[i]) + ", Power: " + str(power_list[i])
+            logging.info(msg)
+            msgs.append(msg)
+        else:
+            backlog_rows.append((names_list[i], today, team, lv_list[i], power_list[i]))
+
+    ## players who were last seen in another alliance leave its totals
+    left = [alliance for alliance in stfc_db.get_latest_alliances(conn, [row[0] for row in lve_rows]) if alliance != team]
+    stfc_db.insert_lve_rows(conn, lve_rows)
+    stfc_db.insert_backlog_rows(conn, backlog_rows)
+    if lve_rows:
+        stfc_db.update_alliance_growth(conn, team, today)
+    for alliance in left:
+        stfc_db.refresh_alliance_growth(conn, alliance)
+    return success_count, warn_count, power_err_count, msgs
+
+# store_in_db
+# store a roster in one transaction on the database writer thread, then queue
+# the messages
+async def store_in_db(ctx, names_list, lv_list, power_list, team, check_power):
+    success_count, warn_count, power_err_count, msgs = await DB.run_update(store_roster, names_list, lv_list, power_list, team, check_power)
+    for msg in msgs:
+        ctx.post(msg)
     return success_count, warn_count, power_err_count
 
+# add_alias
+# give the player called old_name the name new_name too, merging the two players
+# if new_name is already known
+# @return the key of old_name, or None if there is no such player
+def add_alias(conn, new_name, old_name):
+    old_name_key = stfc_db.get_key(conn, old_name.lower())
+    if old_name_key is not None:
+        # check if the new name already exists in the database
+        new_name_key = stfc_db.get_key(conn, new_name.lower())
+        if new_name_key is None:
+            stfc_db.add_alias(conn, old_name_key, new_name)
+        else:
+            stfc_db.merge_keys(conn, old_name_key, new_name_key)
+        stfc_db.set_alias_added(conn, new_name)
+    return old_name_key
+
 # func_alias
 # @param ctx, Discord msg context
 # @param new_name, player name string
 # @param old_name, player name string
+# @return the key of old_name, or None if there is no such player
 async def func_alias(ctx, new_name, old_name):
     logging.debug("Player " + str(ctx.message.author) + " running command \'alias\'")
 
     # add alias
-    cur = conn.cursor()
-    sql = '''SELECT key FROM alias WHERE name="{}"'''.format(old_name.lower())
-    logging.debug("SQL: " + sql)
-    cur.execute(sql)
-    value_list = cur.fetchone()
-    if value_list is None:
+    old_name_key = await DB.run_update(add_alias, new_name, old_name)
+    if old_name_key is None:
         #add_name_to_alias(args[0])
         msg = "**[ERROR]** The player \"" + old_name + "\" does not exist. Please add an alias using the format !alias <new_name> <old_name>"
         logging.error(msg)
         await ctx.send(msg)
     else:
-        old_name_key = value_list[0]
-        # check if the new name already exists in the database
-        sql = '''SELECT key FROM alias WHERE name="{}"'''.format(new_name.lower())
-        logging.debug("SQL: " + sql)
-        cur.execute(sql)
-        value_list_2 = cur.fetchone()
-        if value_list_2 is None:
-            sql = '''INSERT INTO alias (key, name) VALUES ("{}", "{}")'''.format(old_name_key, new_name.lower())
-            logging.debug("SQL: " + sql)
-            cur.execute(sql)
-        else:
-            new_name_key = value_list_2[0]
-            sql = '''UPDATE alias SET key={} WHERE key="{}"'''.format(old_name_key, new_name_key)
-            logging.debug("SQL: " + sql)
-            cur.execute(sql)
-            sql = '''UPDATE LVE SET PlayerKey={} WHERE PlayerKey="{}"'''.format(old_name_key, new_name_key)
-            logging.debug("SQL: " + sql)
-            cur.execute(sql)
-
-        conn.commit()
         msg = "Created alias {} for player {}".format(new_name, old_name)
         logging.info(msg)
         await ctx.send(msg)
-
-# store_in_backlog
-# @param player_data, a tuple containing name, date, alliance, lv, and power
-async def store_in_backlog(player_data):
-    cur = conn.cursor()
-    sql = '''INSERT INTO backlog (Name, Date, Alliance, Lv, Power) VALUES ("{}", "{}", "{}", "{}", "{}")'''.format(player_data[0].lower(), player_data[1], player_data[2], player_data[3], player_data[4]);
-    logging.debug('SQL: ' + sql)
-    cur.execute(sql)
+    return old_name_key
+
+# pop_backlog
+# @param names, a list of names to remove from the backlog
+# @return the backlog entries that were removed
+def pop_backlog(conn, names):
+    player_data = []
+    for name in names:
+        player_data_list = stfc_db.pop_backlog(conn, name)
+        if player_data_list is not None:
+            player_data.append(player_data_list)
+    return player_data
 
 # store_in_db_from_backlog
 # @param names, a list of names to restore from the backlog
 async def store_in_db_from_backlog(ctx, names, check_power):
     # Get a key for the new entry, or the key for the old name if the name is already in the database
-        cur = conn.cursor()
         names_list = []
         alliance = ""
         lv_list = []
         power_list = []
 
-        for name in names:
-            sql = '''SELECT * FROM backlog WHERE Name="{}"'''.format(name.lower())
-            logging.debug('SQL: ' + sql)
-            cur.execute(sql)
-            player_data_list = cur.fetchone()
-            if player_data_list is not None:
-                names_list.append(player_data_list[0])
-                alliance = player_data_list[2]
-                lv_list.append(player_data_list[3])
-                power_list.append(player_data_list[4])
-
-            sql = '''DELETE FROM backlog WHERE Name="{}"'''.format(name.lower())
-            logging.debug('SQL: ' + sql)
-            cur.execute(sql)
+        for player_data_list in await DB.run_update(pop_backlog, names):
+            names_list.append(player_data_list[0])
+            alliance = player_data_list[2]
+            lv_list.append(player_data_list[3])
+            power_list.append(player_data_list[4])
 
         await store_in_db(ctx, names_list, lv_list, power_list, alliance, check_power);
 
+# read_attachment
+# download one screenshot attachment into memory and read it
+# @param i, index of the attachment to read
+# @param slots, a semaphore limiting how many attachments are read at once
+# @return the result of stfc_vision.read_screenshot, None if the attachment is not an image,
+#         or the exception raised if it could not be downloaded or read
+async def read_attachment(ctx, i, slots):
+    if not isImage(ctx, i):
+        return None
+    async with slots:
+        try:
+            img_data = await getImage(ctx.message.attachments[i].url)
+            digest = hashlib.sha256(img_data).hexdigest()
+            result = await get_cached_screenshot(digest)
+            if result is not None:
+                logging.info("Attachment #{} is a duplicate of a screenshot read before; skipping OCR".format(i + 1))
+                return result
+            result = await WORKERS.read_screenshot(img_data, x_percent)
+            await cache_screenshot(digest, result)
+            return result
+        except Exception as e:
+            logging.error("failed to read attachment #{}".format(i + 1), exc_info=True)
+            return e
+
 # process_screenshot
 # @param i, index of the screenshot to process
+# @param result, the screenshot as read by read_attachment
+# @param tiers, tier_stats, roster, roster_used, see check_spelling
 # @return success_count, # of names successfully uploded to the LVE database
-async def process_screenshot(ctx, i, alliance_name, mispelled_list):
+async def process_screenshot(ctx, i, result, alliance_name, mispelled_list, tiers, tier_stats, roster, roster_used):
 
-    if not isImage(ctx, i):
+    if result is None:
         msg = '**[ERROR]** Attachment #{} is not an image. Please only submit images.'.format(i + 1)
         logging.error(msg)
-        await ctx.send(msg)
+        ctx.post(msg)
+        return 0, 0, 0
+    if isinstance(result, Exception):
+        msg = '**[ERROR]** Unable to read attachment #{}; cause: {}'.format(i + 1, result)
+        logging.error(msg)
+        ctx.post(msg)
         return 0, 0, 0
-    im_url = ctx.message.attachments[i].url
-    await getImage(im_url)
-    im = Image.open('latest.jpg')
     names_list = []
     level_list = []
     exclude = [0] * 7
-    rgb = await get_rgb_filter(ctx, im)
-    if rgb is None:
+    if result["error"] is not None:
+        msg = "**[ERROR]** {0}".format(result["error"])
+        logging.error(msg)
+        ctx.post(msg)
+    elif result["rgb"] is None:
+        msg = "**[ERROR]** Unable to find a suitable rgb filter";
+        logging.error(msg)
+        ctx.post(msg)
+    source = result.get("filter_source")
+    if source is not None:
+        FILTER_STATS[source] = FILTER_STATS.get(source, 0) + 1
+        logging.info("screenshot #{}: rgb filter from the {} strategy; since startup: {}".format(i + 1, source,
+            ", ".join("{} {}".format(stat, count) for stat, count in sorted(FILTER_STATS.items()))))
+    if result["rgb"] is None:
         msg = "**[ERROR]** Unable to process screenshot #{}; cause: failed to determine a suitable rgb filter".format(i + 1)
         logging.error(msg)
-        await ctx.send(msg)
+        ctx.post(msg)
         return 0, 0, 0
     else:
         msg = "Processing screenshot #{}:".format(i + 1)
         logging.info(msg)
-        await ctx.send(msg)
+        ctx.post(msg)
 
-    width, height = im.size
-    apply_img_mask(im, rgb, x_percent)
+    if result["rows_error"] is not None:
+        msg = "**[ERROR]** {0}".format(result["rows_error"])
+        logging.error(msg)
+        ctx.post(msg)
+    if result["row_cache"] is not None:
+        logging.info("screenshot #{}: row cache {} hits, {} misses".format(i + 1, result["row_cache"]["hits"], result["row_cache"]["misses"]))
+    row_text = result["rows"]
     for k in range(7):
-        a = 2 * height / 10
-        b = (( height - a) / 7 ) * k
-        c = (( height - a) / 7 ) * (k + 1)
-        im_names = im.crop((  0, math.floor( a + b ) , math.floor(width/2), math.floor( a + c ) ))
-        #tasks.append(process_image(ctx, im_names, names_list, level_list))
-        if not await process_name(ctx, im_names, names_list, level_list):
+        if not await process_name(ctx, row_text[k], names_list, level_list):
             exclude[k] = 1
 
-    await check_spelling(ctx, names_list, mispelled_list)
     power_list = []
-    im_power = im.crop((math.floor(width/2), math.floor(height/10), width, height))
-
-    try:
-        power = pytesseract.image_to_string(im_power)
-    except TesseractError as err:
-        msg = "**[ERROR]** {0}".format(err)
+    if result["power_error"] is not None:
+        msg = "**[ERROR]** {0}".format(result["power_error"])
         logging.error(msg)
-        await ctx.send(msg)
+        ctx.post(msg)
         return 0, 0, 0
+    power = result["power"]
 
     power_list = re.split(r"\n{1,2}", power)
     for i in range(len(power_list)):
@@ -490,13 +510,14 @@ async def process_screenshot(ctx, i, alliance_name, mispelled_list):
     if (len(power_list) != 7):
         msg = "**[ERROR]** {0}".format("Failed to detect a power value for at least one player. Skipping this screenshot...");
         logging.error(msg)
-        await ctx.send(msg)
+        ctx.post(msg)
         return 0, 0, 0
 
     new_power_list = []
     for i in range(7):
         if not exclude[i]:
             new_power_list.append(power_list[i])
+    await check_spelling(ctx, names_list, level_list, new_power_list, mispelled_list, tiers, tier_stats, roster, roster_used)
     success_count, warn_count, power_err_count = await store_in_db(ctx, names_list, level_list, new_power_list, alliance_name.lower(), True)
     return success_count, warn_count, power_err_count
 
@@ -530,28 +551,19 @@ async def ping(ctx):
     await ctx.send('pong')
 
 # add
-# writes any number of space delimited names into the dictonary file
+# adds any number of space delimited names to the alias table and the dictionary
 @bot.command(brief="Add a new player", description="Add a new player name to the dictionary. !add <player_name>")
 async def add(ctx):
     logging.debug("Player " + str(ctx.message.author) + " running command \'add\'")
     args = ctx.message.content[5:].split(' ')
-    file = open("STFC_dict.txt", "a")
     for arg in args:
-        '''file.write(arg + "\n")
-        #key = add_name_to_alias(arg)
-        msg = 'Added \'' + arg + '\' to the dictionary'
-        logging.info(msg)
-        await ctx.send(msg)'''
+        # Get a key for the new entry, or the key for the old name if the name is already in the database,
+        # and mark the name as added so that it is still known after a restart
+        key = await DB.run_update(stfc_db.add_known_name, arg.lower())
         await add_name_to_dict(ctx, arg)
 
-        # Get a key for the new entry, or the key for the old name if the name is already in the database
-        key = get_key(arg.lower())
-
-    #SPELL.word_frequency.load_words(args)
     await store_in_db_from_backlog(ctx, args, True);
 
-    file.close()
-
 # alliance
 # extracts data from the STFC screenshots attached to the user message
 # via image processing and attempts to store this data in the LVE database
@@ -567,29 +579,53 @@ async def alliance(ctx, alliance_name : str):
     else:
 
         # Delete any data currently stored in the backlog
-        del_backlog = '''DELETE FROM backlog WHERE alliance="{}"'''.format(alliance_name);
-        logging.debug("SQL: " + del_backlog)
-        conn.cursor().execute(del_backlog)
+        await DB.run_update(stfc_db.clear_backlog, alliance_name)
 
         mispelled_list = []
         success_count = 0
         already_uploaded_count = 0;
         failed_count = 0
         power_warn_count = 0;
-        for i in range(num_attachments):
-            try:
-                async with ctx.message.channel.typing():
-                    num_success, num_warn, num_power_warn = await process_screenshot(ctx, i, alliance_name, mispelled_list)
-            except UnicodeDecodeError:
-                msg = "**[ERROR]** The dictionary contains at least one non-unicode character"
-                logging.error(msg)
-                await ctx.send(msg)
-                return
-            success_count += num_success
-            already_uploaded_count += num_warn
-            power_warn_count += num_power_warn
-            failed_count += 7 - num_success - num_warn - num_power_warn
+
+        # resolve names among the players seen in this alliance first, then
+        # among every known player
+        alliance_index = await DB.run_query(get_alliance_index, alliance_name.lower())
+        tiers = [("alliance", alliance_index), ("global", SPELL)]
+        tier_stats = {}
+
+        # match the names that cannot be resolved to the players of the last
+        # roster uploaded by their place in it
+        today = datetime.datetime.now().strftime("%Y-%m-%d")
+        roster = await DB.run_query(stfc_names.load_previous_roster, alliance_name.lower(), today)
+        roster_used = set()
+
+        # download and OCR the attachments concurrently, but check spelling and
+        # store the results one screenshot at a time, in attachment order
+        slots = asyncio.Semaphore(attachment_fanout)
+        reads = [asyncio.ensure_future(read_attachment(ctx, i, slots)) for i in range(num_attachments)]
+        try:
+            for i in range(num_attachments):
+                try:
+                    async with ctx.message.channel.typing():
+                        result = await reads[i]
+                        num_success, num_warn, num_power_warn = await process_screenshot(ctx, i, result, alliance_name, mispelled_list, tiers, tier_stats, roster, roster_used)
+                except UnicodeDecodeError:
+                    msg = "**[ERROR]** The dictionary contains at least one non-unicode character"
+                    logging.error(msg)
+                    await ctx.send(msg)
+                    return
+                success_count += num_success
+                already_uploaded_count += num_warn
+                power_warn_count += num_power_warn
+                failed_count += 7 - num_success - num_warn - num_power_warn
+        finally:
+            for read in reads:
+                read.cancel()
         failed_count -= len(mispelled_list)
+        num_names = sum(tier_stats.values())
+        if num_names > 0:
+            logging.info("name resolution for {} ({} names, {} in the alliance tier, {} on the last roster): {}".format(alliance_name, num_names, len(alliance_index), len(roster),
+                ", ".join("{} {} ({:.0%})".format(stat, count, count / num_names) for stat, count in sorted(tier_stats.items()))))
         if len(mispelled_list) == 0:
             mispelled_msg = "No mispelled names"
         else:
@@ -638,8 +674,8 @@ async def correct(ctx, incorrect_name_spelling : str, correct_name_spelling : st
 
     # make the correct name an alias of the incorrect name
     if (incorrect_name_spelling.lower() != correct_name_spelling.lower()):
-        await add_name_to_dict(ctx, incorrect_name_spelling) # add incorrect name to dictionary
-        await func_alias(ctx, incorrect_name_spelling, correct_name_spelling) # create the alias
+        if await func_alias(ctx, incorrect_name_spelling, correct_name_spelling) is not None: # create the alias
+            await add_name_to_dict(ctx, incorrect_name_spelling) # add incorrect name to dictionary
         await store_in_db_from_backlog(ctx, [incorrect_name_spelling], True); # store the data in the backlog into the LVE db
     else:
         msg = "**[WARNING]** The old name and new names are the same, so the command was not run. Try using 'add' instead!"
@@ -660,24 +696,18 @@ async def confirm(ctx):
 # a given team, and lists the names still in the backlog
 @bot.command(brief="Show upload status", description="Show the daily upload status and backlog list for a team", aliases=["upload-status"])
 async def status(ctx, team : str):
-    cur = conn.cursor()
     logging.debug("Player " + str(ctx.message.author) + " running command \'status\'")
-    sql = '''SELECT COUNT(*) FROM LVE  WHERE Alliance="{}" AND Date="{}"'''.format(team.lower(), datetime.datetime.now().strftime("%Y-%m-%d"))
-    logging.debug('SQL: ' + sql)
-    cur.execute(sql)
-    num_data = cur.fetchone()
-    if num_data is not None and num_data[0] > 0:
-        sql = '''SELECT Name, Lv, Power FROM backlog WHERE Alliance="{}" AND Date="{}"'''.format(team.lower(), datetime.datetime.now().strftime("%Y-%m-%d"))
-        logging.debug('SQL: ' + sql)
-        cur.execute(sql)
-        player_data_list = cur.fetchall()
-        msg = "Successfully uploaded {} names. There are {} mispelled names in the backlog.".format(num_data[0], len(player_data_list))
+    today = datetime.datetime.now().strftime("%Y-%m-%d")
+    num_data = await DB.run_query(stfc_db.count_uploaded, team.lower(), today)
+    if num_data > 0:
+        player_data_list = await DB.run_query(stfc_db.get_backlog, team.lower(), today)
+        lines = ["Successfully uploaded {} names. There are {} mispelled names in the backlog.".format(num_data, len(player_data_list))]
         if player_data_list and len(player_data_list) > 0:
-            msg += "\nBACKLOG:\n"
+            lines.append("BACKLOG:")
             for row in player_data_list:
-                msg += "\tName: %s, Lv: %s, Power: %s\n" % (row[0], row[1], row[2])
-        logging.info(msg)
-        await ctx.send(msg)
+                lines.append("\tName: %s, Lv: %s, Power: %s" % (row[0], row[1], row[2]))
+        logging.info("\n".join(lines))
+        await ctx.send_lines(lines)
     else:
         msg = "No data has been uploaded for team {} today".format(team)
         logging.info(msg)
@@ -687,112 +717,40 @@ async def status(ctx, team : str):
 # list all guesses for the specified player ordered first by level and then by power
 @bot.command(brief="Guess the name in the backlog", description="Guess which player a name in the backlog belongs to")
 async def guess(ctx, player : str, limit=3):
-    cur = conn.cursor()
     logging.debug("Player " + str(ctx.message.author) + " running command \'guess\'")
-    sql = '''SELECT Count(*) FROM backlog WHERE name="{}"'''.format(player.lower())
-    cur.execute(sql)
-    res = cur.fetchone()
-    if res is None or len(res) == 0:
+    if await DB.run_query(stfc_db.count_backlog, player) == 0:
         msg = '''No such player is in the backlog'''
         logging.info(msg)
         await ctx.send(msg)
         return
 
-    sql = '''
-        SELECT Name, Lv, Power, Date FROM
-        (
-            SELECT IFNULL(E.Name, D.Name) AS Name, C.Date, C.Lv, C.Power, IFNULL (A.Power - B.Power, 0) AS Diff, IFNULL (A.Lv - B.Lv, 0) AS Lv_diff
-            FROM [backlog] A
-                INNER JOIN [LVE] C
-                    ON A.Alliance = C.Alliance
-                    AND julianday(C.Date) < julianday(A.Date)
-                    AND julianday(C.Date, '+7 days') > julianday(A.date)
-                INNER JOIN
-                (
-                    SELECT PlayerKey, MAX(Date) maxDate, Power, Lv
-                    FROM [LVE]
-                    GROUP BY PlayerKey
-                ) B ON C.PlayerKey = B.PlayerKey AND
-                    C.Date = B.maxDate
-            INNER JOIN
-            (
-                SELECT Name, key
-                FROM [alias]
-                GROUP BY key
-            ) D ON C.PlayerKey = D.Key
-            INNER JOIN
-            (
-                SELECT Name, key
-                FROM [display]
-                GROUP BY key
-            ) E ON C.PlayerKey = E.Key
-
-            WHERE A.Name = "{}"
-
-
-            ORDER BY ABS(Lv_diff), ABS(Diff) ASC
-        )
-        LIMIT "{}"
-        '''.format(player.lower(), limit)
-    logging.debug('SQL: ' + sql)
-    cur.execute(sql)
-    result = cur.fetchall()
-
-    msg = ""
+    result = await DB.run_query(stfc_db.guess_players, player, int(limit))
+
+    lines = []
     if result and len(result) > 0:
-        msg += "Guesses for %s:\n" % player
+        lines.append("Guesses for %s:" % player)
+    else:
+        lines.append("No guesses for %s" % player)
     for row in result:
-        msg += "\tName: {}, Lv: {}, Power: {}, Date: {}\n".format(row[0], row[1], row[2], row[3])
-    logging.info(msg)
-    await ctx.send(msg)
+        lines.append("\tName: {}, Lv: {}, Power: {}, Date: {}".format(row[0], row[1], row[2], row[3]))
+    logging.info("\n".join(lines))
+    await ctx.send_lines(lines)
 
 # missing
 # list all the players that have data in the last week, but no data for today
 @bot.command(brief="Find missing players", description="List all the players that have data in the last week, but no data for today")
 async def missing(ctx, team : str):
-    cur = conn.cursor()
-    sql = '''
-        SELECT Name, Lv, Power, Date FROM
-        (
-            SELECT IFNULL(D.Name, C.Name) AS Name, A.Date, A.Lv, A.Power
-            FROM [LVE] A
-            INNER JOIN
-            (
-                SELECT PlayerKey, MAX(Date) maxDate, Power, Lv
-                FROM [LVE]
-                WHERE julianday(Date, '+7 days') > julianday('now', 'localtime')
-                GROUP BY PlayerKey
-            ) B ON A.PlayerKey = B.PlayerKey AND
-                A.Date = B.maxDate AND
-                B.maxDate != date('now', 'localtime') AND
-                A.Alliance = "{}"
-            INNER JOIN
-            (
-                SELECT Name, key
-                FROM [alias]
-                GROUP BY key
-            ) C ON A.PlayerKey = C.Key
-            INNER JOIN
-            (
-                SELECT Name, key
-                FROM [display]
-                GROUP BY key
-            ) D ON A.PlayerKey = D.Key
-
-        )
-        ORDER BY Power DESC
-        '''.format(team.lower())
-    logging.debug('SQL: ' + sql)
-    cur.execute(sql)
-    result = cur.fetchall()
-
-    msg = ""
+    result = await DB.run_query(stfc_db.get_missing_players, team.lower())
+
+    lines = []
     if result and len(result) > 0:
-        msg += "Missing players from %s:\n" % team
+        lines.append("Missing players from %s:" % team)
+    else:
+        lines.append("No players are missing from %s" % team)
     for row in result:
-        msg += "\tName: {}, Lv: {}, Power: {}, Date: {}\n".format(row[0], row[1], row[2], row[3])
-    logging.info(msg)
-    await ctx.send(msg)
+        lines.append("\tName: {}, Lv: {}, Power: {}, Date: {}".format(row[0], row[1], row[2], row[3]))
+    logging.info("\n".join(lines))
+    await ctx.send_lines(lines)
 
 @bot.event
 async def on_ready():
@@ -808,6 +766,11 @@ async def on_command_error(ctx, error):
 #                                 MAIN SCRIPT
 # ------------------------------------------------------------------------------
 init_logger()
+stfc_db.migrate(DB.writer)
+with DB.write() as conn:
+    stfc_db.init_screenshot_cache(conn)
+SPELL = DB.query(stfc_names.load_alias_index, name_snapshot_file)
+WORKERS.start()
 f = open(token_file, "r")
 TOKEN = f.read()
 bot.run(TOKEN)
\ No newline at end of file
@@ -12,9 +12,12 @@
 import sqlite3                                   # sqlite3        - connects to the database
 from sqlite3 import Error
 from PIL import Image                            # PIL            - loads and preprocesses images
-import pytesseract                               # Tesseract OCR  - converts images to strings
+import stfc_ocr                                  # stfc_ocr       - converts images to strings with Tesseract OCR
 import math                                      # math           - performs basic math operations such as min/max
-from spellchecker import SpellChecker            # pyspellchecker - corrects player names using the dictionary
+import stfc_db                                   # stfc_db        - shared queries on the LVE database
+import stfc_names                                # stfc_names     - corrects player names using the dictionary
+import stfc_vision                               # stfc_vision    - shared screenshot masking and preprocessing
+from stfc_vision import apply_img_mask
 import re                                        # re             - handles regular expressions
 import datetime                                  # datetime       - gets the current date and time
 import argparse                                  # argparse       - process command line arguments
@@ -22,6 +25,7 @@ import argparse                                  # argparse       - process comm
 # MODIFIABLE PARAMTERS
 db_name = "test.db"
 x_percent = 0.12
+ocr_pool_size = 1
 
 # -----------------------------------------------------------------------------
 #                        DATABASE CONNECTION SCRIPT
@@ -41,6 +45,9 @@ def create_connection(db_file):
     return None
 
 conn = create_connection(db_name)
+if conn:
+    stfc_db.migrate(conn)
+OCR = stfc_ocr.create_backend(ocr_pool_size)
 
 # -----------------------------------------------------------------------------
 #                                    FUNCTIONS
@@ -53,83 +60,44 @@ def isImage(img_path):
     return img_path.lower().endswith(('.png', '.jpg', '.jpeg', '.tiff', '.bmp', '.gif'))
 
 # get_rgb_filter
-# guess image filters until you find one that works... you know that a filter
-# works when you can read the word "MEMBERS" on the alliance roster screenshot
+# derive a filter from the header histogram (or the last filter that worked for
+# this resolution) and confirm it by reading the word "MEMBERS" on the alliance
+# roster screenshot; falls back to guessing filters if that does not work
 # @param im, the STFC roster screenshot to find appropriate filter values for
 # @returns rgb, a three-element list consisting of the rgb values for the filter
 def get_rgb_filter(im):
-    width, height = im.size
-    rgb = [220, 220, 220]
-    for i in range(4):
-        im_rgb = im.crop((0, 0, width, math.floor(height/10)))
-        apply_img_mask(im_rgb, rgb, 0)
-        try:
-            word = pytesseract.image_to_string(im_rgb)
-        except TesseractError as err:
-            msg = "**[ERROR]** {0}".format(err)
-            print(msg)
-            return None
-
-        print("I read: " + word)
-        if (bool(re.search(r"MEMBERS", word))):
-            print("found a working filter! I see: " + word)
-            return rgb;
-        else:
-            rgb[0] -= 20
-            rgb[1] -= 20
-            rgb[2] -= 20
-    msg = "**[ERROR]** Unable to find a suitable rgb filter";
-    print(msg)
-    return None
+    try:
+        rgb = stfc_vision.find_rgb_filter(im, OCR.image_to_string)
+    except Exception as err:
+        msg = "**[ERROR]** {0}".format(err)
+        print(msg)
+        return None
+    print("rgb filter stats: {}".format(stfc_vision.FILTER_STATS))
+    if rgb is None:
+        msg = "**[ERROR]** Unable to find a suitable rgb filter";
+        print(msg)
+    else:
+        print("found a working filter! {}".format(rgb))
+    return rgb
 
-# apply_img_mask
-# modify the supplied image s.t. all pixel values below the threshold become white, and all
-# pixels above the threshold become black
-# @param im, the image to apply a mask to
-# @param rgb, a three-element list consisting of the rgb values for the mask threshold
-# @param x_percent, what percentage of the width to crop off from the right. Used to
-#        remove STFC rank symbols for premier, commodore, etc
-def apply_img_mask(im, rgb, x_percent):
-    pixdata = im.load()
-    width, height = im.size
-    x_cutoff = math.floor(width * x_percent)
-    for x in range(width):
-        for y in range(height):
-            r,g,b = im.getpixel((x,y))
-            if r < rgb[0] or g < rgb[1] or b < rgb[2] or x < x_cutoff:
-                #out.putpixel((x,y), 0)
-                pixdata[x,y] = (255, 255, 255);
-            else:
-                pixdata[x,y] = (0,0,0,0)
+# read_name_rows
+# read the name/level strip of every roster row with a single Tesseract call
+# @param im, a masked STFC roster screenshot
+# @return a list with the OCR text of each roster row
+def read_name_rows(im):
+    return stfc_vision.read_rows(stfc_vision.get_name_rows(im),
+        lambda stitched: OCR.image_to_data(stitched, psm=6))
 
 # process_name
-# extract player names and levels from a excerpt of an alliance roster
-# @param im, an STFC roster screenshot
-# @param names_list, an empty list to populate with player names
-# @param level_list, an empty list to populate with player levels
+# extract a player name and level from one line of an alliance roster
+# @param text, the OCR text of one roster row
+# @param names_list, a list to append the player name to
+# @param level_list, a list to append the player level to
 # @return True if success, False if an error occurred
-def process_name(im, names_list, level_list):
-    #width, height = im.size
-    #im_names = im.crop((0, math.floor(height/10), math.floor(width/2), height))
-    try:
-        text = pytesseract.image_to_string(im, config='--psm 7')
-    except Error as err:
-        msg = "**[ERROR]** {0}".format(err)
-        print(msg)
-        return False
-    booboo = re.search(r"[1-5][\]\)l] ", text)
-    if (bool(booboo)):
-        text = text[booboo.start()] + "1 " + text[booboo.end():]
-    match = re.search(r"[0-9]+ {1,3}\S", text)
-    if (bool(match)):
-        #text = re.sub(r'^\W+', '', text)
-        text = text[match.start():]
-        lv, name = re.split(' {1,3}', text, 1)
-        name = name.replace(" ", "_")
-        name = re.sub(r'^[0-9]+_', '', name)
-        heart_match = re.search(r"[a-zA-Z0-9]", name); # check for extra whitespace created by hearts
-        if (bool(heart_match)):
-            name = name[heart_match.start():] # handle extra whitespace created by hearts
+def process_name(text, names_list, level_list):
+    parsed = stfc_vision.parse_name_line(text)
+    if parsed is not None:
+        lv, name = parsed
         level_list.append(lv)
         names_list.append(name)
         return True
@@ -137,20 +105,14 @@ def process_name(im, names_list, level_list):
         #msg = "**[ERROR]** Unable to process image; cause: did not discover any data in the expected format"
         msg = "**[ERROR]** Unable to process line {}; cause: did not discover data in the expected format".format(text)
         print(msg)
-        #im.show()
         return False
 
 # load_dictionary
-# populate the spell checker frequency list from the database
-# @param spell_check, an instance of spell checker
+# populate the name index from the database with the same names as vision-bot:
+# the aliases of every player with an LVE entry or a display name
+# @param spell_check, a stfc_names.NameIndex
 def load_dictionary(spell_check):
-    cur = conn.cursor()
-    sql = '''SELECT name FROM alias WHERE active=1'''
-    cur.execute(sql)
-    word_list = []
-    for row in cur.fetchall():
-        word_list.append(row[0])
-    spell_check.word_frequency.load_words(word_list)
+    spell_check.load_words(name for rowid, name in stfc_db.get_player_alias_rows(conn, 0))
 
 # check_spelling
 # correct the player names in a list, and stash the names that cannot be corrected
@@ -232,6 +194,7 @@ def create_alias(new_name, old_name):
             sql = '''UPDATE main SET key={} WHERE key="{}"'''.format(old_name_key, new_name_key)
             print("SQL: " + sql)
             cur.execute(sql)
+        stfc_db.set_alias_added(conn, new_name)
 
         conn.commit()
         msg = "Created alias {} for player {}".format(new_name, old_name)
@@ -399,7 +362,7 @@ def store_in_db_from_backlog(names, check_power):
 # @param team, alliance name string
 # @param ss, list of STFC screenshot paths
 def upload(team, ss):
-    spell_checker = SpellChecker(language=None, case_sensitive=False)
+    spell_checker = stfc_names.NameIndex()
     load_dictionary(spell_checker)
 
     mispelled_list = []
@@ -429,12 +392,14 @@ def upload(team, ss):
         else:
             apply_img_mask(im, rgb, x_percent)
 
+            try:
+                row_text = read_name_rows(im)
+            except Exception as err:
+                msg = "**[ERROR]** {0}".format(err)
+                print(msg)
+                row_text = [""] * 7
             for k in range(7):
-                a = 2 * height / 10
-                b = (( height - a) / 7 ) * k
-                c = (( height - a) / 7 ) * (k + 1)
-                im_names = im.crop((  0, math.floor( a + b ) , math.floor(width/2), math.floor( a + c ) ))
-                if not process_name(im_names, names_list, level_list):
+                if not process_name(row_text[k], names_list, level_list):
                     exclude[k] = 1
             #im.show()
             check_spelling(spell_checker, names_list, mispelled_list)
@@ -443,8 +408,8 @@ def upload(team, ss):
             im_power = im.crop((math.floor(width/2), math.floor(height/10), width, height))
 
             try:
-                power = pytesseract.image_to_string(im_power)
-            except TesseractError as err:
+                power = OCR.image_to_string(im_power)
+            except Exception as err:
                 fail_count += 7;
                 msg = "**[ERROR]** {0}".format(err)
                 print(msg)
@@ -478,36 +443,13 @@ def upload(team, ss):
         failed_msg = "Unable to process {} names due to errors".format(failed_count)
 
 # add_player
-# adds a player to the dictionary/alias table if they do not exist, otherwise just
-# sets the alias table entry to active
+# adds a player to the alias table if they do not exist, and marks the name as
+# added by hand so that it is in the dictionary, as !add does in vision-bot
 # @param name, a player name string
 # @return key of the added player
 def add_player(name):
-    cur = conn.cursor()
-    sql = '''SELECT key FROM alias WHERE name="{}"'''.format(name.lower())
-    print("SQL: " + sql)
-    cur.execute(sql)
-    res = cur.fetchone()
-    if res:
-        sql = '''UPDATE alias SET active=1 WHERE key={}'''.format(res[0])
-        cur.execute(sql)
-        conn.commit()
-        msg = 'Re-added \'' + name + '\' to the dictionary'
-        print(msg)
-        return res[0]
-    # the player does not exist, add them
-    sql = '''SELECT value FROM __state WHERE name="key"'''
-    print("SQL: " + sql)
-    cur.execute(sql)
-    key = cur.fetchone()[0]
-    sql = '''INSERT INTO alias (key, name, date) VALUES ("{}", "{}", "{}")'''.format(key, name.lower(), datetime.datetime.now().strftime("%Y-%m-%d"))
-    print("SQL: " + sql)
-    cur.execute(sql)
-    new_key = int(key) + 1
-    sql = '''UPDATE __state SET value={} WHERE name="key"'''.format(new_key)
-    print("SQL: " + sql)
-    cur.execute(sql)
-    conn.commit()
+    with stfc_db.transaction(conn):
+        key = stfc_db.add_known_name(conn, name.lower())
     msg = 'Added \'' + name + '\' to the dictionary'
     print(msg)
     return key